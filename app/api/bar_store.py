@@ -0,0 +1,263 @@
+"""K 線（OHLCV）本地儲存：每個 (ticker, interval) 只在第一次完整回補，之後只抓最後一根之後的新 bar。
+
+資料放在 PostgreSQL price_bars 表（見 app/models/migrations.ensure_price_bars），
+price_bar_series 記錄每條序列用哪個 period 回補、最後一次對上游同步的時間。
+
+yfinance 預設回傳還原權值後的價格：除權息後舊 bar 會整段改變。
+增量更新時刻意與上次重疊一根已收盤的 bar，收盤價對不上就整段重抓，避免新舊價格混在同一條序列。
+
+函式皆為同步，於 asyncio.to_thread 內呼叫；下載上游時不持有 DB 連線。
+"""
+import pandas as pd
+import yfinance as yf
+from psycopg2.extras import execute_values
+
+from app.models.db import db_connection
+
+# 各 interval 回補的範圍：走勢圖的每個 range（以及 sparkline）都從這條序列切出來。
+# 比最長的 range 多抓一段，讓 MA120 在區間開頭就有值（1y 日 K 前面多一年、5y 週 K 多五年）。
+# 改了這裡，既有序列會在下次同步時依新範圍重新回補
+BACKFILL_PERIODS = {
+    "5m": "5d",
+    "15m": "1mo",
+    "1d": "2y",
+    "1wk": "10y",
+    "1mo": "max",
+}
+
+# 距上次同步不到這麼多秒就直接讀本地，不問上游
+_FRESH_SECONDS = {
+    "5m": 60,
+    "15m": 120,
+    "1d": 600,
+    "1wk": 3600,
+    "1mo": 6 * 3600,
+}
+
+# 分 K 只留最近一段，避免無限長大（以序列最後一根為基準）
+_RETENTION = {
+    "5m": pd.Timedelta(days=10),
+    "15m": pd.Timedelta(days=45),
+}
+
+# 重疊 bar 的收盤價相對誤差超過此值視為權值已重新還原
+_ADJUST_TOLERANCE = 1e-4
+
+_COLUMNS = ["Open", "High", "Low", "Close", "Volume"]
+
+
+def _empty_bars() -> pd.DataFrame:
+    return pd.DataFrame(columns=_COLUMNS, index=pd.DatetimeIndex([], name="ts"), dtype=float)
+
+
+def download(ticker: str, interval: str, period: str = None, start=None) -> pd.DataFrame:
+    """向 yfinance 下載並整理成 naive 當地時間 index 的 OHLCV。"""
+    if start is not None:
+        hist = yf.Ticker(ticker).history(start=start, interval=interval)
+    else:
+        hist = yf.Ticker(ticker).history(period=period, interval=interval)
+    return _tidy(hist)
+
+
+def download_many(tickers: list, interval: str, period: str) -> dict:
+    """一次 yf.download 取多支同一範圍的 bar，拆成 {ticker: bars}；取不到的代號不列入。"""
+    frame = yf.download(
+        list(tickers), period=period, interval=interval,
+        group_by="ticker", auto_adjust=True, progress=False,
+    )
+    result = {}
+    if frame is None or frame.empty:
+        return result
+    for ticker in tickers:
+        if isinstance(frame.columns, pd.MultiIndex):
+            if ticker not in frame.columns.get_level_values(0):
+                continue
+            hist = frame[ticker]
+        else:
+            hist = frame
+        bars = _tidy(hist)
+        if not bars.empty:
+            result[ticker] = bars
+    return result
+
+
+def _tidy(hist: pd.DataFrame) -> pd.DataFrame:
+    if hist is None or hist.empty:
+        return _empty_bars()
+    hist = hist.dropna(subset=["Close"])[_COLUMNS]
+    if hist.index.tz is not None:
+        hist.index = hist.index.tz_localize(None)
+    hist.index.name = "ts"
+    # 同一根 bar 可能重複出現（盤中最後一根），保留最新的那筆
+    return hist[~hist.index.duplicated(keep="last")]
+
+
+def _db_series_state(ticker: str, interval: str):
+    """回傳 (回補 period, 距上次同步秒數, 最後兩根 bar [(ts, close), ...]；序列不存在時為 None。"""
+    with db_connection() as conn:
+        cur = conn.cursor()
+        try:
+            cur.execute(
+                """SELECT period, EXTRACT(EPOCH FROM NOW() - refreshed_at)
+                   FROM price_bar_series WHERE ticker = %s AND bar_interval = %s""",
+                (ticker, interval),
+            )
+            row = cur.fetchone()
+            if row is None:
+                return None
+            cur.execute(
+                """SELECT ts, close FROM price_bars
+                   WHERE ticker = %s AND bar_interval = %s
+                   ORDER BY ts DESC LIMIT 2""",
+                (ticker, interval),
+            )
+            tail = list(reversed(cur.fetchall()))
+            return row[0], float(row[1]), tail
+        finally:
+            cur.close()
+
+
+def _db_write_bars(ticker: str, interval: str, period: str, bars: pd.DataFrame, replace: bool) -> None:
+    """寫入 bar 並更新序列狀態；replace 時先清掉整條序列（重新回補）。"""
+    with db_connection() as conn:
+        cur = conn.cursor()
+        try:
+            if replace:
+                cur.execute(
+                    "DELETE FROM price_bars WHERE ticker = %s AND bar_interval = %s",
+                    (ticker, interval),
+                )
+            if not bars.empty:
+                rows = [
+                    (ticker, interval, ts.to_pydatetime(),
+                     None if pd.isna(o) else float(o),
+                     None if pd.isna(h) else float(h),
+                     None if pd.isna(l) else float(l),
+                     float(c),
+                     0 if pd.isna(v) else int(v))
+                    for ts, o, h, l, c, v in bars.itertuples()
+                ]
+                execute_values(
+                    cur,
+                    """INSERT INTO price_bars
+                           (ticker, bar_interval, ts, open, high, low, close, volume)
+                       VALUES %s
+                       ON CONFLICT (ticker, bar_interval, ts) DO UPDATE SET
+                           open = EXCLUDED.open, high = EXCLUDED.high, low = EXCLUDED.low,
+                           close = EXCLUDED.close, volume = EXCLUDED.volume""",
+                    rows,
+                )
+            retention = _RETENTION.get(interval)
+            if retention is not None:
+                cur.execute(
+                    """DELETE FROM price_bars
+                       WHERE ticker = %s AND bar_interval = %s
+                         AND ts < (SELECT MAX(ts) FROM price_bars
+                                   WHERE ticker = %s AND bar_interval = %s) - %s""",
+                    (ticker, interval, ticker, interval, retention.to_pytimedelta()),
+                )
+            cur.execute(
+                """INSERT INTO price_bar_series (ticker, bar_interval, period, refreshed_at)
+                   VALUES (%s, %s, %s, NOW())
+                   ON CONFLICT (ticker, bar_interval) DO UPDATE SET
+                       period = EXCLUDED.period, refreshed_at = NOW()""",
+                (ticker, interval, period),
+            )
+            conn.commit()
+        finally:
+            cur.close()
+
+
+def _db_read_bars(ticker: str, interval: str) -> pd.DataFrame:
+    with db_connection() as conn:
+        cur = conn.cursor()
+        try:
+            cur.execute(
+                """SELECT ts, open, high, low, close, volume FROM price_bars
+                   WHERE ticker = %s AND bar_interval = %s ORDER BY ts""",
+                (ticker, interval),
+            )
+            rows = cur.fetchall()
+        finally:
+            cur.close()
+    if not rows:
+        return _empty_bars()
+    bars = pd.DataFrame.from_records(rows, columns=["ts"] + _COLUMNS, index="ts")
+    bars.index = pd.DatetimeIndex(bars.index, name="ts")
+    return bars.astype(float)
+
+
+def _adjustment_changed(fresh: pd.DataFrame, ts, close: float) -> bool:
+    """重疊的那根已收盤 bar 收盤價與本地不同 → 上游已重新還原權值。"""
+    if ts not in fresh.index:
+        return False
+    new_close = float(fresh.at[ts, "Close"])
+    return abs(new_close - close) > _ADJUST_TOLERANCE * max(abs(close), 1e-9)
+
+
+def sync(ticker: str, interval: str) -> None:
+    """讓本地序列追上上游：不存在或回補範圍改變時完整回補，否則只抓最後兩根 bar 之後的資料。"""
+    period = BACKFILL_PERIODS[interval]
+    state = _db_series_state(ticker, interval)
+    if state is not None:
+        stored_period, age, tail = state
+        if stored_period == period and tail:
+            if age < _FRESH_SECONDS[interval]:
+                return
+            # 從倒數第二根（已收盤）開始抓：最後一根可能是盤中未完成的 bar，需要覆寫
+            anchor_ts, anchor_close = tail[0]
+            fresh = download(ticker, interval, start=anchor_ts.strftime("%Y-%m-%d"))
+            if not _adjustment_changed(fresh, pd.Timestamp(anchor_ts), anchor_close):
+                _db_write_bars(ticker, interval, period, fresh, replace=False)
+                return
+            print(f"bar store 偵測到權值還原變動，重新回補: {ticker} {interval}")
+
+    bars = download(ticker, interval, period=period)
+    if bars.empty:
+        return
+    _db_write_bars(ticker, interval, period, bars, replace=True)
+
+
+def sync_many(tickers: list, interval: str) -> dict:
+    """多支一起同步並回傳 {ticker: 整條本地序列}。
+
+    本地已是新鮮的直接讀；其餘（不存在、回補範圍改變或過期）以一次 yf.download
+    完整回補，不再逐支增量抓。上游取不到的代號沿用本地舊資料（可能為空）。
+    """
+    period = BACKFILL_PERIODS[interval]
+    stale = []
+    for ticker in tickers:
+        state = _db_series_state(ticker, interval)
+        if state is None or state[0] != period or not state[2] or state[1] >= _FRESH_SECONDS[interval]:
+            stale.append(ticker)
+    if stale:
+        for ticker, bars in download_many(stale, interval, period).items():
+            _db_write_bars(ticker, interval, period, bars, replace=True)
+    return {ticker: _db_read_bars(ticker, interval) for ticker in tickers}
+
+
+def load(ticker: str, interval: str) -> pd.DataFrame:
+    """同步後回傳整條本地序列（欄位 Open/High/Low/Close/Volume，index 為當地時間）。"""
+    sync(ticker, interval)
+    return _db_read_bars(ticker, interval)
+
+
+def slice_period(bars: pd.DataFrame, period: str) -> pd.DataFrame:
+    """以 yfinance 的 period 語意從序列尾端切出一段。
+
+    "Nd" 取最後 N 個交易日（與 yfinance 一樣以有資料的日子計），
+    "Nmo"/"Ny" 以最後一根往前推日曆月/年，"max" 取全部。
+    """
+    if bars.empty or period == "max":
+        return bars
+    if period.endswith("mo"):
+        cutoff = bars.index[-1] - pd.DateOffset(months=int(period[:-2]))
+        return bars[bars.index > cutoff]
+    if period.endswith("y"):
+        cutoff = bars.index[-1] - pd.DateOffset(years=int(period[:-1]))
+        return bars[bars.index > cutoff]
+    if period.endswith("d"):
+        days = bars.index.normalize()
+        keep = days.unique()[-int(period[:-1]):]
+        return bars[days.isin(keep)]
+    raise ValueError(f"不支援的 period: {period}")
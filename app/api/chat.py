@@ -1,6 +1,7 @@
 from fastapi import APIRouter
 import aiohttp
 from app.core.config import settings
+from app.core.http import get_session
 from app.models.schemas import ChatRequest
 
 router = APIRouter(prefix="/api")
@@ -49,13 +50,13 @@ async def chat(request: ChatRequest):
         if not url.endswith("/chat/completions"):
             url += "/chat/completions"
 
-        async with aiohttp.ClientSession() as session:
-            async with session.post(url, headers=headers, json=data) as response:
-                result = await response.json(content_type=None)
+        session = get_session("deepseek")
+        async with session.post(url, headers=headers, json=data) as response:
+            result = await response.json(content_type=None)
 
-                if "choices" in result and len(result["choices"]) > 0:
-                    return {"response": result["choices"][0]["message"]["content"]}
+            if "choices" in result and len(result["choices"]) > 0:
+                return {"response": result["choices"][0]["message"]["content"]}
 
-                return {"response": "抱歉，我無法處理這個請求。"}
+            return {"response": "抱歉，我無法處理這個請求。"}
     except Exception as e:
         return {"response": f"發生錯誤: {str(e)}"}
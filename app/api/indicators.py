@@ -0,0 +1,83 @@
+"""走勢圖的技術指標：全部以 pandas 向量化計算，不在 Python 迴圈裡逐點算。
+
+每個指標是一個函式：吃收盤價 Series，回傳 {輸出欄位名: Series}（與收盤價同 index，
+暖機期為 NaN）。新增指標只要在 INDICATORS 註冊一筆，/history 的 indicators 參數即可取用。
+"""
+from functools import partial
+
+import pandas as pd
+
+
+def sma(close: pd.Series, window: int) -> dict:
+    return {f"ma{window}": close.rolling(window).mean()}
+
+
+def ema(close: pd.Series, span: int) -> dict:
+    # 前 span-1 點樣本不足，與 MA 一樣留空，避免畫出暖機期的失真線段
+    return {f"ema{span}": close.ewm(span=span, adjust=False, min_periods=span).mean()}
+
+
+def bollinger(close: pd.Series, window: int = 20, num_std: float = 2) -> dict:
+    mean = close.rolling(window).mean()
+    std = close.rolling(window).std(ddof=0)  # 母體標準差，與舊版純 Python 實作一致
+    return {"bb_upper": mean + num_std * std, "bb_lower": mean - num_std * std}
+
+
+def rsi(close: pd.Series, period: int = 14) -> dict:
+    """Wilder RSI。"""
+    delta = close.diff()
+    gain = delta.clip(lower=0).ewm(alpha=1 / period, adjust=False, min_periods=period).mean()
+    loss = (-delta.clip(upper=0)).ewm(alpha=1 / period, adjust=False, min_periods=period).mean()
+    value = 100 - 100 / (1 + gain / loss)
+    # 整段只漲不跌時 loss 為 0，RSI 依定義為 100
+    value = value.mask((loss == 0) & gain.notna(), 100.0)
+    return {f"rsi{period}": value}
+
+
+def macd(close: pd.Series, fast: int = 12, slow: int = 26, signal: int = 9) -> dict:
+    line = (close.ewm(span=fast, adjust=False).mean()
+            - close.ewm(span=slow, adjust=False).mean())
+    line = line.where(close.expanding().count() >= slow)
+    signal_line = line.ewm(span=signal, adjust=False, min_periods=signal).mean()
+    return {"macd": line, "macd_signal": signal_line, "macd_hist": line - signal_line}
+
+
+INDICATORS = {
+    "ma20": partial(sma, window=20),
+    "ma60": partial(sma, window=60),
+    "ma120": partial(sma, window=120),
+    "bb": partial(bollinger, window=20, num_std=2),
+    "ema12": partial(ema, span=12),
+    "ema26": partial(ema, span=26),
+    "rsi14": partial(rsi, period=14),
+    "macd": macd,
+}
+
+# /history 預設回傳的指標（前端走勢圖用到的）
+DEFAULT_INDICATORS = ("ma20", "ma60", "ma120", "bb")
+
+
+def compute(close: pd.Series, names) -> dict:
+    """計算多個指標，回傳 {輸出欄位名: Series}。未註冊的名稱略過。"""
+    out = {}
+    for name in names:
+        fn = INDICATORS.get(name)
+        if fn is not None:
+            out.update(fn(close))
+    return out
+
+
+def to_list(series: pd.Series, decimals: int = 4) -> list:
+    """四捨五入後轉成 JSON 可用的 list，NaN 轉 None。一次向量化完成。"""
+    rounded = series.astype(float).round(decimals)
+    return rounded.astype(object).where(rounded.notna(), None).tolist()
+
+
+def max_drawdown(close: pd.Series) -> float:
+    """區間最大回撤（%），以累積高點計算。"""
+    peak = close.cummax()
+    drawdown = (close - peak) / peak.where(peak > 0)
+    worst = drawdown.min()
+    if pd.isna(worst) or worst > 0:
+        return 0.0
+    return round(float(worst) * 100, 2)
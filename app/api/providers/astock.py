@@ -2,10 +2,13 @@ import aiohttp
 import re
 from datetime import datetime, timezone, timedelta
 
+from app.core.cache import TTLCache
+from app.core.http import get_session
+
 _HKT = timezone(timedelta(hours=8))
 
 # 公司名稱快取
-_name_cache = {}
+_name_cache = TTLCache("astock_name", maxsize=5000, ttl=24 * 3600)
 
 
 def _hk_market_state() -> str:
@@ -120,51 +123,91 @@ def _parse_cn(fields: list[str], ticker: str) -> dict | None:
         return None
 
 
-async def fetch_astock_quote(ticker: str) -> dict | None:
-    """從新浪財經取得港股 / A 股報價。回傳標準格式 dict 或失敗時回傳 None。"""
-    try:
-        sina_symbol = _ticker_to_sina(ticker)
-        if not sina_symbol:
-            print(f"AStock 無法解析代號: {ticker}")
-            return None
+# 新浪 list= 一次可帶多支（逗號分隔）；每批上限，避免 URL 過長被拒
+_MAX_SYMBOLS_PER_REQUEST = 200
 
-        url = f"https://hq.sinajs.cn/list={sina_symbol}"
-        headers = {"Referer": "https://finance.sina.com.cn"}
-
-        async with aiohttp.ClientSession() as session:
-            async with session.get(
-                url,
-                headers=headers,
-                timeout=aiohttp.ClientTimeout(total=10),
-            ) as resp:
-                if resp.status != 200:
-                    print(f"AStock 請求失敗: {ticker} status={resp.status}")
-                    return None
-                raw = await resp.read()
-
-        # 回應為 GBK 編碼
-        text = raw.decode("gbk", errors="replace")
-
-        # 解析格式: var hq_str_xxx="field0,field1,...";
-        match = re.search(r'"([^"]*)"', text)
-        if not match or not match.group(1):
-            print(f"AStock 回應為空: {ticker}")
-            return None
+# 一次比對整段回應的每一行：var hq_str_<symbol>="field0,field1,...";
+_HQ_LINE_RE = re.compile(r'var hq_str_(\w+)="([^"]*)"')
 
-        fields = match.group(1).split(",")
 
+def _parse_body(text: str, by_symbol: dict) -> dict:
+    """單次掃過整段回應，依前綴分派 _parse_hk / _parse_cn，回傳 {ticker: data}。
+
+    by_symbol 為 {新浪代號: [ticker, ...]}：0700.HK 與 700.hk 對到同一個 hk00700，各自回傳。
+    """
+    results = {}
+    for symbol, body in _HQ_LINE_RE.findall(text):
+        tickers = by_symbol.get(symbol)
+        if not tickers:
+            continue
+        if not body:
+            print(f"AStock 回應為空: {tickers[0]}")
+            continue
+        fields = body.split(",")
         # 根據前綴判斷解析方式
-        if sina_symbol.startswith("hk"):
-            result = _parse_hk(fields, ticker)
-        else:
-            result = _parse_cn(fields, ticker)
+        parse = _parse_hk if symbol.startswith("hk") else _parse_cn
+        for ticker in tickers:
+            result = parse(fields, ticker)
+            if result:
+                results[ticker] = result
+    return results
+
+
+async def _fetch_chunk(session: aiohttp.ClientSession, by_symbol: dict, chunk: list[str]) -> dict:
+    """以一次 hq.sinajs.cn 請求取一批代號，回傳 {ticker: data}（只含成功的）。"""
+    url = f"https://hq.sinajs.cn/list={','.join(chunk)}"
+    headers = {"Referer": "https://finance.sina.com.cn"}
+    try:
+        async with session.get(
+            url,
+            headers=headers,
+            timeout=aiohttp.ClientTimeout(total=10),
+        ) as resp:
+            if resp.status != 200:
+                print(f"AStock 請求失敗: {len(chunk)} 支 status={resp.status}")
+                return {}
+            raw = await resp.read()
+    except Exception as e:
+        print(f"AStock 批次請求異常: {len(chunk)} 支 {e}")
+        return {}
+
+    # 回應為 GBK 編碼，整段只解碼一次
+    text = raw.decode("gbk", errors="replace")
+    return _parse_body(text, {symbol: by_symbol[symbol] for symbol in chunk})
 
-        if result:
-            _name_cache[ticker] = result["company_name"]
-            print(f"AStock 取得報價成功: {ticker}")
 
-        return result
+async def fetch_astock_quotes(tickers: list[str]) -> dict:
+    """一次取多支港股 / A 股報價，回傳 {ticker: 標準格式 dict}；失敗的代號不在結果內。"""
+    by_symbol = {}
+    for ticker in tickers:
+        sina_symbol = _ticker_to_sina(ticker)
+        if not sina_symbol:
+            print(f"AStock 無法解析代號: {ticker}")
+            continue
+        by_symbol.setdefault(sina_symbol, []).append(ticker)
+    if not by_symbol:
+        return {}
+
+    symbols = list(by_symbol)
+    chunks = [
+        symbols[i:i + _MAX_SYMBOLS_PER_REQUEST]
+        for i in range(0, len(symbols), _MAX_SYMBOLS_PER_REQUEST)
+    ]
+    results = {}
+    session = get_session("sina")
+    for chunk in chunks:
+        results.update(await _fetch_chunk(session, by_symbol, chunk))
+
+    _name_cache.update({ticker: data["company_name"] for ticker, data in results.items()})
+    if results:
+        print(f"AStock 取得報價成功: {len(results)}/{sum(map(len, by_symbol.values()))} 支")
+    return results
+
 
+async def fetch_astock_quote(ticker: str) -> dict | None:
+    """從新浪財經取得港股 / A 股報價。回傳標準格式 dict 或失敗時回傳 None。"""
+    try:
+        return (await fetch_astock_quotes([ticker])).get(ticker)
     except Exception as e:
         print(f"AStock 取得報價異常: {ticker} {e}")
         return None
@@ -2,8 +2,19 @@ import aiohttp
 from datetime import datetime
 from zoneinfo import ZoneInfo
 
-# 快取公司名稱和 logo（很少變動，節省 API 呼叫）
-_company_cache = {}
+from app.core import shared_cache
+from app.core.cache import TTLCache
+from app.core.http import get_session
+from app.core.ratelimit import TokenBucket
+
+# 快取公司名稱和 logo：幾乎不變，快取一週並與其他 worker 共用，報價刷新時不必再花 token 查
+_company_cache = TTLCache("finnhub_company", maxsize=5000, ttl=7 * 24 * 3600, backend=shared_cache.backend)
+
+# Finnhub 免費方案 60 次/分：報價、公司資料與摘要用的新聞 / 財報全部共用這一個 bucket
+finnhub_bucket = TokenBucket("finnhub", rate=1.0, capacity=5)
+
+# 報價最多等 token 這麼多秒；等不到就回 None，由呼叫端改走 yfinance，不讓整批報價排隊等額度
+_QUOTE_TOKEN_WAIT_SECONDS = 2.0
 
 # 使用 IANA 時區，自動處理夏令/冬令（原本寫死 -4 會在冬令時錯 1 小時）
 _ET = ZoneInfo("America/New_York")
@@ -24,76 +35,84 @@ def _us_market_state() -> str:
 
 
 async def fetch_finnhub_quote(ticker: str, api_key: str) -> dict | None:
-    """從 Finnhub 取得美股報價。回傳標準格式 dict 或失敗時回傳 None。"""
+    """從 Finnhub 取得美股報價。回傳標準格式 dict 或失敗時回傳 None。
+
+    額度用盡（短時間內等不到 token）時也回 None。公司資料只在快取沒有、
+    且當下還有多餘 token 時才查，查不到就先留空，不與報價搶額度。
+    """
     try:
         base_url = "https://finnhub.io/api/v1"
         headers = {"X-Finnhub-Token": api_key}
 
-        async with aiohttp.ClientSession() as session:
-            # 取得報價
-            async with session.get(
-                f"{base_url}/quote",
-                params={"symbol": ticker},
-                headers=headers,
-                timeout=aiohttp.ClientTimeout(total=10),
-            ) as resp:
-                if resp.status != 200:
-                    print(f"Finnhub 報價請求失敗: {ticker} status={resp.status}")
-                    return None
-                quote = await resp.json()
-
-            # 檢查是否有有效價格（c=0 通常代表無效代號）
-            price = quote.get("c", 0)
-            if not price:
-                print(f"Finnhub 無有效報價: {ticker}")
+        session = get_session("finnhub")
+        # 取得報價
+        if not await finnhub_bucket.acquire(timeout=_QUOTE_TOKEN_WAIT_SECONDS):
+            print(f"Finnhub 額度用盡，改用 yfinance: {ticker}")
+            return None
+        async with session.get(
+            f"{base_url}/quote",
+            params={"symbol": ticker},
+            headers=headers,
+            timeout=aiohttp.ClientTimeout(total=10),
+        ) as resp:
+            if resp.status != 200:
+                print(f"Finnhub 報價請求失敗: {ticker} status={resp.status}")
                 return None
+            quote = await resp.json()
+
+        # 檢查是否有有效價格（c=0 通常代表無效代號）
+        price = quote.get("c", 0)
+        if not price:
+            print(f"Finnhub 無有效報價: {ticker}")
+            return None
+
+        prev_close = quote.get("pc", 0)
+        price_change = quote.get("d", 0)
+        price_change_percent = quote.get("dp", 0)
+
+        # 取得公司名稱和 logo（使用快取）
+        company_name = ""
+        logo_url = None
+
+        cached_profile = _company_cache.get(ticker)
+        if cached_profile is not None:
+            company_name = cached_profile.get("name", "")
+            logo_url = cached_profile.get("logo", None)
+        elif await finnhub_bucket.acquire(timeout=0):
+            try:
+                async with session.get(
+                    f"{base_url}/stock/profile2",
+                    params={"symbol": ticker},
+                    headers=headers,
+                    timeout=aiohttp.ClientTimeout(total=10),
+                ) as resp:
+                    if resp.status == 200:
+                        profile = await resp.json()
+                        company_name = profile.get("name", "")
+                        # Clearbit logo API 已停止服務，無備用 logo 來源；
+                        # 缺 logo 時前端會以彩色字母圖示替代
+                        logo_url = profile.get("logo", None)
+                        _company_cache.set(ticker, {
+                            "name": company_name,
+                            "logo": logo_url,
+                        })
+            except Exception as e:
+                print(f"Finnhub 公司資料請求失敗: {ticker} {e}")
 
-            prev_close = quote.get("pc", 0)
-            price_change = quote.get("d", 0)
-            price_change_percent = quote.get("dp", 0)
-
-            # 取得公司名稱和 logo（使用快取）
-            company_name = ""
-            logo_url = None
-
-            if ticker in _company_cache:
-                company_name = _company_cache[ticker].get("name", "")
-                logo_url = _company_cache[ticker].get("logo", None)
-            else:
-                try:
-                    async with session.get(
-                        f"{base_url}/stock/profile2",
-                        params={"symbol": ticker},
-                        headers=headers,
-                        timeout=aiohttp.ClientTimeout(total=10),
-                    ) as resp:
-                        if resp.status == 200:
-                            profile = await resp.json()
-                            company_name = profile.get("name", "")
-                            # Clearbit logo API 已停止服務，無備用 logo 來源；
-                            # 缺 logo 時前端會以彩色字母圖示替代
-                            logo_url = profile.get("logo", None)
-                            _company_cache[ticker] = {
-                                "name": company_name,
-                                "logo": logo_url,
-                            }
-                except Exception as e:
-                    print(f"Finnhub 公司資料請求失敗: {ticker} {e}")
-
-            return {
-                "ticker": ticker,
-                "price": price,
-                "prev_close": prev_close,
-                "price_change": price_change,
-                "price_change_percent": price_change_percent,
-                "company_name": company_name,
-                "logo_url": logo_url,
-                "market_state": _us_market_state(),
-                "extended_price": None,
-                "extended_type": None,
-                "extended_change": None,
-                "extended_change_percent": None,
-            }
+        return {
+            "ticker": ticker,
+            "price": price,
+            "prev_close": prev_close,
+            "price_change": price_change,
+            "price_change_percent": price_change_percent,
+            "company_name": company_name,
+            "logo_url": logo_url,
+            "market_state": _us_market_state(),
+            "extended_price": None,
+            "extended_type": None,
+            "extended_change": None,
+            "extended_change_percent": None,
+        }
 
     except Exception as e:
         print(f"Finnhub 取得報價異常: {ticker} {e}")
@@ -1,5 +1,8 @@
 import aiohttp
 from datetime import datetime, timezone, timedelta
+from urllib.parse import quote
+
+from app.core.http import get_session
 
 _TW = timezone(timedelta(hours=8))
 
@@ -41,92 +44,163 @@ def _ticker_to_ex_ch(ticker: str) -> str:
     return ""
 
 
-async def fetch_twse_quote(ticker: str) -> dict | None:
-    """從 TWSE 取得台股報價。回傳標準格式 dict 或失敗時回傳 None。"""
+# getStockInfo.jsp 的 ex_ch 以 "|" 串接多支代號；整串放在 query string，
+# 單次長度（URL 編碼後）壓在一般 URL 上限（約 2KB）之內，超過就切成多次請求
+_MAX_EX_CH_LEN = 1500
+# "|" 在 query string 內編碼成 %7C，佔三個字元
+_SEPARATOR_LEN = len(quote("|", safe=""))
+
+
+def _chunk_ex_ch(ex_chs: list[str]) -> list[list[str]]:
+    """把 ex_ch 清單切成串接並 URL 編碼後不超過 _MAX_EX_CH_LEN 的多批。"""
+    chunks = []
+    current = []
+    length = 0
+    for ex_ch in ex_chs:
+        encoded = len(quote(ex_ch, safe=""))
+        extra = encoded + (_SEPARATOR_LEN if current else 0)
+        if current and length + extra > _MAX_EX_CH_LEN:
+            chunks.append(current)
+            current = []
+            extra = encoded
+            length = 0
+        current.append(ex_ch)
+        length += extra
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def _parse_stock(stock: dict, ticker: str) -> dict | None:
+    """把 msgArray 內的一筆轉成標準格式 dict，無有效價格時回 None。"""
+    # 檢查是否為無效代號
+    if not stock.get("c") or stock.get("c") == "":
+        print(f"TWSE 無效代號: {ticker}")
+        return None
+
+    # 解析價格（z 可能是 "-" 表示尚未成交）
+    z = stock.get("z", "-")
+    y = stock.get("y", "-")
+
+    price = None
+    if z and z != "-":
+        price = float(z)
+    elif stock.get("pz") and stock["pz"] != "-":
+        # 試撮價格作為備用
+        price = float(stock["pz"])
+    else:
+        # TWSE 快照常無最新成交價（z="-"），改用最佳買賣盤中價估當前價，
+        # 避免 fallback 到延遲約 20 分鐘的 yfinance
+        bid = _first_quote(stock.get("b", ""))
+        ask = _first_quote(stock.get("a", ""))
+        if bid and ask:
+            price = round((bid + ask) / 2, 2)
+        elif bid:
+            price = bid
+        elif ask:
+            price = ask
+
+    prev_close = None
+    if y and y != "-":
+        prev_close = float(y)
+
+    if price is None or prev_close is None:
+        print(f"TWSE 無有效價格: {ticker} z={z} y={y}")
+        return None
+
+    price_change = price - prev_close
+    price_change_percent = (price_change / prev_close * 100) if prev_close else 0
+
+    company_name = stock.get("n", "")
+    # 台股 logo 透過 Clearbit 嘗試，但通常沒有，設為 None
+    logo_url = None
+
+    return {
+        "ticker": ticker,
+        "price": price,
+        "prev_close": prev_close,
+        "price_change": round(price_change, 4),
+        "price_change_percent": round(price_change_percent, 2),
+        "company_name": company_name,
+        "logo_url": logo_url,
+        "market_state": _tw_market_state(),
+        "extended_price": None,
+        "extended_type": None,
+        "extended_change": None,
+        "extended_change_percent": None,
+    }
+
+
+async def _fetch_chunk(session: aiohttp.ClientSession, by_ex_ch: dict, chunk: list[str]) -> dict:
+    """以一次 getStockInfo.jsp 請求取一批代號，回傳 {ticker: data}（只含成功的）。
+
+    by_ex_ch 為 {ex_ch 小寫: [ticker, ...]}：大小寫不同的同一代號（2330.TW / 2330.tw）只查一次、各自回傳。
+    """
+    lookup = {ex_ch.lower(): by_ex_ch[ex_ch.lower()] for ex_ch in chunk}
+    url = "https://mis.twse.com.tw/stock/api/getStockInfo.jsp"
+    params = {"ex_ch": "|".join(chunk), "json": "1", "delay": "0"}
     try:
+        async with session.get(
+            url,
+            params=params,
+            timeout=aiohttp.ClientTimeout(total=10),
+        ) as resp:
+            if resp.status != 200:
+                print(f"TWSE 請求失敗: {len(chunk)} 支 status={resp.status}")
+                return {}
+            data = await resp.json(content_type=None)
+    except Exception as e:
+        print(f"TWSE 批次請求異常: {len(chunk)} 支 {e}")
+        return {}
+
+    # 檢查回應結構
+    if data.get("rtcode") != "0000" or not data.get("msgArray"):
+        print(f"TWSE 回應異常: {len(chunk)} 支 rtcode={data.get('rtcode')}")
+        return {}
+
+    results = {}
+    for stock in data["msgArray"]:
+        # 回應順序不保證與請求相同，以 ex + c（上市/上櫃 + 代碼）對回原本的 Yahoo 代號
+        key = f"{stock.get('ex', '')}_{stock.get('c', '')}.tw".lower()
+        for ticker in lookup.get(key, ()):
+            try:
+                parsed = _parse_stock(stock, ticker)
+            except (ValueError, TypeError) as e:
+                print(f"TWSE 解析欄位錯誤: {ticker} {e}")
+                continue
+            if parsed:
+                results[ticker] = parsed
+    return results
+
+
+async def fetch_twse_quotes(tickers: list[str]) -> dict:
+    """一次取多支台股報價，回傳 {ticker: 標準格式 dict}；失敗或無效的代號不在結果內。
+
+    TWSE 限流嚴格，整個清單的台股合併成一到兩次請求，而不是每支各打一次。
+    """
+    by_ex_ch = {}
+    requested = {}  # ex_ch 小寫 → 實際送出的 ex_ch（第一次出現的寫法）
+    for ticker in tickers:
         ex_ch = _ticker_to_ex_ch(ticker)
         if not ex_ch:
             print(f"TWSE 無法解析代號: {ticker}")
-            return None
-
-        url = "https://mis.twse.com.tw/stock/api/getStockInfo.jsp"
-        params = {"ex_ch": ex_ch, "json": "1", "delay": "0"}
-
-        async with aiohttp.ClientSession() as session:
-            async with session.get(
-                url,
-                params=params,
-                timeout=aiohttp.ClientTimeout(total=10),
-            ) as resp:
-                if resp.status != 200:
-                    print(f"TWSE 請求失敗: {ticker} status={resp.status}")
-                    return None
-                data = await resp.json(content_type=None)
-
-        # 檢查回應結構
-        if data.get("rtcode") != "0000" or not data.get("msgArray"):
-            print(f"TWSE 回應異常: {ticker} rtcode={data.get('rtcode')}")
-            return None
-
-        stock = data["msgArray"][0]
-
-        # 檢查是否為無效代號
-        if not stock.get("c") or stock.get("c") == "":
-            print(f"TWSE 無效代號: {ticker}")
-            return None
-
-        # 解析價格（z 可能是 "-" 表示尚未成交）
-        z = stock.get("z", "-")
-        y = stock.get("y", "-")
-
-        price = None
-        if z and z != "-":
-            price = float(z)
-        elif stock.get("pz") and stock["pz"] != "-":
-            # 試撮價格作為備用
-            price = float(stock["pz"])
-        else:
-            # TWSE 快照常無最新成交價（z="-"），改用最佳買賣盤中價估當前價，
-            # 避免 fallback 到延遲約 20 分鐘的 yfinance
-            bid = _first_quote(stock.get("b", ""))
-            ask = _first_quote(stock.get("a", ""))
-            if bid and ask:
-                price = round((bid + ask) / 2, 2)
-            elif bid:
-                price = bid
-            elif ask:
-                price = ask
-
-        prev_close = None
-        if y and y != "-":
-            prev_close = float(y)
-
-        if price is None or prev_close is None:
-            print(f"TWSE 無有效價格: {ticker} z={z} y={y}")
-            return None
-
-        price_change = price - prev_close
-        price_change_percent = (price_change / prev_close * 100) if prev_close else 0
-
-        company_name = stock.get("n", "")
-        # 台股 logo 透過 Clearbit 嘗試，但通常沒有，設為 None
-        logo_url = None
-
-        return {
-            "ticker": ticker,
-            "price": price,
-            "prev_close": prev_close,
-            "price_change": round(price_change, 4),
-            "price_change_percent": round(price_change_percent, 2),
-            "company_name": company_name,
-            "logo_url": logo_url,
-            "market_state": _tw_market_state(),
-            "extended_price": None,
-            "extended_type": None,
-            "extended_change": None,
-            "extended_change_percent": None,
-        }
+            continue
+        requested.setdefault(ex_ch.lower(), ex_ch)
+        by_ex_ch.setdefault(ex_ch.lower(), []).append(ticker)
+    if not by_ex_ch:
+        return {}
 
+    results = {}
+    session = get_session("twse")
+    for chunk in _chunk_ex_ch(list(requested.values())):
+        results.update(await _fetch_chunk(session, by_ex_ch, chunk))
+    return results
+
+
+async def fetch_twse_quote(ticker: str) -> dict | None:
+    """從 TWSE 取得台股報價。回傳標準格式 dict 或失敗時回傳 None。"""
+    try:
+        return (await fetch_twse_quotes([ticker])).get(ticker)
     except Exception as e:
         print(f"TWSE 取得報價異常: {ticker} {e}")
         return None
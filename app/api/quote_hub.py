@@ -0,0 +1,102 @@
+"""報價推播中心：一次上游取價，扇出給所有訂閱該代號的串流連線。
+
+stock._store_quote 每寫入一筆報價就 publish 一次；只有欄位真的變了才會送到訂閱者，
+沒變的報價不佔頻寬。每個訂閱者只保留每支代號「最新一筆待送」，
+連線慢時舊值直接被新值覆蓋，不會越積越多。
+
+另外記錄哪些代號「有人在看」（有串流訂閱，或最近有報價請求），背景刷新只顧這些代號。
+"""
+import asyncio
+import time
+
+# 判斷「報價有沒有變」時比較的欄位
+_CHANGE_FIELDS = (
+    "price", "prev_close", "price_change", "price_change_percent",
+    "market_state", "extended_price", "extended_type",
+    "extended_change", "extended_change_percent", "company_name",
+)
+
+
+def _signature(data: dict) -> tuple:
+    return tuple(data.get(field) for field in _CHANGE_FIELDS)
+
+
+class Subscription:
+    def __init__(self, hub: "QuoteHub", tickers: set):
+        self._hub = hub
+        self.tickers = tickers
+        self._pending: dict = {}
+        self._event = asyncio.Event()
+
+    def _push(self, ticker: str, data: dict) -> None:
+        self._pending[ticker] = data
+        self._event.set()
+
+    async def next_batch(self, timeout: float) -> dict:
+        """等到有變動或逾時，回傳 {ticker: 報價}；逾時回空 dict。"""
+        try:
+            await asyncio.wait_for(self._event.wait(), timeout)
+        except asyncio.TimeoutError:
+            return {}
+        self._event.clear()
+        batch, self._pending = self._pending, {}
+        return batch
+
+    def close(self) -> None:
+        self._hub._unsubscribe(self)
+
+
+class QuoteHub:
+    def __init__(self):
+        self._subscribers: dict = {}  # ticker -> set[Subscription]
+        self._last: dict = {}         # ticker -> 上次推送的 _signature
+        self._requested: dict = {}    # ticker -> 最近一次報價請求的 monotonic 時間
+
+    def subscribe(self, tickers) -> Subscription:
+        sub = Subscription(self, set(tickers))
+        for ticker in sub.tickers:
+            self._subscribers.setdefault(ticker, set()).add(sub)
+        return sub
+
+    def _unsubscribe(self, sub: Subscription) -> None:
+        for ticker in sub.tickers:
+            subs = self._subscribers.get(ticker)
+            if not subs:
+                continue
+            subs.discard(sub)
+            if not subs:
+                # 沒人訂閱的代號不必記上次推送值
+                del self._subscribers[ticker]
+                self._last.pop(ticker, None)
+
+    def note_request(self, tickers) -> None:
+        """記下這些代號剛被請求過報價。"""
+        now = time.monotonic()
+        for ticker in tickers:
+            self._requested[ticker] = now
+
+    def active_tickers(self, window: float) -> set:
+        """有串流訂閱、或 window 秒內被請求過的代號；較舊的請求紀錄順手清掉。"""
+        cutoff = time.monotonic() - window
+        self._requested = {t: at for t, at in self._requested.items() if at >= cutoff}
+        return set(self._subscribers) | set(self._requested)
+
+    def publish(self, ticker: str, data: dict) -> None:
+        subs = self._subscribers.get(ticker)
+        if not subs:
+            return
+        sig = _signature(data)
+        if self._last.get(ticker) == sig:
+            return
+        self._last[ticker] = sig
+        for sub in subs:
+            sub._push(ticker, data)
+
+    def stats(self) -> dict:
+        return {
+            "tickers": len(self._subscribers),
+            "subscriptions": len({s for subs in self._subscribers.values() for s in subs}),
+        }
+
+
+quote_hub = QuoteHub()
@@ -0,0 +1,182 @@
+"""背景報價刷新：依自選股清單讓報價快取（stock.yahoo_cache）保持溫熱。
+
+原本只有瀏覽器輪詢 /stockprice 時才會去取報價，快取一過期，使用者就得等一整趟上游。
+改由背景工作依各市場的交易狀態定期刷新 watchlist_stocks 內「有人在看」的代號
+（有串流訂閱或 _ACTIVE_SECONDS 內有報價請求，見 quote_hub.active_tickers），
+使用者請求幾乎都直接命中快取，沒人開的清單不耗上游額度。刷新走 stock._fetch_quotes：
+與前端請求共用 single-flight，也照樣寫回快取與資料庫；
+Finnhub 請求都經過共用的 token bucket，刷新再密也不會超過免費方案的每分鐘上限。
+
+各 provider 一組、各自一個 task：美股排隊等 Finnhub 額度時不會拖住台股 3 秒一次的刷新。
+同一組上一批還沒回來就不排下一批，到期的代號等它回來後的下一輪再取。
+"""
+import asyncio
+import logging
+import time
+
+from app.api import stock
+from app.api.quote_hub import quote_hub
+from app.api.providers.astock import _cn_market_state, _hk_market_state
+from app.api.providers.finnhub import _us_market_state, finnhub_bucket
+from app.api.providers.twse import _tw_market_state
+
+logger = logging.getLogger(__name__)
+
+# 主迴圈每幾秒檢查一次哪些代號到期
+_TICK_SECONDS = 1
+# 每幾秒重新從資料庫讀一次自選股代號（新加入的股票最晚這麼久後開始刷新）
+_TICKER_RELOAD_SECONDS = 60
+# 最後一次報價請求後還刷新多久（沒有串流訂閱、只靠輪詢的頁面）
+_ACTIVE_SECONDS = 300
+
+# 各市場狀態的刷新間隔，皆略短於 stock._quote_ttl，讓快取在過期前就被換新
+_CADENCE = {
+    "REGULAR": 3,
+    "PRE": 10,
+    "POST": 10,
+    "CLOSED": 240,
+}
+# 只能走 yfinance 的代號（外匯、其他交易所、未設 Finnhub key 的美股）刷新放慢以免被限流
+_OTHER_CADENCE = 60
+# 背景刷新最多用掉 Finnhub bucket 速率的幾成，其餘留給使用者請求與摘要；
+# 有人在看的美股一多，間隔就依此拉長（例如 1 次/秒、一半額度、30 支 → 每支 60 秒一次）
+_FINNHUB_SHARE = 0.5
+
+_MARKET_STATE_FNS = {
+    "us": _us_market_state,
+    "tw": _tw_market_state,
+    "hk": _hk_market_state,
+    "cn": _cn_market_state,
+}
+
+
+def _market_of(ticker: str) -> str | None:
+    """代號所屬市場（對應 _MARKET_STATE_FNS）；無法判斷時回 None。"""
+    upper = ticker.upper()
+    if upper.endswith(".TW") or upper.endswith(".TWO"):
+        return "tw"
+    if upper.endswith(".HK"):
+        return "hk"
+    if upper.endswith(".SS") or upper.endswith(".SZ"):
+        return "cn"
+    if "." not in ticker and "=" not in ticker and "^" not in ticker:
+        return "us"
+    return None
+
+
+class QuoteRefresher:
+    def __init__(self):
+        self._task: asyncio.Task | None = None
+        self._tickers: list = []
+        self._tickers_loaded_at = float("-inf")
+        self._next_due: dict = {}
+        # 進行中的刷新：{provider: task}
+        self._inflight: dict = {}
+        self.active = 0
+        self.runs = 0
+        self.refreshed = 0
+        self.last_batch_ms: dict = {}  # 各 provider 最近一批的耗時
+
+    async def _reload_tickers(self) -> None:
+        try:
+            tickers = await asyncio.to_thread(stock._db_distinct_watchlist_tickers)
+        except Exception as e:
+            logger.error(f"背景報價刷新讀取自選股失敗: {e}")
+            return
+        self._tickers = tickers
+        self._tickers_loaded_at = time.monotonic()
+        # 已不在任何清單的代號不必再追蹤
+        keep = set(tickers)
+        self._next_due = {t: due for t, due in self._next_due.items() if t in keep}
+
+    def _cadence(self, ticker: str, states: dict, finnhub_floor: float) -> float:
+        market = _market_of(ticker)
+        provider = stock._quote_provider(ticker)
+        if market is None or provider == "yfinance":
+            return _OTHER_CADENCE
+        cadence = _CADENCE.get(states[market], _CADENCE["CLOSED"])
+        if market == "us" and provider == "finnhub":
+            cadence = max(cadence, finnhub_floor)
+        return cadence
+
+    async def _tick(self) -> None:
+        now = time.monotonic()
+        if now - self._tickers_loaded_at >= _TICKER_RELOAD_SECONDS:
+            await self._reload_tickers()
+
+        active = quote_hub.active_tickers(_ACTIVE_SECONDS)
+        tickers = [t for t in self._tickers if t in active]
+        self.active = len(tickers)
+
+        # Finnhub 逐支取價：N 支都要在額度內輪完一次。
+        # 同步給 stock，讓美股報價快取活得比刷新間隔久（見 stock._quote_ttl）
+        finnhub_count = sum(1 for t in tickers if _market_of(t) == "us" and stock._quote_provider(t) == "finnhub")
+        finnhub_floor = finnhub_count / (finnhub_bucket.rate * _FINNHUB_SHARE)
+        stock.finnhub_refresh_seconds = finnhub_floor
+
+        groups: dict = {}
+        for ticker in tickers:
+            if self._next_due.get(ticker, 0) <= now:
+                provider = stock._quote_provider(ticker)
+                if provider not in self._inflight:
+                    groups.setdefault(provider, []).append(ticker)
+        if not groups:
+            return
+
+        # 每一輪各市場狀態只算一次
+        states = {market: fn() for market, fn in _MARKET_STATE_FNS.items()}
+        for provider, due in groups.items():
+            for ticker in due:
+                self._next_due[ticker] = now + self._cadence(ticker, states, finnhub_floor)
+            task = asyncio.create_task(self._refresh(provider, due))
+            self._inflight[provider] = task
+            task.add_done_callback(lambda _, provider=provider: self._inflight.pop(provider, None))
+
+    async def _refresh(self, provider: str, tickers: list) -> None:
+        start = time.perf_counter()
+        try:
+            results = await stock._fetch_quotes(tickers)
+        except Exception as e:
+            logger.error(f"背景報價刷新失敗: {provider} {e}")
+            return
+        self.last_batch_ms[provider] = round((time.perf_counter() - start) * 1000, 1)
+        self.runs += 1
+        self.refreshed += sum(1 for data in results.values() if data)
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self._tick()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"背景報價刷新失敗: {e}")
+            await asyncio.sleep(_TICK_SECONDS)
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        tasks = [self._task, *self._inflight.values()]
+        for task in self._inflight.values():
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._task = None
+
+    def stats(self) -> dict:
+        return {
+            "running": self._task is not None and not self._task.done(),
+            "tickers": len(self._tickers),
+            "active": self.active,
+            "runs": self.runs,
+            "refreshed": self.refreshed,
+            "in_flight": sorted(self._inflight),
+            "last_batch_ms": dict(self.last_batch_ms),
+        }
+
+
+refresher = QuoteRefresher()
@@ -0,0 +1,234 @@
+"""盤中報價紀錄：把背景刷新取到的每筆盤中報價留下來，24h 走勢圖直接由自家資料畫出。
+
+stock_prices 每支只留最新一列，盤中取到的報價原本全被丟掉，24h 圖還得再向 yfinance 下載 5 分 K。
+改為 quote_writer 每次批次寫入時，把交易中（REGULAR）的報價附加到 quote_ticks：
+
+- quote_ticks 依台北日期分區（quote_ticks_pYYYYMMDD），過期的整個分區 DROP，不需大量 DELETE。
+- 已收盤的日子會降採樣成 5 分鐘 K 存進 quote_ticks_5m，保留較久。
+- 分區建立、降採樣、保留期清理由 main.py 的排程每日執行 maintain()。
+
+函式皆為同步，於 asyncio.to_thread 內呼叫。
+"""
+from datetime import date, datetime, timedelta
+from zoneinfo import ZoneInfo
+
+import pandas as pd
+from psycopg2 import sql
+from psycopg2.extras import execute_values
+
+from app.models.db import db_connection
+
+# 分區以台北日期切
+_PARTITION_TZ = ZoneInfo("Asia/Taipei")
+# 原始報價保留天數（之後只剩 5 分 K）
+RAW_RETENTION_DAYS = 3
+# 5 分 K 保留天數
+DOWNSAMPLED_RETENTION_DAYS = 90
+# 預先建立幾天後的分區，避免跨日寫入時分區還不存在
+PARTITION_DAYS_AHEAD = 2
+
+# 讀取 24h 走勢時往回看多久：要涵蓋前一個交易時段（週一要跨過週末）供指標暖機
+_LOOKBACK = timedelta(days=4)
+# 相鄰兩筆間隔超過此值視為不同交易時段（午休最長約 1.5 小時）
+_SESSION_GAP = pd.Timedelta(hours=3)
+# 最新交易時段的 5 分鐘格子至少要有這個比例有資料，才算記錄完整
+_MIN_FILL_RATIO = 0.8
+# 最新一筆比這更舊就不用自家資料（可能漏了整個交易時段，例如 app 停機）
+_MAX_STALENESS = timedelta(hours=20)
+
+_BUCKET_SQL = "date_bin('5 minutes', ts, TIMESTAMPTZ '2000-01-01 00:00:00+00')"
+
+# 代號後綴 → 交易所時區；走勢圖日期以交易所當地時間呈現（與 yfinance 一致）
+_EXCHANGE_TZ = {
+    ".TW": "Asia/Taipei",
+    ".TWO": "Asia/Taipei",
+    ".HK": "Asia/Hong_Kong",
+    ".SS": "Asia/Shanghai",
+    ".SZ": "Asia/Shanghai",
+}
+
+
+def _exchange_tz(ticker: str) -> str | None:
+    upper = ticker.upper()
+    for suffix, tz in _EXCHANGE_TZ.items():
+        if upper.endswith(suffix):
+            return tz
+    if "." not in ticker and "=" not in ticker and "^" not in ticker:
+        return "America/New_York"
+    return None
+
+
+def _partition_name(day: date) -> str:
+    return f"quote_ticks_p{day:%Y%m%d}"
+
+
+def _day_bounds(day: date) -> tuple:
+    start = datetime(day.year, day.month, day.day, tzinfo=_PARTITION_TZ)
+    return start, start + timedelta(days=1)
+
+
+def _db_insert_ticks(rows: list) -> None:
+    """批次附加報價紀錄：rows 為 [(ticker, ts, price), ...]。"""
+    with db_connection() as conn:
+        cur = conn.cursor()
+        try:
+            execute_values(cur, "INSERT INTO quote_ticks (ticker, ts, price) VALUES %s", rows)
+            conn.commit()
+        finally:
+            cur.close()
+
+
+def _partition_days(cur) -> list:
+    cur.execute(
+        """SELECT c.relname FROM pg_inherits i
+           JOIN pg_class c ON c.oid = i.inhrelid
+           JOIN pg_class p ON p.oid = i.inhparent
+           WHERE p.relname = 'quote_ticks'"""
+    )
+    days = []
+    for (name,) in cur.fetchall():
+        try:
+            days.append(datetime.strptime(name.removeprefix("quote_ticks_p"), "%Y%m%d").date())
+        except ValueError:
+            continue
+    return sorted(days)
+
+
+def _create_partition(cur, day: date) -> None:
+    start, end = _day_bounds(day)
+    cur.execute(
+        sql.SQL(
+            "CREATE TABLE IF NOT EXISTS {} PARTITION OF quote_ticks FOR VALUES FROM (%s) TO (%s)"
+        ).format(sql.Identifier(_partition_name(day))),
+        (start, end),
+    )
+
+
+def partition_day(ts: datetime) -> date:
+    """ts 落在哪一天的分區（台北日期）。"""
+    return ts.astimezone(_PARTITION_TZ).date()
+
+
+def ensure_partitions(days) -> None:
+    """補建缺少的分區（已存在的略過）。每日維護沒跑到、寫入時找不到分區時由 quote_writer 呼叫。"""
+    with db_connection() as conn:
+        cur = conn.cursor()
+        try:
+            for day in sorted(set(days)):
+                _create_partition(cur, day)
+            conn.commit()
+        finally:
+            cur.close()
+
+
+def _downsample_day(cur, day: date) -> None:
+    """把某天的原始報價彙整成 5 分 K（可重複執行）。"""
+    start, end = _day_bounds(day)
+    cur.execute(
+        f"""INSERT INTO quote_ticks_5m (ticker, ts, open, high, low, close, samples)
+            SELECT ticker, {_BUCKET_SQL} AS bucket,
+                   (array_agg(price ORDER BY ts))[1], MAX(price), MIN(price),
+                   (array_agg(price ORDER BY ts DESC))[1], COUNT(*)
+            FROM quote_ticks
+            WHERE ts >= %s AND ts < %s
+            GROUP BY ticker, bucket
+            ON CONFLICT (ticker, ts) DO UPDATE SET
+                open = EXCLUDED.open, high = EXCLUDED.high, low = EXCLUDED.low,
+                close = EXCLUDED.close, samples = EXCLUDED.samples""",
+        (start, end),
+    )
+
+
+def maintain(today: date | None = None) -> dict:
+    """每日維護：預建分區、已收盤的日子降採樣、清掉過期分區與過期 5 分 K。"""
+    today = today or datetime.now(_PARTITION_TZ).date()
+    report = {"created": [], "downsampled": [], "dropped": []}
+    with db_connection() as conn:
+        cur = conn.cursor()
+        try:
+            existing = set(_partition_days(cur))
+            for offset in range(PARTITION_DAYS_AHEAD + 1):
+                day = today + timedelta(days=offset)
+                if day not in existing:
+                    _create_partition(cur, day)
+                    report["created"].append(day.isoformat())
+
+            cutoff = today - timedelta(days=RAW_RETENTION_DAYS)
+            for day in sorted(existing):
+                if day >= today:
+                    continue
+                # 先降採樣再 DROP，確保資料不會在保留期之前就消失
+                _downsample_day(cur, day)
+                report["downsampled"].append(day.isoformat())
+                if day < cutoff:
+                    cur.execute(sql.SQL("DROP TABLE IF EXISTS {}").format(
+                        sql.Identifier(_partition_name(day))))
+                    report["dropped"].append(day.isoformat())
+
+            cur.execute(
+                "DELETE FROM quote_ticks_5m WHERE ts < NOW() - %s",
+                (timedelta(days=DOWNSAMPLED_RETENTION_DAYS),),
+            )
+            report["expired_5m_rows"] = cur.rowcount
+            conn.commit()
+        finally:
+            cur.close()
+    return report
+
+
+def _db_fetch_buckets(ticker: str, since: datetime) -> list:
+    """5 分鐘收盤價：原始報價即時彙整，與已降採樣的 5 分 K 合併（同一格以原始資料為準）。"""
+    with db_connection() as conn:
+        cur = conn.cursor()
+        try:
+            cur.execute(
+                f"""SELECT bucket, close FROM (
+                        SELECT {_BUCKET_SQL} AS bucket,
+                               (array_agg(price ORDER BY ts DESC))[1] AS close, 0 AS src
+                        FROM quote_ticks WHERE ticker = %s AND ts >= %s
+                        GROUP BY bucket
+                        UNION ALL
+                        SELECT ts, close, 1 FROM quote_ticks_5m WHERE ticker = %s AND ts >= %s
+                    ) b
+                    ORDER BY bucket, src""",
+                (ticker, since, ticker, since),
+            )
+            return cur.fetchall()
+        finally:
+            cur.close()
+
+
+def load_intraday_bars(ticker: str, now: datetime | None = None) -> pd.DataFrame | None:
+    """以自家報價紀錄組出近幾天的 5 分 K（Close/Volume，index 為交易所當地時間）。
+
+    最新交易時段的紀錄不夠完整時回 None，由呼叫端改向上游取：
+    需有更早的交易時段（表示開盤時已在記錄）、5 分鐘格子填滿率夠高、且最新一筆不太舊。
+    報價沒有成交量，Volume 一律為 0。
+    """
+    tz = _exchange_tz(ticker)
+    if tz is None:
+        return None
+    now = now or datetime.now(_PARTITION_TZ)
+    rows = _db_fetch_buckets(ticker, now - _LOOKBACK)
+    if not rows:
+        return None
+
+    close = pd.Series([float(c) for _, c in rows],
+                      index=pd.DatetimeIndex([pd.Timestamp(b) for b, _ in rows]))
+    close = close[~close.index.duplicated(keep="first")]
+    if now - close.index[-1].to_pydatetime() > _MAX_STALENESS:
+        return None
+
+    session = (close.index.to_series().diff() > _SESSION_GAP).cumsum()
+    if session.iloc[-1] == 0:
+        return None
+    latest = close[session == session.iloc[-1]]
+    expected = (latest.index[-1] - latest.index[0]) / pd.Timedelta(minutes=5) + 1
+    if len(latest) < expected * _MIN_FILL_RATIO:
+        return None
+
+    index = close.index.tz_convert(tz).tz_localize(None)
+    return pd.DataFrame(
+        {"Close": close.to_numpy(), "Volume": 0.0},
+        index=pd.DatetimeIndex(index, name="ts"),
+    )
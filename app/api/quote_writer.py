@@ -0,0 +1,241 @@
+"""報價 write-behind：stock_prices 的寫入移出請求路徑，集中批次 upsert。
+
+原本每取到一筆報價就在請求路徑上 await 一次 upsert（一筆一個交易），
+再用 10 分鐘的寫入時間戳擋掉過於頻繁的寫入。改為取到報價時只放進記憶體緩衝區
+（同一代號只留最新一筆），背景工作每隔幾秒把整批用一條 INSERT ... ON CONFLICT 寫入；
+app 關閉時 lifespan 會先把剩下的寫完。
+
+- 同一代號寫入 stock_prices 至少間隔 _MIN_WRITE_SECONDS：背景刷新每 3 秒就有新報價，
+  逐次 UPDATE 只是徒增寫入量；期間進來的報價留在緩衝區，間隔到了寫最新那筆（不會漏掉收盤價）。
+- 某一列資料本身有問題（代號超過 VARCHAR(20)、數值溢位）時整批會失敗，改逐列寫入，
+  只丟掉有問題的那幾列；quote_ticks 找不到當天分區（CheckViolation）不是資料問題，
+  補建分區後整批重試一次，不逐列；資料庫暫時連不上則放回緩衝區，同一代號連續失敗 _MAX_ATTEMPTS 次就丟掉
+  （報價會持續進來，丟掉的只是過時的那筆），不會讓一筆壞資料卡住之後所有寫入。
+
+同一批次也把交易中的報價附加到 quote_ticks（見 app/api/quote_ticks.py），供 24h 走勢圖使用。
+"""
+import asyncio
+import logging
+import time
+from datetime import datetime, timezone
+
+import psycopg2
+from psycopg2.extras import execute_values
+
+from app.api.quote_ticks import _db_insert_ticks, ensure_partitions, partition_day
+from app.models.db import db_connection
+
+logger = logging.getLogger(__name__)
+
+# 每幾秒寫一次
+_FLUSH_SECONDS = 5
+# 單一 INSERT 最多幾列（execute_values 的 page_size）
+_PAGE_SIZE = 500
+# 同一代號寫入 stock_prices 的最短間隔（盤中報價的完整紀錄在 quote_ticks）
+_MIN_WRITE_SECONDS = 60
+# 寫入失敗（非資料錯誤）幾次後放棄該筆
+_MAX_ATTEMPTS = 5
+# 這些錯誤代表資料本身寫不進去，重試也沒用
+_ROW_ERRORS = (psycopg2.DataError, psycopg2.IntegrityError)
+# 寫進分區表卻沒有對應分區（也是 IntegrityError）：整批都一樣，逐列寫只會每列都失敗
+_MISSING_PARTITION = psycopg2.errors.CheckViolation
+
+_UPSERT_STOCK_SQL = """
+    INSERT INTO stock_prices (
+        ticker, price, prev_close, price_change, price_change_percent,
+        company_name, logo_url, market_state, extended_price,
+        extended_type, extended_change, extended_change_percent,
+        updated_at
+    ) VALUES %s
+    ON CONFLICT (ticker) DO UPDATE SET
+        price = EXCLUDED.price,
+        prev_close = EXCLUDED.prev_close,
+        price_change = EXCLUDED.price_change,
+        price_change_percent = EXCLUDED.price_change_percent,
+        company_name = EXCLUDED.company_name,
+        logo_url = EXCLUDED.logo_url,
+        market_state = EXCLUDED.market_state,
+        extended_price = EXCLUDED.extended_price,
+        extended_type = EXCLUDED.extended_type,
+        extended_change = EXCLUDED.extended_change,
+        extended_change_percent = EXCLUDED.extended_change_percent,
+        updated_at = NOW();
+"""
+_UPSERT_TEMPLATE = "(%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, NOW())"
+
+
+def _db_upsert_stock_prices(quotes: list) -> None:
+    """一個交易內批次 upsert 多筆報價。同步操作，於 to_thread 內呼叫。"""
+    rows = [
+        (
+            data['ticker'], data['price'], data['prev_close'],
+            data['price_change'], data['price_change_percent'],
+            data.get('company_name', ''), data.get('logo_url'),
+            data.get('market_state', ''), data.get('extended_price'),
+            data.get('extended_type'), data.get('extended_change'),
+            data.get('extended_change_percent'),
+        )
+        for data in quotes
+    ]
+    with db_connection() as conn:
+        cur = conn.cursor()
+        try:
+            execute_values(cur, _UPSERT_STOCK_SQL, rows, template=_UPSERT_TEMPLATE, page_size=_PAGE_SIZE)
+            conn.commit()
+        finally:
+            cur.close()
+
+
+class QuoteWriter:
+    def __init__(self):
+        # ticker → 尚未寫入 stock_prices 的最新報價
+        self._pending: dict = {}
+        # ticker → (報價, 取得時間)：下一次 flush 要附加到 quote_ticks 的
+        self._ticks: dict = {}
+        self._attempts: dict = {}
+        self._last_written: dict = {}   # ticker → 上次寫入 stock_prices 的 monotonic 時間
+        self._task: asyncio.Task | None = None
+        self._lock = asyncio.Lock()
+        self.submitted = 0
+        self.flushes = 0
+        self.rows_written = 0
+        self.failures = 0
+        self.dropped = 0                # 資料有誤或重試用盡而丟棄的 stock_prices 列
+        self.ticks_written = 0
+        self.tick_failures = 0
+        self.last_flush_ms = 0.0
+
+    def submit(self, data: dict) -> None:
+        """排入待寫：同一代號只保留最新一筆。不碰資料庫，可在請求路徑上直接呼叫。"""
+        self._pending[data['ticker']] = data
+        self._ticks[data['ticker']] = (data, datetime.now(timezone.utc))
+        self.submitted += 1
+
+    async def _write_rows(self, write, rows: list, label: str) -> list:
+        """整批寫入，回傳寫入成功的列。資料錯誤時改逐列寫、丟掉寫不進去的列；其他錯誤照拋。"""
+        try:
+            await asyncio.to_thread(write, rows)
+            return rows
+        except _MISSING_PARTITION:
+            raise
+        except _ROW_ERRORS as e:
+            if len(rows) == 1:
+                logger.error(f"{label}資料有誤，丟棄: {rows[0]!r:.200} {e}")
+                return []
+        written = []
+        for row in rows:
+            written += await self._write_rows(write, [row], label)
+        return written
+
+    def _take_due(self, force: bool) -> dict:
+        now = time.monotonic()
+        self._last_written = {
+            t: at for t, at in self._last_written.items() if now - at < _MIN_WRITE_SECONDS
+        }
+        due = {
+            t: data for t, data in self._pending.items()
+            if force or t not in self._last_written
+        }
+        for ticker in due:
+            del self._pending[ticker]
+        return due
+
+    async def flush(self, force: bool = False) -> int:
+        """把到期（距上次寫入超過 _MIN_WRITE_SECONDS，force 時不限）的報價整批寫入，回傳寫入筆數。
+
+        寫入失敗時放回緩衝區（不覆蓋期間進來的較新報價）。
+        """
+        async with self._lock:
+            due = self._take_due(force)
+            ticks, self._ticks = self._ticks, {}
+            if not due and not ticks:
+                return 0
+            start = time.perf_counter()
+            written = []
+            if due:
+                try:
+                    written = await self._write_rows(_db_upsert_stock_prices, list(due.values()), "報價")
+                    self.dropped += len(due) - len(written)
+                except Exception as e:
+                    self.failures += 1
+                    logger.error(f"報價批次寫入失敗（{len(due)} 筆，稍後重試）: {e}")
+                    self._requeue(due)
+                now = time.monotonic()
+                for data in written:
+                    self._last_written[data['ticker']] = now
+                    self._attempts.pop(data['ticker'], None)
+            await self._write_ticks(ticks)
+            self.last_flush_ms = round((time.perf_counter() - start) * 1000, 1)
+            self.flushes += 1
+            self.rows_written += len(written)
+            return len(written)
+
+    def _requeue(self, batch: dict) -> None:
+        for ticker, data in batch.items():
+            attempts = self._attempts.get(ticker, 0) + 1
+            if attempts >= _MAX_ATTEMPTS:
+                self._attempts.pop(ticker, None)
+                self.dropped += 1
+                continue
+            self._attempts[ticker] = attempts
+            self._pending.setdefault(ticker, data)
+
+    async def _write_ticks(self, batch: dict) -> None:
+        """交易中的報價附加到 quote_ticks。只是紀錄用途：失敗只記 log，不重試也不影響 stock_prices。"""
+        rows = [
+            (ticker, fetched_at, float(data['price']))
+            for ticker, (data, fetched_at) in batch.items()
+            if data.get('market_state') == 'REGULAR' and data.get('price')
+        ]
+        if not rows:
+            return
+        try:
+            try:
+                written = await self._write_rows(_db_insert_ticks, rows, "報價紀錄")
+            except _MISSING_PARTITION as e:
+                # 每日維護沒跑到（或跨日前沒預建）：補建這批用到的分區，整批重試一次
+                days = {partition_day(fetched_at) for _, fetched_at, _ in rows}
+                logger.warning(f"報價紀錄分區不存在，補建後重試: {sorted(d.isoformat() for d in days)} {e}")
+                await asyncio.to_thread(ensure_partitions, days)
+                written = await self._write_rows(_db_insert_ticks, rows, "報價紀錄")
+            self.ticks_written += len(written)
+        except Exception as e:
+            self.tick_failures += 1
+            logger.error(f"報價紀錄寫入失敗（{len(rows)} 筆）: {e}")
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(_FLUSH_SECONDS)
+            await self.flush()
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """停止背景工作並把剩下的報價寫完。"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush(force=True)
+
+    def stats(self) -> dict:
+        return {
+            "running": self._task is not None and not self._task.done(),
+            "pending": len(self._pending),
+            "submitted": self.submitted,
+            "flushes": self.flushes,
+            "rows_written": self.rows_written,
+            "failures": self.failures,
+            "dropped": self.dropped,
+            "ticks_written": self.ticks_written,
+            "tick_failures": self.tick_failures,
+            "last_flush_ms": self.last_flush_ms,
+        }
+
+
+quote_writer = QuoteWriter()
@@ -1,32 +1,80 @@
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Query, Request
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+from typing import Callable, List
 import asyncio
+import hashlib
+import json
+import pandas as pd
 import yfinance as yf
 import yahooquery as yq
-from app.models.db import get_db_connection
+import psycopg2
+from app.models.db import db_connection
 from psycopg2.extras import RealDictCursor
 from datetime import datetime, timedelta
 from app.core.config import settings
+from app.core.http import get_session
+from app.core.cache import TTLCache
+from app.core import shared_cache
+from app.core.singleflight import SingleFlight
 from app.core.security import current_user_email
-from app.api.providers.finnhub import fetch_finnhub_quote
-from app.api.providers.twse import fetch_twse_quote
-from app.api.providers.astock import fetch_astock_quote
+from app.api import bar_store, indicators, quote_ticks
+from app.api.providers.finnhub import fetch_finnhub_quote, finnhub_bucket
+from app.api.providers.twse import fetch_twse_quotes
+from app.api.providers.astock import fetch_astock_quotes
+from app.api.quote_hub import quote_hub
+from app.api.quote_writer import quote_writer
+from app.api.symbol_index import symbol_index
+from app.api.watchlists import _db_fetch_watchlist_stocks
 
 router = APIRouter()
 
-# 記錄最後一次 upsert 的時間
-last_upsert_times = {}
+
+# 背景刷新（quote_refresher）目前多久輪完一次 Finnhub 美股；由刷新每一輪更新
+finnhub_refresh_seconds = 0.0
+# Finnhub 報價快取比刷新間隔多活這麼久（涵蓋等 token 與請求本身的時間）
+_FINNHUB_TTL_MARGIN = 5
+
+
+def _quote_ttl(data: dict) -> float:
+    """報價快取秒數：依該筆報價的市場狀態決定，配合前端的輪詢間隔。
+
+    走 Finnhub 的美股在看的人多時，背景刷新會被額度拉長到數十秒一次；
+    快取至少活到下一次刷新，否則過期後前端輪詢會各自打 Finnhub 搶同一份額度。
+    """
+    state = data.get('market_state', '')
+    if state == 'REGULAR':
+        ttl = 4  # <5s，配合前端 5 秒輪詢
+    elif state in ('PRE', 'POST'):
+        ttl = 12  # <15s，配合前端盤前/盤後 15 秒輪詢
+    else:
+        ttl = 300
+    ticker = data.get('ticker')
+    if finnhub_refresh_seconds and ticker and _quote_provider(ticker) == 'finnhub':
+        ttl = max(ttl, finnhub_refresh_seconds + _FINNHUB_TTL_MARGIN)
+    return ttl
+
+
+# 以下四個快取在 CACHE_BACKEND=sqlite 時多一層跨 worker 共用（見 app/core/shared_cache.py）
 
 # 記錄 Yahoo Finance 的快取
-yahoo_cache = {}
+yahoo_cache = TTLCache("quote", maxsize=5000, ttl_policy=_quote_ttl, backend=shared_cache.backend)
 
 # sparkline 走勢快取（變動慢，快取較久）
-sparkline_cache = {}
+sparkline_cache = TTLCache("sparkline", maxsize=2000, ttl=1800, backend=shared_cache.backend)
 
-# 歷史走勢快取（含 OHLCV + MA + MDD）
-history_cache = {}
+# 歷史走勢快取（含 OHLCV + MA + MDD）；單筆可達數百 KB，上限壓低
+history_cache = TTLCache("history", maxsize=500, ttl=1800, backend=shared_cache.backend)
 
 # 基本面快取（變動更慢）
-fundamentals_cache = {}
+fundamentals_cache = TTLCache("fundamentals", maxsize=2000, ttl=6 * 3600, backend=shared_cache.backend)
+
+# 快取未命中時的上游請求合併：同一個 key 同時只送一次
+quote_flight = SingleFlight("quote")
+sparkline_flight = SingleFlight("sparkline")
+history_flight = SingleFlight("history")
+bars_flight = SingleFlight("bars")
+fundamentals_flight = SingleFlight("fundamentals")
 
 
 async def _supplement_us_extended(ticker: str, data: dict) -> None:
@@ -73,155 +121,203 @@ async def get_logo_url(ticker: str) -> str | None:
     return None
 
 
-# ── DB 同步操作：在 async endpoint 內以 asyncio.to_thread 呼叫，避免阻塞 event loop ──
-
-_UPSERT_STOCK_SQL = """
-    INSERT INTO stock_prices (
-        ticker, price, prev_close, price_change, price_change_percent,
-        company_name, logo_url, market_state, extended_price,
-        extended_type, extended_change, extended_change_percent,
-        updated_at
-    ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, NOW())
-    ON CONFLICT (ticker) DO UPDATE SET
-        price = EXCLUDED.price,
-        prev_close = EXCLUDED.prev_close,
-        price_change = EXCLUDED.price_change,
-        price_change_percent = EXCLUDED.price_change_percent,
-        company_name = EXCLUDED.company_name,
-        logo_url = EXCLUDED.logo_url,
-        market_state = EXCLUDED.market_state,
-        extended_price = EXCLUDED.extended_price,
-        extended_type = EXCLUDED.extended_type,
-        extended_change = EXCLUDED.extended_change,
-        extended_change_percent = EXCLUDED.extended_change_percent,
-        updated_at = NOW();
-"""
-
-
-def _db_upsert_stock_price(data: dict) -> None:
-    conn = get_db_connection()
-    cur = conn.cursor()
-    try:
-        cur.execute(_UPSERT_STOCK_SQL, (
-            data['ticker'], data['price'], data['prev_close'],
-            data['price_change'], data['price_change_percent'],
-            data.get('company_name', ''), data.get('logo_url'),
-            data.get('market_state', ''), data.get('extended_price'),
-            data.get('extended_type'), data.get('extended_change'),
-            data.get('extended_change_percent'),
-        ))
-        conn.commit()
-    finally:
-        cur.close()
-        conn.close()
+def _cached_quote(ticker: str) -> dict | None:
+    """回傳仍在有效期內的快取報價；快取時間由 _quote_ttl 依市場狀態決定。"""
+    return yahoo_cache.get(ticker)
+
+
+def _quote_provider(ticker: str) -> str:
+    """依代號決定優先使用的 provider：twse / astock / finnhub / yfinance。"""
+    ticker_upper = ticker.upper()
+    if ticker_upper.endswith('.TW') or ticker_upper.endswith('.TWO'):
+        return 'twse'
+    if ticker_upper.endswith('.HK') or ticker_upper.endswith('.SS') or ticker_upper.endswith('.SZ'):
+        return 'astock'
+    # 外匯（=X）與指數（^）Finnhub 免費方案取不到，直接走 yfinance，不浪費 Finnhub 額度
+    if '.' not in ticker and '=' not in ticker and '^' not in ticker and settings.FINNHUB_API_KEY:
+        return 'finnhub'
+    return 'yfinance'
+
+
+def _fetch_yf_quote_sync(ticker: str) -> dict | None:
+    """yfinance 後備報價。於 to_thread 內執行（阻塞）。"""
+    print(f"使用 yfinance 取得報價: {ticker}")
+    info = yf.Ticker(ticker).info
+    if not info:
+        return None
+
+    current_price = info.get('regularMarketPrice', 0)
+    prev_close = info.get('previousClose', 0)
+    price_change = info.get('regularMarketChange', 0)
+    price_change_percent = info.get('regularMarketChangePercent', 0)
+
+    # 嘗試從不同可能的欄位獲取 logo URL（Clearbit 已停服，不再作為備源）
+    logo_url = info.get('logo_url') or info.get('logoUrl')
+
+    company_name = info.get('longName', '') or info.get('shortName', '')
+
+    # 獲取市場狀態和交易價格
+    market_state = info.get('marketState', '')
+    extended_price = None
+    extended_type = None
+    extended_change = None
+    extended_change_percent = None
+
+    # 處理盤前交易（漲跌對上一個正規收盤價 current_price，非更前一日 prev_close）
+    if market_state == 'PRE':
+        if 'preMarketPrice' in info and info['preMarketPrice']:
+            extended_price = float(info['preMarketPrice'])
+            extended_type = 'PRE_MARKET'
+            if current_price and extended_price:
+                extended_change = extended_price - current_price
+                extended_change_percent = (extended_change / current_price) * 100
+
+    # 處理盤後交易（包括已收盤狀態）
+    elif market_state in ['POST', 'POSTPOST', 'CLOSED']:
+        post_price = info.get('postMarketPrice')
+        if post_price and isinstance(post_price, (int, float)) and post_price > 0:
+            extended_price = float(post_price)
+            extended_type = 'POST_MARKET'
+            if current_price and extended_price:
+                extended_change = extended_price - current_price
+                extended_change_percent = (extended_change / current_price) * 100
+
+    return {
+        'ticker': ticker,
+        'price': current_price,
+        'prev_close': prev_close,
+        'price_change': price_change,
+        'price_change_percent': price_change_percent,
+        'company_name': company_name,
+        'logo_url': logo_url,
+        'market_state': market_state,
+        'extended_price': extended_price,
+        'extended_type': extended_type,
+        'extended_change': extended_change,
+        'extended_change_percent': extended_change_percent
+    }
+
+
+async def _fetch_provider_quote(ticker: str, provider: str) -> dict | None:
+    """透過逐支查詢的 provider（Finnhub）取得單支報價，失敗回 None。"""
+    if provider == 'finnhub':
+        # 美股（無後綴）→ 先試 Finnhub
+        print(f"嘗試 Finnhub 取得報價: {ticker}")
+        response_data = await fetch_finnhub_quote(ticker, settings.FINNHUB_API_KEY)
+        if response_data:
+            print(f"Finnhub 取得報價成功: {ticker}")
+        return response_data
+    return None
+
+
+async def _fetch_provider_group(provider: str, tickers: list) -> dict:
+    """同一 provider 的一組代號一起取，回傳 {ticker: data 或 None}。"""
+    if provider == 'yfinance':
+        return dict.fromkeys(tickers)
+    if provider == 'twse':
+        # 台股 → 整批一次打 TWSE（限流嚴格，不可逐支打）
+        print(f"嘗試 TWSE 取得報價: {len(tickers)} 支")
+        try:
+            quotes = await fetch_twse_quotes(tickers)
+        except Exception as e:
+            print(f"TWSE 批次取得報價異常: {e}")
+            quotes = {}
+        print(f"TWSE 取得報價成功: {len(quotes)}/{len(tickers)} 支")
+        return {t: quotes.get(t) for t in tickers}
+    if provider == 'astock':
+        # 港股 / A 股 → 整批一次打新浪財經
+        print(f"嘗試 AStock 取得報價: {len(tickers)} 支")
+        try:
+            quotes = await fetch_astock_quotes(tickers)
+        except Exception as e:
+            print(f"AStock 批次取得報價異常: {e}")
+            quotes = {}
+        return {t: quotes.get(t) for t in tickers}
+    results = await asyncio.gather(
+        *(_fetch_provider_quote(t, provider) for t in tickers),
+        return_exceptions=True,
+    )
+    return {t: (None if isinstance(r, BaseException) else r) for t, r in zip(tickers, results)}
+
+
+async def _complete_quote(ticker: str, response_data: dict | None) -> dict | None:
+    """補齊 provider 缺的欄位，provider 失敗時 fallback 到 yfinance。"""
+    # 美股經 Finnhub 取得時無盤前/盤後資料，於非交易時段補打 yfinance 取得
+    if (response_data is not None
+            and '.' not in ticker
+            and response_data.get('market_state') not in ('REGULAR', '')
+            and not response_data.get('extended_price')):
+        await _supplement_us_extended(ticker, response_data)
+
+    # 如果 provider 未取得資料，fallback 到 yfinance
+    if response_data is None:
+        response_data = await asyncio.to_thread(_fetch_yf_quote_sync, ticker)
+    if response_data is None:
+        return None
+
+    # 若 provider 未提供 logo（台股/港股/陸股），用 Google favicon 補上
+    if not response_data.get('logo_url'):
+        response_data['logo_url'] = await get_logo_url(ticker)
+    return response_data
+
+
+async def _store_quote(ticker: str, response_data: dict) -> None:
+    """更新快取、推送給串流訂閱者、排入 write-behind 緩衝區（由 quote_writer 批次寫入資料庫），
+    並把公司名稱收進搜尋索引。"""
+    yahoo_cache.set(ticker, response_data)
+    quote_hub.publish(ticker, response_data)
+    quote_writer.submit(response_data)
+    # 報價帶的公司名稱（台股多為中文）補進搜尋索引
+    if response_data.get('company_name'):
+        _index_symbol(ticker, response_data['company_name'])
+
+
+async def _fetch_quotes(tickers: list) -> dict:
+    """不看快取，取得一批報價並寫入快取，回傳 {ticker: data 或 None}。
+
+    已有其他請求正在取的代號直接等它的結果，不重複打上游。
+    """
+    return await quote_flight.do_many(tickers, _fetch_quotes_upstream)
+
+
+async def _fetch_quotes_upstream(tickers: list) -> dict:
+    """依 provider 分組向上游取得一批報價並寫入快取。
+
+    回傳 {ticker: data 或 None}。各組並行；單支失敗不影響其他代號。
+    """
+    groups = {}
+    for ticker in tickers:
+        groups.setdefault(_quote_provider(ticker), []).append(ticker)
+
+    fetched = {}
+    for group in await asyncio.gather(
+        *(_fetch_provider_group(provider, group) for provider, group in groups.items())
+    ):
+        fetched.update(group)
+
+    async def _finish(ticker: str) -> dict | None:
+        try:
+            data = await _complete_quote(ticker, fetched.get(ticker))
+            if data is not None:
+                await _store_quote(ticker, data)
+            return data
+        except Exception as e:
+            print(f"取得報價異常: {ticker} {e}")
+            return None
+
+    results = await asyncio.gather(*(_finish(t) for t in tickers))
+    return dict(zip(tickers, results))
 
 
 @router.get("/stockprice/{ticker}")
 async def get_stock_price(ticker: str, _: str = Depends(current_user_email)):
+    quote_hub.note_request([ticker])
     try:
-        current_time = datetime.now()
-        
-        # 根據上次市場狀態動態調整快取時間
-        if ticker in yahoo_cache:
-            cache_data = yahoo_cache[ticker]
-            time_diff = current_time - cache_data['timestamp']
-            last_state = cache_data['data'].get('market_state', '')
-            if last_state == 'REGULAR':
-                cache_ttl = timedelta(seconds=4)  # <5s，配合前端 5 秒輪詢
-            elif last_state in ('PRE', 'POST'):
-                cache_ttl = timedelta(seconds=12)  # <15s，配合前端盤前/盤後 15 秒輪詢
-            else:
-                cache_ttl = timedelta(minutes=5)
-            if time_diff < cache_ttl:
-                return cache_data['data']
-        
-        # 嘗試透過專用 provider 取得資料（Finnhub / TWSE），失敗則 fallback 到 yfinance
-        response_data = None
-        ticker_upper = ticker.upper()
-
-        if ticker_upper.endswith('.TW') or ticker_upper.endswith('.TWO'):
-            # 台股 → 先試 TWSE
-            print(f"嘗試 TWSE 取得報價: {ticker}")
-            response_data = await fetch_twse_quote(ticker)
-            if response_data:
-                print(f"TWSE 取得報價成功: {ticker}")
-        elif ticker_upper.endswith('.HK') or ticker_upper.endswith('.SS') or ticker_upper.endswith('.SZ'):
-            # 港股 / A 股 → 先試新浪財經
-            print(f"嘗試 AStock 取得報價: {ticker}")
-            response_data = await fetch_astock_quote(ticker)
-            if response_data:
-                print(f"AStock 取得報價成功: {ticker}")
-        elif '.' not in ticker and settings.FINNHUB_API_KEY:
-            # 美股（無後綴）→ 先試 Finnhub
-            print(f"嘗試 Finnhub 取得報價: {ticker}")
-            response_data = await fetch_finnhub_quote(ticker, settings.FINNHUB_API_KEY)
-            if response_data:
-                print(f"Finnhub 取得報價成功: {ticker}")
-
-        # 美股經 Finnhub 取得時無盤前/盤後資料，於非交易時段補打 yfinance 取得
-        if (response_data is not None
-                and '.' not in ticker
-                and response_data.get('market_state') not in ('REGULAR', '')
-                and not response_data.get('extended_price')):
-            await _supplement_us_extended(ticker, response_data)
-
-        # 如果 provider 未取得資料，fallback 到 yfinance
-        if response_data is None:
-            print(f"使用 yfinance 取得報價: {ticker}")
-            info = await asyncio.to_thread(lambda: yf.Ticker(ticker).info)
-
-            if info:
-                current_price = info.get('regularMarketPrice', 0)
-                prev_close = info.get('previousClose', 0)
-                price_change = info.get('regularMarketChange', 0)
-                price_change_percent = info.get('regularMarketChangePercent', 0)
-
-                # 嘗試從不同可能的欄位獲取 logo URL（Clearbit 已停服，不再作為備源）
-                logo_url = info.get('logo_url') or info.get('logoUrl')
-
-                company_name = info.get('longName', '') or info.get('shortName', '')
-
-                # 獲取市場狀態和交易價格
-                market_state = info.get('marketState', '')
-                extended_price = None
-                extended_type = None
-                extended_change = None
-                extended_change_percent = None
-
-                # 處理盤前交易（漲跌對上一個正規收盤價 current_price，非更前一日 prev_close）
-                if market_state == 'PRE':
-                    if 'preMarketPrice' in info and info['preMarketPrice']:
-                        extended_price = float(info['preMarketPrice'])
-                        extended_type = 'PRE_MARKET'
-                        if current_price and extended_price:
-                            extended_change = extended_price - current_price
-                            extended_change_percent = (extended_change / current_price) * 100
-
-                # 處理盤後交易（包括已收盤狀態）
-                elif market_state in ['POST', 'POSTPOST', 'CLOSED']:
-                    post_price = info.get('postMarketPrice')
-                    if post_price and isinstance(post_price, (int, float)) and post_price > 0:
-                        extended_price = float(post_price)
-                        extended_type = 'POST_MARKET'
-                        if current_price and extended_price:
-                            extended_change = extended_price - current_price
-                            extended_change_percent = (extended_change / current_price) * 100
-
-                # 準備回傳資料
-                response_data = {
-                    'ticker': ticker,
-                    'price': current_price,
-                    'prev_close': prev_close,
-                    'price_change': price_change,
-                    'price_change_percent': price_change_percent,
-                    'company_name': company_name,
-                    'logo_url': logo_url,
-                    'market_state': market_state,
-                    'extended_price': extended_price,
-                    'extended_type': extended_type,
-                    'extended_change': extended_change,
-                    'extended_change_percent': extended_change_percent
-                }
+        cached = _cached_quote(ticker)
+        if cached is not None:
+            return cached
+
+        response_data = (await _fetch_quotes([ticker]))[ticker]
 
         # 如果所有來源都未取得資料
         if response_data is None:
@@ -229,32 +325,6 @@ async def get_stock_price(ticker: str, _: str = Depends(current_user_email)):
                 'error': '無法獲取股票資訊',
                 'ticker': ticker
             }
-
-        # 若 provider 未提供 logo（台股/港股/陸股），用 Google favicon 補上
-        if not response_data.get('logo_url'):
-            response_data['logo_url'] = await get_logo_url(ticker)
-
-        # 更新快取
-        yahoo_cache[ticker] = {
-            'timestamp': current_time,
-            'data': response_data
-        }
-
-        # 檢查是否需要更新資料庫
-        should_update_db = True
-        if ticker in last_upsert_times:
-            time_diff = current_time - last_upsert_times[ticker]
-            if time_diff < timedelta(minutes=10):
-                should_update_db = False
-
-        # 如果需要更新資料庫
-        if should_update_db:
-            try:
-                await asyncio.to_thread(_db_upsert_stock_price, response_data)
-                last_upsert_times[ticker] = current_time
-            except Exception as db_error:
-                print(f"資料庫更新錯誤: {str(db_error)}")
-
         return response_data
     except Exception as e:
         return {
@@ -262,6 +332,100 @@ async def get_stock_price(ticker: str, _: str = Depends(current_user_email)):
             'ticker': ticker
         }
 
+
+# 單次批次報價的代號上限（一個清單通常幾十支，上限只為擋異常請求）
+MAX_BATCH_TICKERS = 200
+
+
+class StockPricesRequest(BaseModel):
+    tickers: List[str]
+
+
+async def _quotes_for(tickers: list) -> dict:
+    """一批代號的報價：{ticker: 報價 dict 或 {"error": ...}}。
+
+    快取命中的直接回；未命中的依 provider 分組後一起取。
+    這批代號記為最近有人看，背景刷新會讓它們保持溫熱。
+    """
+    quote_hub.note_request(tickers)
+    results = {}
+    misses = []
+    for ticker in tickers:
+        cached = _cached_quote(ticker)
+        if cached is not None:
+            results[ticker] = cached
+        else:
+            misses.append(ticker)
+
+    if misses:
+        try:
+            fetched = await _fetch_quotes(misses)
+        except Exception as e:
+            print(f"批次報價異常: {e}")
+            fetched = {}
+        for ticker in misses:
+            results[ticker] = fetched.get(ticker) or {
+                'error': '無法獲取股票資訊',
+                'ticker': ticker
+            }
+    return results
+
+
+@router.post("/stockprices")
+async def get_stock_prices(request: StockPricesRequest, _: str = Depends(current_user_email)):
+    """一次回傳多支報價：{ticker: 報價 dict 或 {"error": ...}}。
+
+    前端每輪詢一次只打這一支，取代每列各打一次 /stockprice。
+    """
+    tickers = list(dict.fromkeys(t for t in request.tickers if t))[:MAX_BATCH_TICKERS]
+    return await _quotes_for(tickers)
+
+
+# 串流沒有新報價時多久送一次心跳，避免代理伺服器把閒置連線切斷
+_STREAM_HEARTBEAT_SECONDS = 15
+
+
+def _sse(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False, default=str)}\n\n"
+
+
+@router.get("/stream/quotes")
+async def stream_quotes(
+    request: Request,
+    watchlist_id: int,
+    user_email: str = Depends(current_user_email),
+):
+    """Server-Sent Events：推送清單內有變動的報價，取代前端定時輪詢。
+
+    連上時先送一次整份快照（event: quotes），之後只在報價變動時推送變動的那幾支。
+    報價由背景刷新（quote_refresher）取得後經 quote_hub 扇出，
+    同一支股票不論幾個人在看，上游都只取一次。
+    前端以 fetch 讀取串流（EventSource 無法帶 Authorization header）。
+    """
+    rows = await asyncio.to_thread(_db_fetch_watchlist_stocks, user_email, watchlist_id)
+    tickers = [row['ticker'] for row in rows][:MAX_BATCH_TICKERS]
+
+    async def events():
+        # 先訂閱再取快照：快照期間才到的報價也不會漏掉。在 generator 內訂閱，
+        # 回應還沒開始送就被放棄時不會留下沒人取消的訂閱
+        subscription = quote_hub.subscribe(tickers)
+        try:
+            yield _sse("quotes", await _quotes_for(tickers))
+            while not await request.is_disconnected():
+                batch = await subscription.next_batch(_STREAM_HEARTBEAT_SECONDS)
+                if batch:
+                    yield _sse("quotes", batch)
+                else:
+                    yield ": ping\n\n"
+        finally:
+            subscription.close()
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
 def _yf_ticker(ticker: str) -> str:
     """正規化代號供 yfinance 使用：港股需 4 位數代碼（去多餘前導零、補滿 4 位）。
     例：01810.HK -> 1810.HK、00700.HK -> 0700.HK。其他市場原樣回傳。"""
@@ -276,25 +440,100 @@ def _yf_ticker(ticker: str) -> str:
 
 @router.get("/sparkline/{ticker}")
 async def get_sparkline(ticker: str, _: str = Depends(current_user_email)):
-    """回傳近一個月日收盤序列，供前端畫迷你走勢圖。全市場通用，快取 30 分鐘。"""
+    """回傳近一個月日收盤序列，供前端畫迷你走勢圖。全市場通用，快取 30 分鐘。
+
+    從與走勢圖共用的日 K 序列切出，不另外向上游下載。
+    """
+    return await _sparkline_for(ticker)
+
+
+async def _sparkline_for(ticker: str) -> dict:
+    """單支 sparkline；失敗時 points 為空陣列。"""
     try:
-        now = datetime.now()
-        if ticker in sparkline_cache:
-            ts, cached = sparkline_cache[ticker]
-            if now - ts < timedelta(minutes=30):
-                return cached
-
-        hist = await asyncio.to_thread(lambda: yf.Ticker(_yf_ticker(ticker)).history(period="1mo", interval="1d"))
-        closes = [round(float(c), 4) for c in hist["Close"].dropna().tolist()][-30:]
-        data = {"ticker": ticker, "points": closes}
-        if closes:  # 只快取成功結果；空的（多半是併發被限流）不快取以便重試
-            sparkline_cache[ticker] = (now, data)
-        return data
+        cached = await sparkline_cache.aget(ticker)
+        if cached is not None:
+            return cached
+
+        async def _load() -> dict:
+            bars = await _load_bars(_yf_ticker(ticker), "1d")
+            closes = _sparkline_points(bars)
+            data = {"ticker": ticker, "points": closes}
+            if closes:  # 只快取成功結果；空的（多半是併發被限流）不快取以便重試
+                sparkline_cache.set(ticker, data)
+            return data
+
+        return await sparkline_flight.do(ticker, _load)
     except Exception as e:
         print(f"sparkline 取得失敗: {ticker} {e}")
         return {"ticker": ticker, "points": []}
 
 
+def _sparkline_points(bars: pd.DataFrame) -> list:
+    """從日 K 序列切出近一個月收盤價（最多 30 點）。"""
+    close = bar_store.slice_period(bars, "1mo")["Close"].dropna()
+    return close.astype(float).round(4).tolist()[-30:]
+
+
+def _fetch_sparkline_bars_sync(tickers: list) -> dict:
+    """在 worker thread 執行：多支日 K 序列一起同步（一次 yf.download），回傳 {yf 代號: bars}。
+
+    資料庫不可用時退回直接批次下載同一範圍。
+    """
+    symbols = list(dict.fromkeys(_yf_ticker(t) for t in tickers))
+    try:
+        return bar_store.sync_many(symbols, "1d")
+    except psycopg2.Error as e:
+        print(f"bar store 無法使用，直接批次下載: {len(symbols)} 支 {e}")
+        return bar_store.download_many(symbols, "1d", bar_store.BACKFILL_PERIODS["1d"])
+
+
+async def _fetch_sparklines(tickers: list) -> dict:
+    """未命中快取的 sparkline 一起取日 K 序列並切出；成功的寫進 sparkline_cache。"""
+    series = await asyncio.to_thread(_fetch_sparkline_bars_sync, tickers)
+    result = {}
+    for ticker in tickers:
+        bars = series.get(_yf_ticker(ticker))
+        closes = _sparkline_points(bars) if bars is not None else []
+        result[ticker] = {"ticker": ticker, "points": closes}
+        if closes:
+            sparkline_cache.set(ticker, result[ticker])
+    return result
+
+
+@router.post("/sparklines")
+async def get_sparklines(request: StockPricesRequest, _: str = Depends(current_user_email)):
+    """一次回傳整份清單的 sparkline：{ticker: {"ticker", "points"}}。
+
+    快取命中的直接回，其餘與單支端點一樣從共用的日 K 序列切出；
+    需要向上游同步的序列只打一次 yf.download。取不到的代號 points 為空陣列（不快取，下次重試）。
+    """
+    tickers = list(dict.fromkeys(t for t in request.tickers if t))[:MAX_BATCH_TICKERS]
+    return await _sparklines_for(tickers)
+
+
+async def _sparklines_for(tickers: list) -> dict:
+    """一批代號的 sparkline（端點與啟動預熱共用）：快取命中的直接回，其餘一起批次取（與其他請求共用 single-flight）。"""
+    result = {}
+    misses = []
+    cached_items = await asyncio.gather(*(sparkline_cache.aget(t) for t in tickers))
+    for ticker, cached in zip(tickers, cached_items):
+        if cached is not None:
+            result[ticker] = cached
+        else:
+            misses.append(ticker)
+    if misses:
+        try:
+            fetched = await sparkline_flight.do_many(misses, _fetch_sparklines)
+        except Exception as e:
+            print(f"sparklines 批次取得失敗: {len(misses)} 支 {e}")
+            fetched = {}
+        for ticker in misses:
+            result[ticker] = fetched.get(ticker) or {"ticker": ticker, "points": []}
+    return result
+
+
+# range → (period, interval)。同 interval 的 range 共用一條序列（1m/3m/1y 與 sparkline 都是日 K），
+# 每個 interval 只向上游抓一次（見 bar_store.BACKFILL_PERIODS），各 range 再從中切出
 _RANGE_MAP = {
     "24h": ("1d", "5m"),
     "5d":  ("5d", "15m"),
@@ -306,99 +545,115 @@ _RANGE_MAP = {
 }
 
 
-def _compute_history(ticker_yf: str, period: str, interval: str) -> dict:
-    """在 worker thread 執行：拉歷史 OHLCV、算 MA 和 max drawdown。"""
-    hist = yf.Ticker(ticker_yf).history(period=period, interval=interval)
-    if hist.empty:
-        return {"dates": [], "close": [], "volume": [], "ma20": [], "ma60": [], "ma120": [], "bb_upper": [], "bb_lower": [], "mdd": None}
-
-    import math
-    hist = hist.dropna(subset=["Close"])
-    if hist.empty:
-        return {"dates": [], "close": [], "volume": [], "ma20": [], "ma60": [], "ma120": [], "bb_upper": [], "bb_lower": [], "mdd": None}
-
-    dates = [d.strftime("%Y-%m-%d %H:%M") if interval in ("5m", "15m") else d.strftime("%Y-%m-%d")
-             for d in hist.index]
-    close = [round(float(c), 4) for c in hist["Close"]]
-    volume = [int(v) if not math.isnan(v) else 0 for v in hist["Volume"]]
-
-    ma20 = _ma_list(close, 20)
-    ma60 = _ma_list(close, 60)
-    ma120 = _ma_list(close, 120)
-    bb_upper, bb_lower = _bollinger_bands(close, 20, 2)
-
-    peak = 0.0
-    mdd = 0.0
-    for c in close:
-        if c > peak:
-            peak = c
-        if peak > 0:
-            dd = (c - peak) / peak
-            if dd < mdd:
-                mdd = dd
-    mdd = round(mdd * 100, 2)
-
-    hi = max(close)
-    lo = min(close)
-    avg = round(sum(close) / len(close), 4)
+def _fetch_bars_sync(ticker_yf: str, interval: str) -> pd.DataFrame:
+    """在 worker thread 執行：取整條 bar 序列。資料庫不可用時退回直接下載同一範圍。"""
+    try:
+        return bar_store.load(ticker_yf, interval)
+    except psycopg2.Error as e:
+        print(f"bar store 無法使用，直接下載: {ticker_yf} {interval} {e}")
+        return bar_store.download(ticker_yf, interval, period=bar_store.BACKFILL_PERIODS[interval])
 
-    return {
-        "dates": dates, "close": close, "volume": volume,
-        "ma20": ma20, "ma60": ma60, "ma120": ma120,
-        "bb_upper": bb_upper, "bb_lower": bb_lower,
-        "mdd": mdd, "high": hi, "low": lo, "avg": avg,
-    }
+
+async def _load_bars(ticker_yf: str, interval: str) -> pd.DataFrame:
+    """同一 (ticker, interval) 同時只同步一次：1m/3m/1y 與 sparkline 一起打開時共用同一次上游請求。"""
+    return await bars_flight.do(
+        f"{ticker_yf}:{interval}", lambda: asyncio.to_thread(_fetch_bars_sync, ticker_yf, interval)
+    )
+
+
+async def _load_intraday_bars(ticker: str) -> pd.DataFrame | None:
+    """24h 走勢優先用自家盤中報價紀錄（quote_ticks）；紀錄不完整或資料庫不可用時回 None 改向上游取。"""
+    try:
+        return await asyncio.to_thread(quote_ticks.load_intraday_bars, ticker)
+    except psycopg2.Error as e:
+        print(f"quote_ticks 無法使用: {ticker} {e}")
+        return None
 
 
-def _ma_list(close: list, window: int) -> list:
-    n = len(close)
-    if n < window:
-        return [None] * n
-    result = [None] * (window - 1)
-    s = sum(close[:window])
-    result.append(round(s / window, 4))
-    for i in range(window, n):
-        s += close[i] - close[i - window]
-        result.append(round(s / window, 4))
+def _empty_history(extra: tuple = ()) -> dict:
+    empty = {"dates": [], "close": [], "volume": [], "mdd": None}
+    for name in indicators.compute(pd.Series(dtype=float), indicators.DEFAULT_INDICATORS + extra):
+        empty[name] = []
+    return empty
+
+
+def _compute_history(bars: pd.DataFrame, period: str, interval: str, extra: tuple = ()) -> dict:
+    """在 worker thread 執行：從整條 bar 序列算 MA／布林通道，再切出 period 區間與 max drawdown。
+
+    指標在整條序列上計算後才切片，短區間開頭的 MA120 也有足夠的暖機資料。
+    直接在 DataFrame 上以 rolling / cummax 向量化計算，
+    最後一次性四捨五入並轉成 list，不逐點跑 Python 迴圈。extra 為額外要算的指標名稱。
+    """
+    bars = bars.dropna(subset=["Close"])
+    n = len(bar_store.slice_period(bars, period))
+    if n == 0:
+        return _empty_history(extra)
+
+    date_format = "%Y-%m-%d %H:%M" if interval in ("5m", "15m") else "%Y-%m-%d"
+    # 指標以四捨五入後的收盤價計算，與回傳給前端的 close 一致
+    full_close = bars["Close"].astype(float).round(4)
+    hist = bars.iloc[-n:]
+    close = full_close.iloc[-n:]
+
+    result = {
+        "dates": hist.index.strftime(date_format).tolist(),
+        "close": close.tolist(),
+        "volume": hist["Volume"].fillna(0).astype("int64").tolist(),
+    }
+    for name, series in indicators.compute(full_close, indicators.DEFAULT_INDICATORS + extra).items():
+        result[name] = indicators.to_list(series.iloc[-n:])
+
+    result.update({
+        "mdd": indicators.max_drawdown(close),
+        "high": float(close.max()),
+        "low": float(close.min()),
+        "avg": round(float(close.mean()), 4),
+    })
     return result
 
 
-def _bollinger_bands(close: list, window: int = 20, num_std: int = 2) -> tuple[list, list]:
-    """純 Python 計算布林通道上下軌。"""
-    import math
-    n = len(close)
-    upper = [None] * n
-    lower = [None] * n
-    if n < window:
-        return upper, lower
-    for i in range(window - 1, n):
-        seg = close[i - window + 1: i + 1]
-        mean = sum(seg) / window
-        variance = sum((x - mean) ** 2 for x in seg) / window
-        std = math.sqrt(variance)
-        upper[i] = round(mean + num_std * std, 4)
-        lower[i] = round(mean - num_std * std, 4)
-    return upper, lower
+def _parse_indicators(raw: str) -> tuple:
+    """解析 ?indicators=rsi14,macd：只留已註冊且不在預設內的名稱，排序後當快取 key 的一部分。"""
+    names = {n.strip() for n in (raw or "").split(",") if n.strip()}
+    return tuple(sorted(n for n in names
+                        if n in indicators.INDICATORS and n not in indicators.DEFAULT_INDICATORS))
 
 
 @router.get("/history/{ticker}")
-async def get_history(ticker: str, range: str = "3m", _: str = Depends(current_user_email)):
-    """回傳歷史 OHLCV + MA20/60/120 + Max Drawdown，供前端畫走勢圖。快取 30 分鐘。"""
+async def get_history(
+    ticker: str,
+    range: str = "3m",
+    extra_indicators: str = Query("", alias="indicators"),
+    _: str = Depends(current_user_email),
+):
+    """回傳歷史 OHLCV + MA20/60/120 + 布林通道 + Max Drawdown，供前端畫走勢圖。快取 30 分鐘。
+
+    indicators 可額外要求已註冊的指標（逗號分隔，如 rsi14,macd），見 app/api/indicators.py。
+    """
     if range not in _RANGE_MAP:
         range = "3m"
-    cache_key = f"{ticker}:{range}"
-    now = datetime.now()
-    if cache_key in history_cache:
-        ts, cached = history_cache[cache_key]
-        if now - ts < timedelta(minutes=30):
-            return cached
+    return await _history_for(ticker, range, _parse_indicators(extra_indicators))
+
+
+async def _history_for(ticker: str, range: str, extra: tuple = ()) -> dict:
+    """get_history 的本體（快取 → single-flight → 載入 bar 並計算），供啟動預熱共用。"""
+    cache_key = f"{ticker}:{range}" + (f":{','.join(extra)}" if extra else "")
+    cached = await history_cache.aget(cache_key)
+    if cached is not None:
+        return cached
     try:
-        period, interval = _RANGE_MAP[range]
-        data = await asyncio.to_thread(_compute_history, _yf_ticker(ticker), period, interval)
-        result = {"ticker": ticker, "range": range, **data}
-        if data["close"]:
-            history_cache[cache_key] = (now, result)
-        return result
+        async def _load() -> dict:
+            period, interval = _RANGE_MAP[range]
+            bars = await _load_intraday_bars(ticker) if range == "24h" else None
+            if bars is None:
+                bars = await _load_bars(_yf_ticker(ticker), interval)
+            data = await asyncio.to_thread(_compute_history, bars, period, interval, extra)
+            result = {"ticker": ticker, "range": range, **data}
+            if data["close"]:
+                history_cache.set(cache_key, result)
+            return result
+
+        return await history_flight.do(cache_key, _load)
     except Exception as e:
         print(f"history 取得失敗: {ticker} {e}")
         return {"ticker": ticker, "range": range, "error": str(e)}
@@ -408,30 +663,31 @@ async def get_history(ticker: str, range: str = "3m", _: str = Depends(current_u
 async def get_fundamentals(ticker: str, _: str = Depends(current_user_email)):
     """回傳基本面指標供股票列展開時顯示。全市場通用，快取 6 小時。缺值回 null。"""
     try:
-        now = datetime.now()
-        if ticker in fundamentals_cache:
-            ts, cached = fundamentals_cache[ticker]
-            if now - ts < timedelta(hours=6):
-                return cached
-
-        info = await asyncio.to_thread(lambda: yf.Ticker(_yf_ticker(ticker)).info) or {}
-        # ADR/外國股票的股價幣別與財報幣別不同時（如 TSM: USD/TWD），
-        # Yahoo 的 P/B、P/S 是跨幣別誤除的錯值（TSM P/B 會變 87）——寧缺勿錯，回 null
-        cur, fin_cur = info.get("currency"), info.get("financialCurrency")
-        mixed_ccy = bool(cur and fin_cur and cur != fin_cur)
-        data = {
-            "ticker": ticker,
-            "pe": info.get("trailingPE"),
-            "pb": None if mixed_ccy else info.get("priceToBook"),
-            "ps": None if mixed_ccy else info.get("priceToSalesTrailing12Months"),
-            "eps": info.get("trailingEps"),
-            "dividend": info.get("dividendRate"),
-            "divYield": info.get("dividendYield"),
-            "week52High": info.get("fiftyTwoWeekHigh"),
-            "week52Low": info.get("fiftyTwoWeekLow"),
-        }
-        fundamentals_cache[ticker] = (now, data)
-        return data
+        cached = await fundamentals_cache.aget(ticker)
+        if cached is not None:
+            return cached
+
+        async def _load() -> dict:
+            info = await asyncio.to_thread(lambda: yf.Ticker(_yf_ticker(ticker)).info) or {}
+            # ADR/外國股票的股價幣別與財報幣別不同時（如 TSM: USD/TWD），
+            # Yahoo 的 P/B、P/S 是跨幣別誤除的錯值（TSM P/B 會變 87）——寧缺勿錯，回 null
+            cur, fin_cur = info.get("currency"), info.get("financialCurrency")
+            mixed_ccy = bool(cur and fin_cur and cur != fin_cur)
+            data = {
+                "ticker": ticker,
+                "pe": info.get("trailingPE"),
+                "pb": None if mixed_ccy else info.get("priceToBook"),
+                "ps": None if mixed_ccy else info.get("priceToSalesTrailing12Months"),
+                "eps": info.get("trailingEps"),
+                "dividend": info.get("dividendRate"),
+                "divYield": info.get("dividendYield"),
+                "week52High": info.get("fiftyTwoWeekHigh"),
+                "week52Low": info.get("fiftyTwoWeekLow"),
+            }
+            fundamentals_cache.set(ticker, data)
+            return data
+
+        return await fundamentals_flight.do(ticker, _load)
     except Exception as e:
         print(f"基本面取得失敗: {ticker} {e}")
         return {"ticker": ticker, "error": str(e)}
@@ -529,55 +785,115 @@ _EXCHANGE_NAMES = {
 }
 
 
-def _search_forex(query: str) -> list[dict]:
-    """比對靜態外匯清單，回傳符合的結果。"""
-    q = query.upper().replace("/", "").replace("=X", "")
-    matches = []
-    for symbol, pair_name, cn_name in _FOREX_PAIRS:
-        key = symbol.replace("=X", "")
-        if q in key or q in pair_name.upper().replace("/", "") or q in cn_name:
-            matches.append({
-                'symbol': symbol,
-                'name': f"{pair_name} {cn_name}",
-                'exchange': 'FX',
-                'display': f"{symbol} - {pair_name} {cn_name} (外匯)"
-            })
-    return matches
+# 代號後綴 → Yahoo 交易所代碼，供本地索引內沒有交易所資訊的代號顯示
+_SUFFIX_EXCHANGES = {
+    ".TW": "TAI", ".TWO": "TWO", ".HK": "HKG", ".SS": "SHH", ".SZ": "SHZ",
+}
+
+# 本地索引結果少於這個數量才問 Yahoo
+_LOCAL_ENOUGH = 5
+
+# Yahoo 搜尋結果快取（以正規化後的查詢字串為 key）
+autocomplete_cache = TTLCache("autocomplete", maxsize=2000, ttl=6 * 3600)
+autocomplete_flight = SingleFlight("autocomplete")
+
+
+def _symbol_result(symbol: str, name: str, exchange: str) -> dict:
+    if exchange == "FX":
+        display = f"{symbol} - {name} (外匯)"
+    else:
+        display = f"{symbol} - {name}" if name and name != symbol else symbol
+        if exchange:
+            display += f" ({_EXCHANGE_NAMES.get(exchange, exchange)})"
+    return {'symbol': symbol, 'name': name, 'exchange': exchange, 'display': display}
+
+
+def _add_to_index(result: dict, pinned: bool = False) -> None:
+    """結果加入本地索引；交易所名稱（如「港交所」）一併可搜尋。
+    pinned=False（報價、Yahoo 搜尋學到的）的代號有數量上限，最久沒出現的會被淘汰。"""
+    exchange_name = _EXCHANGE_NAMES.get(result['exchange'])
+    symbol_index.add(result, aliases=(exchange_name,) if exchange_name else (), pinned=pinned)
+
+
+def _index_symbol(symbol: str, name: str | None, pinned: bool = False) -> None:
+    """把代號（與名稱）加入本地索引；交易所依代號後綴推斷。"""
+    upper = symbol.upper()
+    exchange = next((code for suffix, code in _SUFFIX_EXCHANGES.items() if upper.endswith(suffix)), "")
+    _add_to_index(_symbol_result(symbol, name or symbol, exchange), pinned=pinned)
+
+
+for _symbol, _pair_name, _cn_name in _FOREX_PAIRS:
+    _add_to_index(_symbol_result(_symbol, f"{_pair_name} {_cn_name}", "FX"), pinned=True)
+
+
+def _db_known_symbols() -> list:
+    """stock_prices 與 watchlist_stocks 出現過的代號與公司名稱。"""
+    with db_connection() as conn:
+        cur = conn.cursor()
+        try:
+            cur.execute(
+                """SELECT ticker, company_name FROM stock_prices
+                   UNION
+                   SELECT DISTINCT ws.ticker, NULL FROM watchlist_stocks ws
+                   WHERE NOT EXISTS (SELECT 1 FROM stock_prices sp WHERE sp.ticker = ws.ticker)"""
+            )
+            return cur.fetchall()
+        finally:
+            cur.close()
+
+
+def seed_symbol_index() -> int:
+    """啟動時以資料庫內已知的代號填入本地索引。同步操作，於 to_thread 內呼叫。回傳加入筆數。"""
+    rows = _db_known_symbols()
+    for ticker, company_name in rows:
+        _index_symbol(ticker, company_name, pinned=True)
+    return len(rows)
+
+
+def _yahoo_search_sync(query: str) -> list:
+    """yq.search 並整理成前端格式（只留股票與 ETF）。於 to_thread 內執行（阻塞）。"""
+    search = yq.search(query)
+    results = []
+    if search and 'quotes' in search:
+        for quote in search['quotes']:
+            if quote.get('quoteType') in ['EQUITY', 'ETF']:
+                symbol = quote.get('symbol', '')
+                short_name = quote.get('shortname', '') or quote.get('longname', '')
+                if not (symbol and short_name):
+                    continue
+                results.append(_symbol_result(symbol, short_name, quote.get('exchange', '')))
+    return results
+
+
+async def _yahoo_search(query: str) -> list:
+    """Yahoo 搜尋（依查詢字串快取、同查詢併發只打一次）；結果同時收進本地索引。"""
+    key = query.strip().upper()
+    cached = autocomplete_cache.get(key)
+    if cached is not None:
+        return cached
+
+    async def _load() -> list:
+        results = await asyncio.to_thread(_yahoo_search_sync, query)
+        for result in results:
+            _add_to_index(result)
+        autocomplete_cache.set(key, results)
+        return results
+
+    return await autocomplete_flight.do(key, _load)
 
 
 @router.get("/autocomplete/{query}")
 async def autocomplete(query: str, _: str = Depends(current_user_email)):
+    """代號／名稱搜尋：先查本地索引（外匯、看過的代號、過去的搜尋結果，含中文名稱），
+    結果不足 _LOCAL_ENOUGH 筆才問 Yahoo，兩者合併後回傳最多 10 筆。"""
     try:
-        # 先比對靜態外匯清單
-        forex_hits = _search_forex(query)
-
-        # 使用 yahooquery 搜尋股票
-        search = await asyncio.to_thread(yq.search, query)
-
-        # 過濾並格式化結果
-        stock_results = []
-        if search and 'quotes' in search:
-            for quote in search['quotes']:
-                if quote.get('quoteType') in ['EQUITY', 'ETF']:
-                    symbol = quote.get('symbol', '')
-                    short_name = quote.get('shortname', '') or quote.get('longname', '')
-                    exchange = quote.get('exchange', '')
-                    if not (symbol and short_name):
-                        continue
-                    display = f"{symbol} - {short_name}"
-                    if exchange:
-                        display += f" ({_EXCHANGE_NAMES.get(exchange, exchange)})"
-                    stock_results.append({
-                        'symbol': symbol,
-                        'name': short_name,
-                        'exchange': exchange,
-                        'display': display
-                    })
-
-        # 外匯優先，合併後限制數量
-        seen = {r['symbol'] for r in forex_hits}
-        combined = forex_hits + [r for r in stock_results if r['symbol'] not in seen]
-        return combined[:10]
+        local = symbol_index.search(query, limit=10)
+        if len(local) >= _LOCAL_ENOUGH:
+            return local
+
+        remote = await _yahoo_search(query)
+        seen = {r['symbol'] for r in local}
+        return (local + [r for r in remote if r['symbol'] not in seen])[:10]
 
     except Exception as e:
         print(f"搜尋時發生錯誤: {str(e)}")
@@ -590,47 +906,59 @@ import aiohttp
 
 def _db_fetch_summary(ticker: str) -> dict | None:
     """讀取 stock_summaries 中的快取摘要，回 dict 或 None。"""
-    conn = get_db_connection()
-    cur = conn.cursor(cursor_factory=RealDictCursor)
-    try:
-        cur.execute(
-            "SELECT ticker, summary, generated_at FROM stock_summaries WHERE ticker = %s",
-            (ticker,),
-        )
-        row = cur.fetchone()
-        return dict(row) if row else None
-    finally:
-        cur.close()
-        conn.close()
-
-
-def _db_upsert_summary(ticker: str, summary: str) -> None:
-    conn = get_db_connection()
-    cur = conn.cursor()
-    try:
-        cur.execute(
-            """INSERT INTO stock_summaries (ticker, summary, generated_at)
-               VALUES (%s, %s, NOW())
-               ON CONFLICT (ticker) DO UPDATE SET
-                   summary = EXCLUDED.summary,
-                   generated_at = NOW();""",
-            (ticker, summary),
-        )
-        conn.commit()
-    finally:
-        cur.close()
-        conn.close()
+    with db_connection() as conn:
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        try:
+            cur.execute(
+                "SELECT ticker, summary, generated_at, context_hash FROM stock_summaries WHERE ticker = %s",
+                (ticker,),
+            )
+            row = cur.fetchone()
+            return dict(row) if row else None
+        finally:
+            cur.close()
+
+
+def _db_upsert_summary(ticker: str, summary: str, context_hash: str | None = None) -> None:
+    with db_connection() as conn:
+        cur = conn.cursor()
+        try:
+            cur.execute(
+                """INSERT INTO stock_summaries (ticker, summary, generated_at, context_hash)
+                   VALUES (%s, %s, NOW(), %s)
+                   ON CONFLICT (ticker) DO UPDATE SET
+                       summary = EXCLUDED.summary,
+                       generated_at = NOW(),
+                       context_hash = EXCLUDED.context_hash;""",
+                (ticker, summary, context_hash),
+            )
+            conn.commit()
+        finally:
+            cur.close()
+
+
+def _db_touch_summary(ticker: str) -> None:
+    """輸入資料沒變：摘要內容照舊，只把 generated_at 更新為現在（視為已重新確認）。"""
+    with db_connection() as conn:
+        cur = conn.cursor()
+        try:
+            cur.execute(
+                "UPDATE stock_summaries SET generated_at = NOW() WHERE ticker = %s",
+                (ticker,),
+            )
+            conn.commit()
+        finally:
+            cur.close()
 
 
 def _db_distinct_watchlist_tickers() -> list:
-    conn = get_db_connection()
-    cur = conn.cursor()
-    try:
-        cur.execute("SELECT DISTINCT ticker FROM watchlist_stocks")
-        return [row[0] for row in cur.fetchall()]
-    finally:
-        cur.close()
-        conn.close()
+    with db_connection() as conn:
+        cur = conn.cursor()
+        try:
+            cur.execute("SELECT DISTINCT ticker FROM watchlist_stocks")
+            return [row[0] for row in cur.fetchall()]
+        finally:
+            cur.close()
 
 
 async def _collect_us_context(ticker: str) -> str:
@@ -641,45 +969,47 @@ async def _collect_us_context(ticker: str) -> str:
     to_date = datetime.now()
     from_date = to_date - timedelta(days=30)
     try:
-        async with aiohttp.ClientSession() as session:
-            # 公司新聞
-            try:
-                async with session.get(
-                    f"{base_url}/company-news",
-                    params={
-                        "symbol": ticker,
-                        "from": from_date.strftime("%Y-%m-%d"),
-                        "to": to_date.strftime("%Y-%m-%d"),
-                        "token": token,
-                    },
-                    timeout=aiohttp.ClientTimeout(total=15),
-                ) as resp:
-                    if resp.status == 200:
-                        news = await resp.json()
-                        headlines = [n.get("headline", "") for n in (news or [])[:15] if n.get("headline")]
-                        if headlines:
-                            parts.append("近期新聞標題：\n" + "\n".join(f"- {h}" for h in headlines))
-            except Exception as e:
-                print(f"Finnhub 新聞取得失敗: {ticker} {e}")
+        session = get_session("finnhub")
+        # 公司新聞
+        try:
+            await finnhub_bucket.acquire()
+            async with session.get(
+                f"{base_url}/company-news",
+                params={
+                    "symbol": ticker,
+                    "from": from_date.strftime("%Y-%m-%d"),
+                    "to": to_date.strftime("%Y-%m-%d"),
+                    "token": token,
+                },
+                timeout=aiohttp.ClientTimeout(total=15),
+            ) as resp:
+                if resp.status == 200:
+                    news = await resp.json()
+                    headlines = [n.get("headline", "") for n in (news or [])[:15] if n.get("headline")]
+                    if headlines:
+                        parts.append("近期新聞標題：\n" + "\n".join(f"- {h}" for h in headlines))
+        except Exception as e:
+            print(f"Finnhub 新聞取得失敗: {ticker} {e}")
 
-            # 財報 EPS
-            try:
-                async with session.get(
-                    f"{base_url}/stock/earnings",
-                    params={"symbol": ticker, "token": token},
-                    timeout=aiohttp.ClientTimeout(total=15),
-                ) as resp:
-                    if resp.status == 200:
-                        earnings = await resp.json()
-                        if earnings:
-                            e = earnings[0]
-                            parts.append(
-                                "最新一季財報（EPS）："
-                                f"實際 {e.get('actual')}、預估 {e.get('estimate')}、"
-                                f"驚奇 {e.get('surprise')}（期別 {e.get('period')}）"
-                            )
-            except Exception as e:
-                print(f"Finnhub 財報取得失敗: {ticker} {e}")
+        # 財報 EPS
+        try:
+            await finnhub_bucket.acquire()
+            async with session.get(
+                f"{base_url}/stock/earnings",
+                params={"symbol": ticker, "token": token},
+                timeout=aiohttp.ClientTimeout(total=15),
+            ) as resp:
+                if resp.status == 200:
+                    earnings = await resp.json()
+                    if earnings:
+                        e = earnings[0]
+                        parts.append(
+                            "最新一季財報（EPS）："
+                            f"實際 {e.get('actual')}、預估 {e.get('estimate')}、"
+                            f"驚奇 {e.get('surprise')}（期別 {e.get('period')}）"
+                        )
+        except Exception as e:
+            print(f"Finnhub 財報取得失敗: {ticker} {e}")
     except Exception as e:
         print(f"Finnhub 資料蒐集異常: {ticker} {e}")
     return "\n\n".join(parts)
@@ -764,8 +1094,8 @@ def _collect_non_us_context_sync(ticker: str) -> str:
     return "\n\n".join(parts)
 
 
-async def _call_deepseek_summary(ticker: str, context_text: str, *, is_fx: bool = False) -> str:
-    """呼叫 DeepSeek 產生 200 字以內繁中摘要。沿用 chat.py 的呼叫方式。"""
+def _deepseek_summary_request(ticker: str, context_text: str, *, is_fx: bool = False) -> tuple:
+    """組出摘要用的 DeepSeek 請求：回傳 (url, headers, payload)。一次回傳與串流兩種模式共用。"""
     headers = {
         "Content-Type": "application/json",
         "Authorization": f"Bearer {settings.DEEPSEEK_API_KEY}",
@@ -796,37 +1126,133 @@ async def _call_deepseek_summary(ticker: str, context_text: str, *, is_fx: bool
     url = settings.DEEPSEEK_API_URL.rstrip("/")
     if not url.endswith("/chat/completions"):
         url += "/chat/completions"
+    return url, headers, data
+
 
-    async with aiohttp.ClientSession() as session:
-        async with session.post(
-            url, headers=headers, json=data,
-            timeout=aiohttp.ClientTimeout(total=60),
-        ) as response:
-            result = await response.json(content_type=None)
-            if "choices" in result and len(result["choices"]) > 0:
-                return result["choices"][0]["message"]["content"].strip()
+async def _call_deepseek_summary(ticker: str, context_text: str, *, is_fx: bool = False) -> str:
+    """呼叫 DeepSeek 產生 200 字以內繁中摘要。沿用 chat.py 的呼叫方式。"""
+    url, headers, data = _deepseek_summary_request(ticker, context_text, is_fx=is_fx)
+    session = get_session("deepseek")
+    async with session.post(
+        url, headers=headers, json=data,
+        timeout=aiohttp.ClientTimeout(total=60),
+    ) as response:
+        result = await response.json(content_type=None)
+        if "choices" in result and len(result["choices"]) > 0:
+            return result["choices"][0]["message"]["content"].strip()
     return ""
 
 
-async def generate_stock_summary(ticker: str) -> str:
-    """產生單支股票摘要（不含快取判斷）：蒐集資料→呼叫 DeepSeek→upsert。
-    供端點與排程共用。回傳摘要字串；任何階段失敗時回空字串並印 log。"""
+async def _stream_deepseek_summary(ticker: str, context_text: str, *, is_fx: bool = False):
+    """串流模式（stream: true）：逐段 yield DeepSeek 回傳的文字。
+
+    DeepSeek 與 OpenAI 相容，回應為 SSE：每行 `data: {...}`，以 `data: [DONE]` 結束。
+    """
+    url, headers, data = _deepseek_summary_request(ticker, context_text, is_fx=is_fx)
+    data["stream"] = True
+    session = get_session("deepseek")
+    async with session.post(
+        url, headers=headers, json=data,
+        timeout=aiohttp.ClientTimeout(total=60),
+    ) as response:
+        if response.status != 200:
+            raise RuntimeError(f"DeepSeek 回應 HTTP {response.status}")
+        async for raw in response.content:
+            line = raw.decode("utf-8").strip()
+            if not line.startswith("data:"):
+                continue
+            payload = line[5:].strip()
+            if payload == "[DONE]":
+                break
+            for choice in json.loads(payload).get("choices") or []:
+                text = (choice.get("delta") or {}).get("content")
+                if text:
+                    yield text
+
+
+def _summary_context_source(ticker: str) -> str:
+    """摘要資料來源：外匯 fx、有 Finnhub key 的美股 finnhub，其餘 yfinance。"""
+    if ticker.upper().endswith("=X"):
+        return "fx"
+    if '.' not in ticker and settings.FINNHUB_API_KEY:
+        return "finnhub"
+    return "yfinance"
+
+
+class SummaryContextUnavailable(Exception):
+    """新聞與財報都取不到（上游失敗或暫時沒資料）。不該拿空資料呼叫 LLM、蓋掉既有摘要。"""
+
+
+async def collect_summary_context(ticker: str) -> str:
+    """蒐集摘要用的新聞與財報文字；都取不到時 raise SummaryContextUnavailable（可重試）。"""
+    source = _summary_context_source(ticker)
+    if source == "fx":
+        context_text = await asyncio.to_thread(_collect_fx_context_sync, ticker)
+    elif source == "finnhub":
+        context_text = await _collect_us_context(ticker)
+    else:
+        context_text = await asyncio.to_thread(_collect_non_us_context_sync, ticker)
+    if not context_text:
+        raise SummaryContextUnavailable(f"{ticker} 取不到新聞與財報資料")
+    return context_text
+
+
+# 改了摘要 prompt 時調高，讓所有股票的指紋失效、下次一律重新產生
+_SUMMARY_PROMPT_VERSION = 1
+
+
+def _context_fingerprint(ticker: str, context_text: str) -> str:
+    """摘要輸入資料的指紋：去掉空白差異、行序排序後取 SHA-256。
+
+    新聞標題只是順序變了、或前後多了空白，都不算資料有變。
+    """
+    lines = sorted(" ".join(line.split()) for line in context_text.splitlines())
+    normalized = "\n".join(line for line in lines if line)
+    raw = f"v{_SUMMARY_PROMPT_VERSION}|{ticker.upper()}|{normalized}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+async def reuse_unchanged_summary(ticker: str, fingerprint: str) -> str | None:
+    """資料庫內摘要的輸入指紋與這次相同時，更新其時間並回傳該摘要（不必再呼叫 LLM）；否則回 None。"""
     try:
-        is_fx = ticker.upper().endswith("=X")
-        if is_fx:
-            context_text = await asyncio.to_thread(_collect_fx_context_sync, ticker)
-        elif '.' not in ticker and settings.FINNHUB_API_KEY:
-            context_text = await _collect_us_context(ticker)
-        else:
-            context_text = await asyncio.to_thread(_collect_non_us_context_sync, ticker)
+        cached = await asyncio.to_thread(_db_fetch_summary, ticker)
+        if cached and cached.get("summary") and cached.get("context_hash") == fingerprint:
+            await asyncio.to_thread(_db_touch_summary, ticker)
+            return cached["summary"]
+    except Exception as e:
+        print(f"比對摘要指紋失敗: {ticker} {e}")
+    return None
 
-        if not context_text:
-            context_text = "（無可用的新聞與財報資料）"
 
-        summary = await _call_deepseek_summary(ticker, context_text, is_fx=is_fx)
+async def generate_stock_summary(ticker: str, on_token: Callable[[str], None] | None = None) -> str:
+    """產生單支股票摘要（不含快取判斷）：蒐集資料→（資料有變才）呼叫 DeepSeek→upsert。
+    供端點使用（排程批次走 summary_pipeline）。回傳摘要字串；任何階段失敗時回空字串並印 log。
+    給了 on_token 時改用串流模式，每收到一段文字就呼叫一次。
+    資料蒐集不到時不呼叫 LLM，回資料庫內既有的摘要（沒有則回空字串）。"""
+    try:
+        try:
+            context_text = await collect_summary_context(ticker)
+        except SummaryContextUnavailable as e:
+            print(f"{e}，沿用既有摘要")
+            cached = await asyncio.to_thread(_db_fetch_summary, ticker)
+            return (cached or {}).get("summary") or ""
+        fingerprint = _context_fingerprint(ticker, context_text)
+        unchanged = await reuse_unchanged_summary(ticker, fingerprint)
+        if unchanged is not None:
+            return unchanged
+
+        is_fx = _summary_context_source(ticker) == "fx"
+        if on_token is None:
+            summary = await _call_deepseek_summary(ticker, context_text, is_fx=is_fx)
+        else:
+            parts = []
+            async for text in _stream_deepseek_summary(ticker, context_text, is_fx=is_fx):
+                parts.append(text)
+                on_token(text)
+            summary = "".join(parts).strip()
         if summary:
             try:
-                await asyncio.to_thread(_db_upsert_summary, ticker, summary)
+                await asyncio.to_thread(_db_upsert_summary, ticker, summary, fingerprint)
             except Exception as e:
                 print(f"摘要寫入資料庫失敗: {ticker} {e}")
         return summary
@@ -835,39 +1261,117 @@ async def generate_stock_summary(ticker: str) -> str:
         return ""
 
 
+# 摘要產生的 single-flight：同一支股票同時只產生一次（背景重新產生與同步請求共用）
+summary_flight = SingleFlight("summary")
+# 進行中的背景重新產生工作；保留參照以免 task 被 GC 回收
+_summary_tasks: set = set()
+
+
+# 串流產生中的摘要：ticker → _SummaryStream，之後進來的串流請求從這裡接收同一份輸出
+_summary_streams: dict = {}
+
+
+class _SummaryStream:
+    """以串流模式產生摘要（作為 summary_flight 的擁有者執行），把每段文字分送給所有訂閱者。
+
+    產生在 single-flight 的獨立 task 裡跑，訂閱者中途斷線不會中斷產生與寫入。
+    """
+
+    def __init__(self, ticker: str):
+        self.ticker = ticker
+        self.parts: list = []
+        self._queues: set = set()
+        self.started = False
+
+    def subscribe(self) -> asyncio.Queue:
+        """訂閱之後的文字；已經產生的部分先補進佇列。"""
+        queue = asyncio.Queue()
+        for text in self.parts:
+            queue.put_nowait(text)
+        self._queues.add(queue)
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue) -> None:
+        self._queues.discard(queue)
+
+    def _publish(self, text: str) -> None:
+        self.parts.append(text)
+        for queue in self._queues:
+            queue.put_nowait(text)
+
+    async def run(self) -> str:
+        self.started = True
+        # 登記後可能已被移除（發起的請求在產生開始前就斷線）：自己正在產生就補登記
+        _summary_streams.setdefault(self.ticker, self)
+        try:
+            return await generate_stock_summary(self.ticker, on_token=self._publish)
+        finally:
+            if _summary_streams.get(self.ticker) is self:
+                del _summary_streams[self.ticker]
+
+
+def _regenerate_summary_in_background(ticker: str) -> None:
+    """在背景重新產生摘要（已在進行中則不重複啟動），完成後下次請求就會拿到新的。"""
+    if ticker in summary_flight:
+        return
+
+    async def _run() -> None:
+        try:
+            await summary_flight.do(ticker, lambda: generate_stock_summary(ticker))
+        except Exception as e:
+            print(f"背景重新產生摘要失敗: {ticker} {e}")
+
+    task = asyncio.create_task(_run())
+    _summary_tasks.add(task)
+    task.add_done_callback(_summary_tasks.discard)
+
+
+async def _summary_from_cache(ticker: str, refresh: bool) -> dict | None:
+    """摘要快取判斷（一般與串流端點共用）：可直接回應時回 response dict，需要即時產生時回 None。
+
+    快取已超過 25 小時（stale-while-revalidate）：立即回舊摘要並帶 stale: true，
+    同時在背景重新產生。refresh=true 在 1 小時冷卻內回 cooldown: true。
+    """
+    try:
+        cached = await asyncio.to_thread(_db_fetch_summary, ticker)
+    except Exception as e:
+        print(f"讀取摘要快取失敗: {ticker} {e}")
+        return None
+    if not (cached and cached.get("summary") and cached.get("generated_at")):
+        return None
+
+    gen = cached["generated_at"]
+    now = datetime.now(gen.tzinfo) if gen.tzinfo else datetime.now()
+    age = now - gen
+    response = {
+        "ticker": ticker,
+        "summary": cached["summary"],
+        "generated_at": gen.isoformat(),
+    }
+    if refresh:
+        if age < timedelta(hours=1):
+            return {**response, "cooldown": True}
+        return None
+    if age >= timedelta(hours=25):
+        _regenerate_summary_in_background(ticker)
+        response["stale"] = True
+    return response
+
+
 @router.get("/ai-summary/{ticker}")
 async def get_ai_summary(ticker: str, refresh: bool = False, _: str = Depends(current_user_email)):
-    """回傳 AI 股票摘要。25 小時內有快取則直接回，否則即時產生。refresh=true 強制重新產生。"""
+    """回傳 AI 股票摘要。25 小時內有快取則直接回；refresh=true 強制重新產生。
+
+    快取過期時先回舊摘要（stale: true）並在背景重新產生，前端下次再取就是新的。
+    只有從沒產生過摘要的股票需要同步等待。
+    """
     try:
-        # 先看快取
-        try:
-            cached = await asyncio.to_thread(_db_fetch_summary, ticker)
-        except Exception as e:
-            print(f"讀取摘要快取失敗: {ticker} {e}")
-            cached = None
-
-        if cached and cached.get("summary") and cached.get("generated_at"):
-            gen = cached["generated_at"]
-            now = datetime.now(gen.tzinfo) if gen.tzinfo else datetime.now()
-            age = now - gen
-
-            if refresh and age < timedelta(hours=1):
-                return {
-                    "ticker": ticker,
-                    "summary": cached["summary"],
-                    "generated_at": gen.isoformat(),
-                    "cooldown": True,
-                }
-
-            if not refresh and age < timedelta(hours=25):
-                return {
-                    "ticker": ticker,
-                    "summary": cached["summary"],
-                    "generated_at": gen.isoformat(),
-                }
-
-        # 即時產生
-        summary = await generate_stock_summary(ticker)
+        cached = await _summary_from_cache(ticker, refresh)
+        if cached is not None:
+            return cached
+
+        # 即時產生（同一支同時只產生一次）
+        summary = await summary_flight.do(ticker, lambda: generate_stock_summary(ticker))
         if not summary:
             return {"ticker": ticker, "summary": "", "error": "無法產生摘要"}
 
@@ -878,4 +1382,68 @@ async def get_ai_summary(ticker: str, refresh: bool = False, _: str = Depends(cu
         }
     except Exception as e:
         print(f"ai-summary 端點異常: {ticker} {e}")
-        return {"ticker": ticker, "summary": "", "error": str(e)}
\ No newline at end of file
+        return {"ticker": ticker, "summary": "", "error": str(e)}
+
+
+@router.get("/ai-summary/{ticker}/stream")
+async def stream_ai_summary(ticker: str, refresh: bool = False, _: str = Depends(current_user_email)):
+    """Server-Sent Events 版的 /ai-summary：需要即時產生時逐段轉送 DeepSeek 的輸出。
+
+    event: token 為增量文字（data: {"text": ...}）；event: done 為完整結果，欄位同 /ai-summary；
+    event: error 為失敗。有快取（含 stale、cooldown）或輸入資料沒變時直接送一個 done。
+
+    串流產生同樣走 summary_flight：同一支同時只呼叫一次 LLM，之後的串流請求從頭接收同一份輸出，
+    /ai-summary 與背景重新產生則等它的結果。使用者中途離開時產生照樣完成並寫入 stock_summaries。
+    """
+    async def events():
+        try:
+            cached = await _summary_from_cache(ticker, refresh)
+            if cached is not None:
+                yield _sse("done", cached)
+                return
+
+            # 已有串流在產生就訂閱它；否則登記一個由自己產生（若別的請求正以一般模式產生，do 會改為等它）
+            stream = _summary_streams.get(ticker)
+            if stream is None:
+                stream = _summary_streams[ticker] = _SummaryStream(ticker)
+            queue = stream.subscribe()
+            flight = asyncio.ensure_future(summary_flight.do(ticker, stream.run))
+            get = None
+            try:
+                while not flight.done():
+                    get = asyncio.ensure_future(queue.get())
+                    await asyncio.wait({get, flight}, return_when=asyncio.FIRST_COMPLETED)
+                    if not get.done():
+                        break
+                    yield _sse("token", {"text": get.result()})
+                # 產生完成前送出的文字都已進佇列，補送剩下的
+                while not queue.empty():
+                    yield _sse("token", {"text": queue.get_nowait()})
+                summary = flight.result()
+            finally:
+                if get is not None:
+                    get.cancel()
+                stream.unsubscribe(queue)
+                # 只取消自己的等待；產生在 single-flight 的 task 裡照樣跑完並寫入
+                flight.cancel()
+                # 別的請求以一般模式擁有 summary_flight 時這個串流不會執行，登記要自己清掉
+                if not stream.started and _summary_streams.get(ticker) is stream:
+                    del _summary_streams[ticker]
+
+            if not summary:
+                yield _sse("error", {"ticker": ticker, "error": "無法產生摘要"})
+                return
+            yield _sse("done", {
+                "ticker": ticker,
+                "summary": summary,
+                "generated_at": datetime.now().isoformat(),
+            })
+        except Exception as e:
+            print(f"ai-summary 串流異常: {ticker} {e}")
+            yield _sse("error", {"ticker": ticker, "error": str(e)})
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
@@ -0,0 +1,177 @@
+"""AI 摘要批次刷新：每日排程對所有自選股重新產生摘要。
+
+原本逐支序列執行（蒐集資料 → 等 DeepSeek 最多 60 秒 → 下一支），股票一多就要跑好幾個小時。
+改為有上限的並行管線：
+
+- 蒐集資料（Finnhub / yfinance）與呼叫 LLM 各自有並行上限，互不佔用名額；
+- 每個上游各有 token bucket 限制每秒請求數，並行再高也不會把上游打到限流
+  （Finnhub 用 providers.finnhub 的共用 bucket，與報價刷新一起算額度）；
+- 輸入資料指紋與上次相同的股票不呼叫 LLM，沿用既有摘要；
+- 失敗（例外、資料蒐集不到或 DeepSeek 回空）以指數退避重試；資料重試後仍蒐集不到就跳過 LLM、保留既有摘要；
+- 產生走 stock.summary_flight：與同一支的 /ai-summary、串流請求同時發生時只產生一次；
+- 結束時以 log 輸出進度與各階段延遲報告，最近一次報告也放在 /metrics。
+"""
+import asyncio
+import logging
+import random
+import time
+
+from app.api import stock
+from app.core.ratelimit import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+# 同時進行中的資料蒐集 / LLM 呼叫數
+CONTEXT_CONCURRENCY = 6
+LLM_CONCURRENCY = 4
+
+# 各上游每秒請求數（yfinance 非官方 API，保守一點）。Finnhub 的請求由 stock._collect_us_context
+# 逐一向共用的 finnhub_bucket 取 token，這裡不另外限
+_BUCKETS = {
+    "yfinance": TokenBucket("summary_yfinance", rate=2.0, capacity=4),
+    "deepseek": TokenBucket("summary_deepseek", rate=2.0, capacity=4),
+}
+# 一次資料蒐集會打幾個 yfinance 請求（新聞 + 財務）
+_CONTEXT_REQUESTS = {"yfinance": 2, "fx": 2}
+
+MAX_ATTEMPTS = 3
+_BACKOFF_BASE_SECONDS = 2.0
+# 每完成幾支印一次進度
+_PROGRESS_EVERY = 20
+
+# 最近一次批次的報告，供 /metrics
+last_report: dict = {}
+
+
+class _EmptySummary(Exception):
+    """DeepSeek 沒回內容（多半是被限流或暫時錯誤），視為可重試。"""
+
+
+async def _with_retry(run: "_Run", label: str, fn):
+    """執行 fn()，失敗時以指數退避（含隨機抖動）重試，最多 MAX_ATTEMPTS 次。"""
+    for attempt in range(1, MAX_ATTEMPTS + 1):
+        try:
+            return await fn()
+        except Exception as e:
+            if attempt == MAX_ATTEMPTS:
+                raise
+            run.retries += 1
+            delay = _BACKOFF_BASE_SECONDS * 2 ** (attempt - 1) * (1 + random.random() * 0.5)
+            logger.warning(f"{label} 第 {attempt} 次失敗，{delay:.1f} 秒後重試: {e}")
+            await asyncio.sleep(delay)
+
+
+def _percentile(values: list, pct: float) -> float | None:
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * (len(ordered) - 1))))
+    return round(ordered[index], 2)
+
+
+def _latency_summary(values: list) -> dict:
+    return {
+        "p50": _percentile(values, 50),
+        "p95": _percentile(values, 95),
+        "max": round(max(values), 2) if values else None,
+    }
+
+
+class _Run:
+    """一次批次刷新的狀態與統計。"""
+
+    def __init__(self, total: int):
+        self.total = total
+        self.done = 0
+        self.succeeded = 0
+        self.retries = 0
+        self.unchanged = 0
+        self.skipped = 0      # 資料蒐集不到、保留既有摘要的支數
+        self.failed: dict = {}
+        self.context_seconds: list = []
+        self.llm_seconds: list = []
+        self.started = time.perf_counter()
+        self.context_slots = asyncio.Semaphore(CONTEXT_CONCURRENCY)
+        self.llm_slots = asyncio.Semaphore(LLM_CONCURRENCY)
+
+    def progress(self) -> None:
+        self.done += 1
+        if self.done % _PROGRESS_EVERY == 0 or self.done == self.total:
+            elapsed = time.perf_counter() - self.started
+            logger.info(f"摘要刷新進度 {self.done}/{self.total}（成功 {self.succeeded}，失敗 {len(self.failed)}，{elapsed:.0f} 秒）")
+
+    def report(self) -> dict:
+        return {
+            "total": self.total,
+            "succeeded": self.succeeded,
+            "unchanged": self.unchanged,
+            "skipped": self.skipped,
+            "failed": len(self.failed),
+            "failed_tickers": self.failed,
+            "retries": self.retries,
+            "duration_seconds": round(time.perf_counter() - self.started, 1),
+            "context_latency": _latency_summary(self.context_seconds),
+            "llm_latency": _latency_summary(self.llm_seconds),
+        }
+
+
+async def _refresh_one(run: _Run, ticker: str) -> None:
+    source = stock._summary_context_source(ticker)
+
+    async def _collect() -> str:
+        if source in _CONTEXT_REQUESTS:
+            await _BUCKETS["yfinance"].acquire(_CONTEXT_REQUESTS[source])
+        return await stock.collect_summary_context(ticker)
+
+    async def _summarize(context_text: str) -> str:
+        await _BUCKETS["deepseek"].acquire()
+        summary = await stock._call_deepseek_summary(ticker, context_text, is_fx=source == "fx")
+        if not summary:
+            raise _EmptySummary("DeepSeek 未回傳內容")
+        return summary
+
+    async def _generate() -> str:
+        async with run.context_slots:
+            start = time.perf_counter()
+            context_text = await _with_retry(run, f"{ticker} 資料蒐集", _collect)
+            run.context_seconds.append(time.perf_counter() - start)
+
+        fingerprint = stock._context_fingerprint(ticker, context_text)
+        unchanged = await stock.reuse_unchanged_summary(ticker, fingerprint)
+        if unchanged is not None:
+            run.unchanged += 1
+            return unchanged
+
+        async with run.llm_slots:
+            start = time.perf_counter()
+            summary = await _with_retry(run, f"{ticker} 摘要產生", lambda: _summarize(context_text))
+            run.llm_seconds.append(time.perf_counter() - start)
+
+        await asyncio.to_thread(stock._db_upsert_summary, ticker, summary, fingerprint)
+        return summary
+
+    try:
+        # 同一支正由端點產生時直接等它的結果
+        summary = await stock.summary_flight.do(ticker, _generate)
+        if not summary:
+            raise _EmptySummary("摘要產生失敗")
+        run.succeeded += 1
+    except stock.SummaryContextUnavailable as e:
+        run.skipped += 1
+        logger.warning(f"排程摘要跳過，保留既有摘要: {e}")
+    except Exception as e:
+        run.failed[ticker] = str(e) or type(e).__name__
+        logger.error(f"排程產生摘要失敗: {ticker} {e}")
+    finally:
+        run.progress()
+
+
+async def refresh_summaries(tickers: list) -> dict:
+    """並行刷新多支股票的摘要，回傳報告（也記在 last_report 與 log）。"""
+    global last_report
+    run = _Run(len(tickers))
+    await asyncio.gather(*(_refresh_one(run, ticker) for ticker in tickers))
+    report = run.report()
+    last_report = report
+    logger.info(f"摘要刷新完成: {report}")
+    return report
@@ -0,0 +1,209 @@
+"""本地代號索引：autocomplete 先查記憶體，結果不夠才問 Yahoo。
+
+原本每次輸入都同步打一次 yq.search（網路請求），只有外匯清單在本地線性比對。
+索引收錄外匯清單、stock_prices / watchlist_stocks 出現過的代號、取報價時拿到的公司名稱，
+以及 Yahoo 搜尋回來的結果；同一代號可有多個名稱（例如英文名與「台積電」）。
+
+外匯清單與資料庫內的代號固定收錄（pinned）；報價與 Yahoo 搜尋順手學到的代號來自使用者輸入，
+最多保留 max_learned 筆，超過就淘汰最久沒再出現的，索引不會無限長大。
+
+- 前綴：代號、去掉市場後綴的代號、名稱（去空白）與名稱中每個字，排序後以 bisect 找範圍；
+- 子字串 / 中文：字元 bigram（中文另加單字）倒排索引，取交集後再驗證；
+- 模糊：前兩者都找不到時，以 bigram 的 Dice 係數找拼錯的代號或名稱。
+
+查詢只碰記憶體結構，數千筆規模下遠低於 1 毫秒。
+"""
+import bisect
+import threading
+import unicodedata
+from collections import OrderedDict
+
+# 前綴範圍最多掃幾筆（"A" 之類的短查詢可能命中上千筆）
+_MAX_PREFIX_SCAN = 500
+# 模糊比對的最低 Dice 係數
+_FUZZY_THRESHOLD = 0.5
+# 非固定收錄的代號最多保留幾筆
+_MAX_LEARNED = 20000
+# 每個代號最多收錄幾段可搜尋文字（代號、名稱、名稱中的字），擋住同一代號一直換名稱
+_MAX_TERMS = 32
+
+
+def _normalize(text: str) -> str:
+    """全形轉半形、轉大寫。"""
+    return unicodedata.normalize("NFKC", text or "").upper().strip()
+
+
+def _compact(text: str) -> str:
+    """去掉空白、斜線與外匯後綴：USD/TWD、usdtwd=x 都變成 USDTWD。"""
+    return _normalize(text).replace("=X", "").replace("/", "").replace(" ", "")
+
+
+def _is_cjk(ch: str) -> bool:
+    return "一" <= ch <= "鿿" or "㐀" <= ch <= "䶿"
+
+
+def _grams(text: str) -> set:
+    """字元 bigram；中文字另外單獨收錄，讓「台」這種一個字的查詢也找得到。"""
+    grams = {text[i:i + 2] for i in range(len(text) - 1)}
+    grams.update(ch for ch in text if _is_cjk(ch))
+    return grams
+
+
+def _dice(a: set, b: set) -> float:
+    if not a or not b:
+        return 0.0
+    return 2 * len(a & b) / (len(a) + len(b))
+
+
+class SymbolIndex:
+    def __init__(self, max_learned: int = _MAX_LEARNED):
+        self.max_learned = max_learned
+        self._lock = threading.Lock()
+        self._entries: dict = {}       # symbol → 回傳給前端的 dict
+        self._order: dict = {}         # symbol → 加入順序（同等級時先加入者在前，保留 Yahoo 的相關度排序）
+        self._haystacks: dict = {}     # symbol → 供子字串比對的正規化文字（所有名稱串在一起）
+        self._keys: list = []          # 排序的 (前綴 key, symbol)
+        self._symbol_keys: dict = {}   # symbol → {前綴 key, ...}，淘汰時用
+        self._postings: dict = {}      # gram → {symbol, ...}
+        self._learned: OrderedDict = OrderedDict()  # 非固定收錄的代號，依最近出現排序
+        self._added = 0
+        self.searches = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, symbol: str) -> bool:
+        return symbol in self._entries
+
+    def add(self, result: dict, aliases: tuple = (), pinned: bool = False) -> None:
+        """加入或補充一筆：result 需有 symbol/name/exchange/display。
+
+        代號已存在時不覆蓋原本的顯示內容，只把新名稱（與 aliases）當別名補進索引。
+        pinned=False 的代號計入 max_learned 上限，超過時淘汰最久沒再加入的。
+        """
+        symbol = result["symbol"]
+        with self._lock:
+            if symbol not in self._entries:
+                self._entries[symbol] = result
+                self._order[symbol] = self._added
+                self._added += 1
+                self._haystacks[symbol] = ""
+                self._symbol_keys[symbol] = set()
+                base = symbol.split(".")[0]
+                for key in {_compact(symbol), _compact(base)}:
+                    self._insert_key(key, symbol)
+                if not pinned:
+                    self._learned[symbol] = None
+            if pinned:
+                self._learned.pop(symbol, None)
+            elif symbol in self._learned:
+                self._learned.move_to_end(symbol)
+            for name in (result.get("name"), *aliases):
+                self._add_name(symbol, name)
+            while len(self._learned) > self.max_learned:
+                oldest, _ = self._learned.popitem(last=False)
+                self._remove(oldest)
+                self.evictions += 1
+
+    def _remove(self, symbol: str) -> None:
+        del self._entries[symbol]
+        del self._order[symbol]
+        for key in self._symbol_keys.pop(symbol):
+            item = (key, symbol)
+            pos = bisect.bisect_left(self._keys, item)
+            if pos < len(self._keys) and self._keys[pos] == item:
+                del self._keys[pos]
+        for word in self._haystacks.pop(symbol).split("|"):
+            for gram in _grams(word):
+                symbols = self._postings.get(gram)
+                if symbols is not None:
+                    symbols.discard(symbol)
+                    if not symbols:
+                        del self._postings[gram]
+
+    def _add_name(self, symbol: str, name: str | None) -> None:
+        compact = _compact(name or "")
+        names = self._haystacks[symbol].split("|")
+        if not compact or compact in names or len(names) > _MAX_TERMS:
+            return
+        self._haystacks[symbol] += "|" + compact
+        self._insert_key(compact, symbol)
+        for word in _normalize(name).replace("/", " ").split():
+            self._insert_key(word, symbol)
+        for gram in _grams(compact):
+            self._postings.setdefault(gram, set()).add(symbol)
+
+    def _insert_key(self, key: str, symbol: str) -> None:
+        item = (key, symbol)
+        pos = bisect.bisect_left(self._keys, item)
+        if pos == len(self._keys) or self._keys[pos] != item:
+            self._keys.insert(pos, item)
+        self._symbol_keys[symbol].add(key)
+        # 代號本身也要能被子字串 / 模糊比對找到
+        if symbol in self._haystacks and key not in self._haystacks[symbol].split("|"):
+            self._haystacks[symbol] += "|" + key
+            for gram in _grams(key):
+                self._postings.setdefault(gram, set()).add(symbol)
+
+    def _prefix_hits(self, q: str) -> list:
+        hits = []
+        pos = bisect.bisect_left(self._keys, (q, ""))
+        end = min(len(self._keys), pos + _MAX_PREFIX_SCAN)
+        while pos < end and self._keys[pos][0].startswith(q):
+            hits.append(self._keys[pos][1])
+            pos += 1
+        return hits
+
+    def search(self, query: str, limit: int = 10) -> list:
+        """依相關度回傳最多 limit 筆：代號完全相符 > 代號前綴 > 名稱前綴 > 子字串；都沒有才做模糊比對。"""
+        q = _compact(query)
+        if not q:
+            return []
+        with self._lock:
+            self.searches += 1
+            ranked: dict = {}
+
+            def _rank(symbol: str, tier: int) -> None:
+                if tier < ranked.get(symbol, 99):
+                    ranked[symbol] = tier
+
+            for symbol in self._prefix_hits(q):
+                base = _compact(symbol.split(".")[0])
+                if q in (_compact(symbol), base):
+                    _rank(symbol, 0)
+                elif _compact(symbol).startswith(q) or base.startswith(q):
+                    _rank(symbol, 1)
+                else:
+                    _rank(symbol, 2)
+
+            grams = _grams(q)
+            if len(ranked) < limit and grams:
+                postings = [self._postings.get(g, set()) for g in grams]
+                for symbol in set.intersection(*postings):
+                    if q in self._haystacks[symbol]:
+                        _rank(symbol, 3)
+
+            # 模糊比對只在完全沒有結果時才做，避免短字詞帶出一堆不相干的代號
+            if not ranked and len(q) >= 3:
+                candidates = set().union(*(self._postings.get(g, set()) for g in grams))
+                for symbol in candidates - ranked.keys():
+                    words = self._haystacks[symbol].split("|")
+                    if any(_dice(grams, _grams(w)) >= _FUZZY_THRESHOLD for w in words if w):
+                        _rank(symbol, 4)
+
+            order = sorted(ranked, key=lambda s: (ranked[s], self._order[s]))
+            return [self._entries[s] for s in order[:limit]]
+
+    def stats(self) -> dict:
+        return {
+            "symbols": len(self._entries),
+            "learned": len(self._learned),
+            "max_learned": self.max_learned,
+            "keys": len(self._keys),
+            "searches": self.searches,
+            "evictions": self.evictions,
+        }
+
+
+symbol_index = SymbolIndex()
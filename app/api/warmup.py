@@ -0,0 +1,177 @@
+"""啟動預熱：部署後第一次開頁不必每列都等上游。
+
+1. 啟動時（lifespan 內、開始服務前）把 stock_prices 裡上次存下的報價放進 yahoo_cache，
+   標記 stale: true 與 as_of（資料庫寫入時間），只活 _STALE_QUOTE_TTL 秒，
+   背景刷新一取到新報價就會蓋掉；
+2. 開始服務後在背景依「被最多清單收藏」排序取前 WARMUP_TICKERS 支，
+   預取報價、sparkline（整批一次）與 3m 走勢（走勢圖有並行上限），全部走既有的快取與 single-flight；
+3. 進度與是否完成由 /health 回報。
+"""
+import asyncio
+import logging
+import time
+
+from app.api import stock
+from app.models.db import db_connection
+
+logger = logging.getLogger(__name__)
+
+# 背景預熱的代號數（依收藏數排序）
+WARMUP_TICKERS = 50
+# 3m 走勢同時預取幾支（每支要讀 / 同步一條日 K 序列）
+HISTORY_CONCURRENCY = 4
+# 預熱最多等多久：超過就視為完成（上游太慢時不能讓 /health 一直回未就緒）
+WARMUP_TIMEOUT_SECONDS = 90
+# 資料庫帶出來的舊報價只撐到背景刷新取到新的為止
+_STALE_QUOTE_TTL = 60
+
+_QUOTE_COLUMNS = (
+    "ticker", "price", "prev_close", "price_change", "price_change_percent",
+    "company_name", "logo_url", "market_state", "extended_price",
+    "extended_type", "extended_change", "extended_change_percent",
+)
+_NUMERIC_COLUMNS = {
+    "price", "prev_close", "price_change", "price_change_percent",
+    "extended_price", "extended_change", "extended_change_percent",
+}
+
+
+def _db_stored_quotes() -> list:
+    """stock_prices 內所有報價，數值轉成 float（與上游報價同型別），附上 as_of。"""
+    with db_connection() as conn:
+        cur = conn.cursor()
+        try:
+            cur.execute(f"SELECT {', '.join(_QUOTE_COLUMNS)}, updated_at FROM stock_prices")
+            quotes = []
+            for row in cur.fetchall():
+                data = dict(zip(_QUOTE_COLUMNS, row[:-1]))
+                for column in _NUMERIC_COLUMNS:
+                    if data[column] is not None:
+                        data[column] = float(data[column])
+                data["stale"] = True
+                data["as_of"] = row[-1].isoformat() if row[-1] else None
+                quotes.append(data)
+            return quotes
+        finally:
+            cur.close()
+
+
+def _db_most_watched(limit: int) -> list:
+    with db_connection() as conn:
+        cur = conn.cursor()
+        try:
+            cur.execute(
+                """SELECT ticker FROM watchlist_stocks
+                   GROUP BY ticker ORDER BY COUNT(*) DESC, ticker LIMIT %s""",
+                (limit,),
+            )
+            return [row[0] for row in cur.fetchall()]
+        finally:
+            cur.close()
+
+
+def preload_stale_quotes() -> int:
+    """把資料庫裡的舊報價放進 yahoo_cache（已有報價的不覆蓋），回傳放入筆數。同步操作，於 to_thread 內呼叫。"""
+    count = 0
+    for data in _db_stored_quotes():
+        if data.get("price") is None or stock.yahoo_cache.get(data["ticker"]) is not None:
+            continue
+        stock.yahoo_cache.set(data["ticker"], data, ttl=_STALE_QUOTE_TTL)
+        count += 1
+    return count
+
+
+class Warmup:
+    def __init__(self):
+        self._task: asyncio.Task | None = None
+        self.state = "pending"   # pending → warming → ready
+        self.preloaded_quotes = 0
+        self.tickers = 0
+        self.quotes = 0
+        self.sparklines = 0
+        self.histories = 0
+        self.timed_out = False
+        self.duration_seconds = None
+
+    @property
+    def ready(self) -> bool:
+        return self.state == "ready"
+
+    async def preload(self) -> None:
+        """開始服務前呼叫：只讀一次資料庫，不打上游。"""
+        try:
+            self.preloaded_quotes = await asyncio.to_thread(preload_stale_quotes)
+            logger.info(f"已由資料庫預載 {self.preloaded_quotes} 筆報價（標記為 stale）")
+        except Exception as e:
+            logger.error(f"預載資料庫報價失敗: {e}")
+
+    async def _prefetch(self) -> None:
+        tickers = await asyncio.to_thread(_db_most_watched, WARMUP_TICKERS)
+        self.tickers = len(tickers)
+        if not tickers:
+            return
+
+        # 資料庫帶出來的舊報價不算數，照樣向上游取
+        need_quotes = [t for t in tickers if (stock._cached_quote(t) or {"stale": True}).get("stale")]
+
+        async def _quotes() -> None:
+            if need_quotes:
+                results = await stock._fetch_quotes(need_quotes)
+                self.quotes = sum(1 for data in results.values() if data)
+
+        async def _sparklines() -> None:
+            results = await stock._sparklines_for(tickers)
+            self.sparklines = sum(1 for data in results.values() if data.get("points"))
+
+        slots = asyncio.Semaphore(HISTORY_CONCURRENCY)
+
+        async def _history(ticker: str) -> None:
+            async with slots:
+                data = await stock._history_for(ticker, "3m")
+            if data.get("close"):
+                self.histories += 1
+
+        await asyncio.gather(_quotes(), _sparklines(), *(_history(t) for t in tickers))
+
+    async def _run(self) -> None:
+        self.state = "warming"
+        start = time.perf_counter()
+        try:
+            await asyncio.wait_for(self._prefetch(), WARMUP_TIMEOUT_SECONDS)
+        except asyncio.TimeoutError:
+            self.timed_out = True
+            logger.warning(f"快取預熱超過 {WARMUP_TIMEOUT_SECONDS} 秒，先視為完成")
+        except Exception as e:
+            logger.error(f"快取預熱失敗: {e}")
+        self.duration_seconds = round(time.perf_counter() - start, 1)
+        self.state = "ready"
+        logger.info(f"快取預熱完成: {self.stats()}")
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    def stats(self) -> dict:
+        return {
+            "state": self.state,
+            "preloaded_quotes": self.preloaded_quotes,
+            "tickers": self.tickers,
+            "quotes": self.quotes,
+            "sparklines": self.sparklines,
+            "histories": self.histories,
+            "timed_out": self.timed_out,
+            "duration_seconds": self.duration_seconds,
+        }
+
+
+warmup = Warmup()
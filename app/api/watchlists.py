@@ -16,7 +16,7 @@ from pydantic import BaseModel
 from typing import List
 
 from app.core.security import current_user_email
-from app.models.db import get_db_connection
+from app.models.db import db_connection
 from app.models.migrations import DEFAULT_WATCHLIST_NAME
 
 logger = logging.getLogger(__name__)
@@ -72,122 +72,117 @@ _LIST_SQL = """
 
 def _db_list_watchlists(user_email: str) -> list:
     """回傳清單列表；使用者若還沒有任何清單，lazy 建立一個預設清單。"""
-    conn = get_db_connection()
-    cur = conn.cursor(cursor_factory=RealDictCursor)
-    try:
-        cur.execute(_LIST_SQL, (user_email,))
-        rows = [dict(r) for r in cur.fetchall()]
-        if rows:
-            return rows
+    with db_connection() as conn:
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        try:
+            cur.execute(_LIST_SQL, (user_email,))
+            rows = [dict(r) for r in cur.fetchall()]
+            if rows:
+                return rows
+
+            try:
+                cur.execute(
+                    """INSERT INTO watchlists (user_email, name, display_order)
+                       VALUES (%s, %s, 0)""",
+                    (user_email, DEFAULT_WATCHLIST_NAME),
+                )
+            except psycopg2.errors.ForeignKeyViolation:
+                conn.rollback()
+                raise HTTPException(status_code=404, detail="找不到使用者")
+            conn.commit()
+            cur.execute(_LIST_SQL, (user_email,))
+            return [dict(r) for r in cur.fetchall()]
+        finally:
+            cur.close()
+
 
+def _db_create_watchlist(user_email: str, name: str) -> dict:
+    with db_connection() as conn:
+        cur = conn.cursor(cursor_factory=RealDictCursor)
         try:
+            cur.execute(
+                "SELECT COALESCE(MAX(display_order), -1) + 1 AS next FROM watchlists WHERE user_email = %s",
+                (user_email,),
+            )
+            next_order = cur.fetchone()["next"]
             cur.execute(
                 """INSERT INTO watchlists (user_email, name, display_order)
-                   VALUES (%s, %s, 0)""",
-                (user_email, DEFAULT_WATCHLIST_NAME),
+                   VALUES (%s, %s, %s)
+                   RETURNING id, name, display_order, 0 AS count""",
+                (user_email, name, next_order),
             )
-        except psycopg2.errors.ForeignKeyViolation:
+            row = dict(cur.fetchone())
+            conn.commit()
+            return row
+        except psycopg2.errors.UniqueViolation as e:
             conn.rollback()
-            raise HTTPException(status_code=404, detail="找不到使用者")
-        conn.commit()
-        cur.execute(_LIST_SQL, (user_email,))
-        return [dict(r) for r in cur.fetchall()]
-    finally:
-        cur.close()
-        conn.close()
-
-
-def _db_create_watchlist(user_email: str, name: str) -> dict:
-    conn = get_db_connection()
-    cur = conn.cursor(cursor_factory=RealDictCursor)
-    try:
-        cur.execute(
-            "SELECT COALESCE(MAX(display_order), -1) + 1 AS next FROM watchlists WHERE user_email = %s",
-            (user_email,),
-        )
-        next_order = cur.fetchone()["next"]
-        cur.execute(
-            """INSERT INTO watchlists (user_email, name, display_order)
-               VALUES (%s, %s, %s)
-               RETURNING id, name, display_order, 0 AS count""",
-            (user_email, name, next_order),
-        )
-        row = dict(cur.fetchone())
-        conn.commit()
-        return row
-    except psycopg2.errors.UniqueViolation as e:
-        conn.rollback()
-        if e.diag.constraint_name != "idx_watchlists_user_name":
-            raise
-        raise HTTPException(status_code=400, detail="清單名稱已存在")
-    finally:
-        cur.close()
-        conn.close()
+            if e.diag.constraint_name != "idx_watchlists_user_name":
+                raise
+            raise HTTPException(status_code=400, detail="清單名稱已存在")
+        finally:
+            cur.close()
 
 
 def _db_rename_watchlist(user_email: str, watchlist_id: int, name: str) -> dict:
-    conn = get_db_connection()
-    cur = conn.cursor(cursor_factory=RealDictCursor)
-    try:
-        _assert_owns(cur, user_email, watchlist_id)
-        cur.execute(
-            """UPDATE watchlists SET name = %s, updated_at = NOW()
-               WHERE id = %s AND user_email = %s
-               RETURNING id, name, display_order,
-                   (SELECT COUNT(*) FROM watchlist_stocks ws WHERE ws.watchlist_id = %s) AS count""",
-            (name, watchlist_id, user_email, watchlist_id),
-        )
-        row = dict(cur.fetchone())
-        conn.commit()
-        return row
-    except psycopg2.errors.UniqueViolation as e:
-        conn.rollback()
-        if e.diag.constraint_name != "idx_watchlists_user_name":
-            raise
-        raise HTTPException(status_code=400, detail="清單名稱已存在")
-    finally:
-        cur.close()
-        conn.close()
+    with db_connection() as conn:
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        try:
+            _assert_owns(cur, user_email, watchlist_id)
+            cur.execute(
+                """UPDATE watchlists SET name = %s, updated_at = NOW()
+                   WHERE id = %s AND user_email = %s
+                   RETURNING id, name, display_order,
+                       (SELECT COUNT(*) FROM watchlist_stocks ws WHERE ws.watchlist_id = %s) AS count""",
+                (name, watchlist_id, user_email, watchlist_id),
+            )
+            row = dict(cur.fetchone())
+            conn.commit()
+            return row
+        except psycopg2.errors.UniqueViolation as e:
+            conn.rollback()
+            if e.diag.constraint_name != "idx_watchlists_user_name":
+                raise
+            raise HTTPException(status_code=400, detail="清單名稱已存在")
+        finally:
+            cur.close()
 
 
 def _db_delete_watchlist(user_email: str, watchlist_id: int) -> None:
-    conn = get_db_connection()
-    cur = conn.cursor()
-    try:
-        _assert_owns(cur, user_email, watchlist_id)
-        # FOR UPDATE 鎖住該使用者所有清單列，避免兩個並發刪除同時讀到「還有兩個」
-        # 而雙雙通過檢查，導致清單被刪光（違反「至少保留一個」的不變量）。
-        cur.execute(
-            "SELECT COUNT(*) FROM (SELECT 1 FROM watchlists WHERE user_email = %s FOR UPDATE) t",
-            (user_email,),
-        )
-        if cur.fetchone()[0] <= 1:
-            raise HTTPException(status_code=400, detail="至少要保留一個清單")
-        # watchlist_stocks 有 ON DELETE CASCADE，歸屬列會一併刪除
-        cur.execute(
-            "DELETE FROM watchlists WHERE id = %s AND user_email = %s",
-            (watchlist_id, user_email),
-        )
-        conn.commit()
-    finally:
-        cur.close()
-        conn.close()
+    with db_connection() as conn:
+        cur = conn.cursor()
+        try:
+            _assert_owns(cur, user_email, watchlist_id)
+            # FOR UPDATE 鎖住該使用者所有清單列，避免兩個並發刪除同時讀到「還有兩個」
+            # 而雙雙通過檢查，導致清單被刪光（違反「至少保留一個」的不變量）。
+            cur.execute(
+                "SELECT COUNT(*) FROM (SELECT 1 FROM watchlists WHERE user_email = %s FOR UPDATE) t",
+                (user_email,),
+            )
+            if cur.fetchone()[0] <= 1:
+                raise HTTPException(status_code=400, detail="至少要保留一個清單")
+            # watchlist_stocks 有 ON DELETE CASCADE，歸屬列會一併刪除
+            cur.execute(
+                "DELETE FROM watchlists WHERE id = %s AND user_email = %s",
+                (watchlist_id, user_email),
+            )
+            conn.commit()
+        finally:
+            cur.close()
 
 
 def _db_reorder_watchlists(user_email: str, ids: list) -> None:
-    conn = get_db_connection()
-    cur = conn.cursor()
-    try:
-        for index, watchlist_id in enumerate(ids):
-            cur.execute(
-                """UPDATE watchlists SET display_order = %s, updated_at = NOW()
-                   WHERE id = %s AND user_email = %s""",
-                (index, watchlist_id, user_email),
-            )
-        conn.commit()
-    finally:
-        cur.close()
-        conn.close()
+    with db_connection() as conn:
+        cur = conn.cursor()
+        try:
+            for index, watchlist_id in enumerate(ids):
+                cur.execute(
+                    """UPDATE watchlists SET display_order = %s, updated_at = NOW()
+                       WHERE id = %s AND user_email = %s""",
+                    (index, watchlist_id, user_email),
+                )
+            conn.commit()
+        finally:
+            cur.close()
 
 
 @router.get("/watchlists")
@@ -265,113 +260,108 @@ _STOCKS_SQL = """
 
 
 def _db_fetch_watchlist_stocks(user_email: str, watchlist_id: int) -> list:
-    conn = get_db_connection()
-    cur = conn.cursor(cursor_factory=RealDictCursor)
-    try:
-        _assert_owns(cur, user_email, watchlist_id)
-        cur.execute(_STOCKS_SQL, (watchlist_id,))
-        return [dict(r) for r in cur.fetchall()]
-    finally:
-        cur.close()
-        conn.close()
+    with db_connection() as conn:
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        try:
+            _assert_owns(cur, user_email, watchlist_id)
+            cur.execute(_STOCKS_SQL, (watchlist_id,))
+            return [dict(r) for r in cur.fetchall()]
+        finally:
+            cur.close()
 
 
 def _db_fetch_memberships(user_email: str, ticker: str) -> list:
-    conn = get_db_connection()
-    cur = conn.cursor()
-    try:
-        cur.execute(
-            """SELECT ws.watchlist_id
-               FROM watchlist_stocks ws
-               JOIN watchlists w ON w.id = ws.watchlist_id
-               WHERE w.user_email = %s AND ws.ticker = %s
-               ORDER BY w.display_order, w.id""",
-            (user_email, ticker),
-        )
-        return [r[0] for r in cur.fetchall()]
-    finally:
-        cur.close()
-        conn.close()
+    with db_connection() as conn:
+        cur = conn.cursor()
+        try:
+            cur.execute(
+                """SELECT ws.watchlist_id
+                   FROM watchlist_stocks ws
+                   JOIN watchlists w ON w.id = ws.watchlist_id
+                   WHERE w.user_email = %s AND ws.ticker = %s
+                   ORDER BY w.display_order, w.id""",
+                (user_email, ticker),
+            )
+            return [r[0] for r in cur.fetchall()]
+        finally:
+            cur.close()
 
 
 def _db_set_memberships(user_email: str, ticker: str, watchlist_ids: list) -> None:
     """全量覆蓋某 ticker 的歸屬：勾選的加入（接在清單末端）、未勾選的移除。"""
-    conn = get_db_connection()
-    cur = conn.cursor()
-    try:
-        for watchlist_id in watchlist_ids:
-            _assert_owns(cur, user_email, watchlist_id)
+    with db_connection() as conn:
+        cur = conn.cursor()
+        try:
+            for watchlist_id in watchlist_ids:
+                _assert_owns(cur, user_email, watchlist_id)
+
+            # 移除未勾選的（限縮在該使用者自己的清單內）
+            if watchlist_ids:
+                cur.execute(
+                    """DELETE FROM watchlist_stocks ws
+                       USING watchlists w
+                       WHERE ws.watchlist_id = w.id
+                         AND w.user_email = %s
+                         AND ws.ticker = %s
+                         AND NOT (ws.watchlist_id = ANY(%s))""",
+                    (user_email, ticker, watchlist_ids),
+                )
+            else:
+                cur.execute(
+                    """DELETE FROM watchlist_stocks ws
+                       USING watchlists w
+                       WHERE ws.watchlist_id = w.id
+                         AND w.user_email = %s
+                         AND ws.ticker = %s""",
+                    (user_email, ticker),
+                )
+
+            # 加入勾選但還沒有的（display_order 接在該清單末端）
+            # ON CONFLICT DO NOTHING 讓重複插入原子化地略過，避免併發重複提交時
+            # 因 idx_unique_watchlist_ticker 撞號而丟出未捕捉的 UniqueViolation
+            for watchlist_id in watchlist_ids:
+                cur.execute(
+                    """INSERT INTO watchlist_stocks (user_email, watchlist_id, ticker, display_order)
+                       SELECT %s, %s, %s,
+                              COALESCE((SELECT MAX(display_order) + 1 FROM watchlist_stocks
+                                        WHERE watchlist_id = %s), 0)
+                       ON CONFLICT (watchlist_id, ticker) DO NOTHING""",
+                    (user_email, watchlist_id, ticker, watchlist_id),
+                )
+            conn.commit()
+        finally:
+            cur.close()
 
-        # 移除未勾選的（限縮在該使用者自己的清單內）
-        if watchlist_ids:
-            cur.execute(
-                """DELETE FROM watchlist_stocks ws
-                   USING watchlists w
-                   WHERE ws.watchlist_id = w.id
-                     AND w.user_email = %s
-                     AND ws.ticker = %s
-                     AND NOT (ws.watchlist_id = ANY(%s))""",
-                (user_email, ticker, watchlist_ids),
-            )
-        else:
-            cur.execute(
-                """DELETE FROM watchlist_stocks ws
-                   USING watchlists w
-                   WHERE ws.watchlist_id = w.id
-                     AND w.user_email = %s
-                     AND ws.ticker = %s""",
-                (user_email, ticker),
-            )
 
-        # 加入勾選但還沒有的（display_order 接在該清單末端）
-        # ON CONFLICT DO NOTHING 讓重複插入原子化地略過，避免併發重複提交時
-        # 因 idx_unique_watchlist_ticker 撞號而丟出未捕捉的 UniqueViolation
-        for watchlist_id in watchlist_ids:
+def _db_remove_stock(user_email: str, watchlist_id: int, ticker: str) -> None:
+    with db_connection() as conn:
+        cur = conn.cursor()
+        try:
+            _assert_owns(cur, user_email, watchlist_id)
             cur.execute(
-                """INSERT INTO watchlist_stocks (user_email, watchlist_id, ticker, display_order)
-                   SELECT %s, %s, %s,
-                          COALESCE((SELECT MAX(display_order) + 1 FROM watchlist_stocks
-                                    WHERE watchlist_id = %s), 0)
-                   ON CONFLICT (watchlist_id, ticker) DO NOTHING""",
-                (user_email, watchlist_id, ticker, watchlist_id),
+                """DELETE FROM watchlist_stocks
+                   WHERE watchlist_id = %s AND ticker = %s AND user_email = %s""",
+                (watchlist_id, ticker, user_email),
             )
-        conn.commit()
-    finally:
-        cur.close()
-        conn.close()
-
-
-def _db_remove_stock(user_email: str, watchlist_id: int, ticker: str) -> None:
-    conn = get_db_connection()
-    cur = conn.cursor()
-    try:
-        _assert_owns(cur, user_email, watchlist_id)
-        cur.execute(
-            """DELETE FROM watchlist_stocks
-               WHERE watchlist_id = %s AND ticker = %s AND user_email = %s""",
-            (watchlist_id, ticker, user_email),
-        )
-        conn.commit()
-    finally:
-        cur.close()
-        conn.close()
+            conn.commit()
+        finally:
+            cur.close()
 
 
 def _db_reorder_stocks(user_email: str, watchlist_id: int, tickers: list) -> None:
-    conn = get_db_connection()
-    cur = conn.cursor()
-    try:
-        _assert_owns(cur, user_email, watchlist_id)
-        for index, ticker in enumerate(tickers):
-            cur.execute(
-                """UPDATE watchlist_stocks SET display_order = %s, updated_at = NOW()
-                   WHERE watchlist_id = %s AND ticker = %s AND user_email = %s""",
-                (index, watchlist_id, ticker, user_email),
-            )
-        conn.commit()
-    finally:
-        cur.close()
-        conn.close()
+    with db_connection() as conn:
+        cur = conn.cursor()
+        try:
+            _assert_owns(cur, user_email, watchlist_id)
+            for index, ticker in enumerate(tickers):
+                cur.execute(
+                    """UPDATE watchlist_stocks SET display_order = %s, updated_at = NOW()
+                       WHERE watchlist_id = %s AND ticker = %s AND user_email = %s""",
+                    (index, watchlist_id, ticker, user_email),
+                )
+            conn.commit()
+        finally:
+            cur.close()
 
 
 @router.get("/watchlists/{watchlist_id}/stocks")
@@ -0,0 +1,223 @@
+"""有上限、帶 TTL 的 LRU 快取。
+
+取代原本散在各模組、永不淘汰的 dict 快取：autocomplete 之類的路徑可以塞進任意 key，
+plain dict 只會一直長大。每個快取都有筆數上限（超過就淘汰最久沒用的）、
+逐筆的到期時間，以及命中/未命中/淘汰次數與記憶體粗估，供 /metrics 觀察。
+
+建立時可給 backend（見 app/core/shared_cache.py）作為跨 worker 共用的第二層。
+"""
+import asyncio
+import pickle
+import sys
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable
+
+# 所有 TTLCache 實例，供 /metrics 列出統計
+_registry: dict = {}
+
+_MISSING = object()
+
+
+def estimate_size(obj: Any, _depth: int = 0) -> int:
+    """粗估物件佔用的位元組數（遞迴加總容器內容，深度有限）。
+
+    只求量級正確，供觀察用；不追蹤共用參照，也不保證精確。
+    """
+    size = sys.getsizeof(obj)
+    if _depth >= 4:
+        return size
+    if isinstance(obj, dict):
+        size += sum(estimate_size(k, _depth + 1) + estimate_size(v, _depth + 1) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(estimate_size(v, _depth + 1) for v in obj)
+    return size
+
+
+class TTLCache:
+    """執行緒安全的 LRU + TTL 快取。
+
+    ttl 為預設存活秒數；ttl_policy(value) 若有給，會在寫入時依值決定該筆的存活秒數
+    （例如報價依市場狀態決定快取多久）。set() 明確帶 ttl 時以它為準。
+
+    有 backend 時，set() / pop() / clear() 另外排入共用層的背景寫入（序列化也在背景做，不佔呼叫端），
+    get() 在記憶體未命中時改讀共用層並放回記憶體；aget() 相同，但共用層的讀取在 worker thread 做。
+    __contains__ / ttl_remaining 只看記憶體。
+    """
+
+    def __init__(
+        self,
+        name: str,
+        maxsize: int,
+        ttl: float | None = None,
+        ttl_policy: Callable[[Any], float] | None = None,
+        backend=None,
+    ):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.ttl_policy = ttl_policy
+        self.backend = backend
+        self._data: OrderedDict = OrderedDict()  # key -> (value, 到期的 monotonic 時間, 粗估大小)
+        self._lock = threading.RLock()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.shared_hits = 0
+        _registry[name] = self
+
+    def _ttl_for(self, value, ttl: float | None) -> float | None:
+        if ttl is not None:
+            return ttl
+        if self.ttl_policy is not None:
+            return self.ttl_policy(value)
+        return self.ttl
+
+    def _drop(self, key) -> None:
+        _, _, size = self._data.pop(key)
+        self._bytes -= size
+
+    def _lookup(self, key):
+        """回傳未過期的值或 _MISSING；過期的順手移除。不計入命中統計。"""
+        entry = self._data.get(key)
+        if entry is None:
+            return _MISSING
+        value, expires_at, _ = entry
+        if expires_at is not None and time.monotonic() >= expires_at:
+            self._drop(key)
+            self.expirations += 1
+            return _MISSING
+        return value
+
+    def _store(self, key, value, ttl: float | None, size: int) -> None:
+        expires_at = time.monotonic() + ttl if ttl is not None else None
+        with self._lock:
+            if key in self._data:
+                self._drop(key)
+            self._data[key] = (value, expires_at, size)
+            self._bytes += size
+            while len(self._data) > self.maxsize:
+                oldest = next(iter(self._data))
+                self._drop(oldest)
+                self.evictions += 1
+
+    def _load_shared(self, key):
+        """從共用層讀一筆並放回記憶體（沿用共用層記的到期時間）；沒有或讀不出來回 _MISSING。"""
+        row = self.backend.get(self.name, str(key))
+        if row is None:
+            return _MISSING
+        blob, expires_at = row
+        try:
+            value = pickle.loads(blob)
+        except Exception:
+            return _MISSING
+        ttl = expires_at - time.time() if expires_at is not None else None
+        self._store(key, value, ttl, len(blob))
+        return value
+
+    def _get_memory(self, key):
+        with self._lock:
+            value = self._lookup(key)
+            if value is not _MISSING:
+                self._data.move_to_end(key)
+                self.hits += 1
+            return value
+
+    def _count_shared(self, value, default):
+        with self._lock:
+            if value is _MISSING:
+                self.misses += 1
+                return default
+            self.hits += 1
+            self.shared_hits += 1
+            return value
+
+    def get(self, key: Hashable, default=None):
+        value = self._get_memory(key)
+        if value is not _MISSING:
+            return value
+        if self.backend is not None:
+            return self._count_shared(self._load_shared(key), default)
+        with self._lock:
+            self.misses += 1
+        return default
+
+    async def aget(self, key: Hashable, default=None):
+        """get() 的 async 版：記憶體未命中時，共用層的讀取與反序列化丟到 worker thread，
+        不卡住 event loop（走勢圖之類單筆數百 KB 的快取用這個）。"""
+        value = self._get_memory(key)
+        if value is not _MISSING:
+            return value
+        if self.backend is not None:
+            return self._count_shared(await asyncio.to_thread(self._load_shared, key), default)
+        with self._lock:
+            self.misses += 1
+        return default
+
+    def set(self, key: Hashable, value, ttl: float | None = None) -> None:
+        ttl = self._ttl_for(value, ttl)
+        if self.backend is not None:
+            expires_at = time.time() + ttl if ttl is not None else None
+            self.backend.set(self.name, str(key), value, expires_at)
+        self._store(key, value, ttl, estimate_size(value))
+
+    def update(self, items: dict) -> None:
+        for key, value in items.items():
+            self.set(key, value)
+
+    def pop(self, key: Hashable, default=None):
+        if self.backend is not None:
+            self.backend.delete(self.name, str(key))
+        with self._lock:
+            value = self._lookup(key)
+            if value is _MISSING:
+                return default
+            self._drop(key)
+            return value
+
+    def ttl_remaining(self, key: Hashable) -> float | None:
+        """該筆還能活幾秒；不存在或已過期回 None，永不過期回 inf。"""
+        with self._lock:
+            if self._lookup(key) is _MISSING:
+                return None
+            expires_at = self._data[key][1]
+            if expires_at is None:
+                return float("inf")
+            return expires_at - time.monotonic()
+
+    def clear(self) -> None:
+        if self.backend is not None:
+            self.backend.clear(self.name)
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self._lock:
+            return self._lookup(key) is not _MISSING
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "memory_bytes": self._bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "shared_hits": self.shared_hits if self.backend is not None else None,
+            }
+
+
+def all_stats() -> dict:
+    """所有 TTLCache 的統計，key 為建立時給的名稱。"""
+    return {name: cache.stats() for name, cache in _registry.items()}
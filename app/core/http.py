@@ -0,0 +1,69 @@
+"""共用的 aiohttp ClientSession：每個上游主機一個長駐 session。
+
+每次呼叫都開新 ClientSession 等於每 5 秒輪詢都重做一次 TCP + TLS 握手；
+改成 main.lifespan 啟動時建立、關閉時釋放，連線可跨請求 keep-alive 重用。
+lifespan 沒跑到時（例如測試直接打 TestClient 而未進入 with）會在第一次使用時
+lazy 建立，呼叫端不必分辨。
+"""
+import asyncio
+import logging
+
+import aiohttp
+
+logger = logging.getLogger(__name__)
+
+# 每個上游一組連線參數：limit 為該 session 同時開啟的連線上限
+_HOSTS = {
+    "finnhub": {"limit": 20},
+    "twse": {"limit": 4},       # TWSE 限流嚴格，批次請求本來就只需一兩條連線
+    "sina": {"limit": 8},
+    "deepseek": {"limit": 8},
+}
+
+_KEEPALIVE_SECONDS = 30
+_DNS_CACHE_SECONDS = 300
+
+# name -> (建立時的 event loop, session)；loop 不同代表 session 已不能用
+_sessions: dict = {}
+
+
+def _new_session(name: str) -> aiohttp.ClientSession:
+    limit = _HOSTS.get(name, {}).get("limit", 10)
+    connector = aiohttp.TCPConnector(
+        limit=limit,
+        limit_per_host=limit,
+        keepalive_timeout=_KEEPALIVE_SECONDS,
+        ttl_dns_cache=_DNS_CACHE_SECONDS,
+        enable_cleanup_closed=True,
+    )
+    return aiohttp.ClientSession(connector=connector)
+
+
+def get_session(name: str) -> aiohttp.ClientSession:
+    """取得某上游的共用 session。不要用 async with 包它，否則用完就被關掉。"""
+    loop = asyncio.get_running_loop()
+    entry = _sessions.get(name)
+    if entry is not None:
+        owner_loop, session = entry
+        if owner_loop is loop and not session.closed:
+            return session
+    session = _new_session(name)
+    _sessions[name] = (loop, session)
+    return session
+
+
+async def init_sessions() -> None:
+    """於 lifespan 啟動時預先建立所有上游的 session。"""
+    for name in _HOSTS:
+        get_session(name)
+
+
+async def close_sessions() -> None:
+    """於 lifespan 關閉時釋放所有 session 與其連線。"""
+    entries = list(_sessions.values())
+    _sessions.clear()
+    for _, session in entries:
+        try:
+            await session.close()
+        except Exception as e:
+            logger.error(f"關閉 HTTP session 失敗: {e}")
@@ -0,0 +1,80 @@
+"""Token bucket 限流：控制對單一上游每秒最多送出幾個請求。
+
+Semaphore 只限制同時進行中的數量；上游回得快時，一樣可能在一秒內打出幾十個請求而被限流。
+token bucket 以固定速率補充 token，容量即允許的瞬間突發量，每個請求先取得一個 token 才送出。
+"""
+import asyncio
+import time
+
+# 所有 TokenBucket 實例，供 /metrics 列出統計
+_registry: dict = {}
+
+
+class TokenBucket:
+    def __init__(self, name: str, rate: float, capacity: float | None = None):
+        """rate 為每秒補充的 token 數，capacity 為最多可累積的 token（預設等於 rate，至少 1）。"""
+        self.name = name
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+        self.acquired = 0
+        self.waited_seconds = 0.0
+        self.rejected = 0  # 給了 timeout 而沒等到 token 的次數
+        _registry[name] = self
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self, tokens: float = 1, timeout: float | None = None) -> bool:
+        """取得 tokens 個 token（一次動作會打多個請求時可一併取）；不足時等到補滿為止。等待者依序（FIFO）取得。
+
+        給 timeout 時最多等這麼多秒（含排隊時間）：等不到就不取、回傳 False，
+        呼叫端可改走其他來源；timeout=0 即不等待，只在當下有 token 時取得。
+        """
+        tokens = min(tokens, self.capacity)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        if deadline is None:
+            await self._lock.acquire()
+        elif self._lock.locked() and timeout <= 0:
+            self.rejected += 1
+            return False
+        else:
+            try:
+                async with asyncio.timeout(timeout):
+                    await self._lock.acquire()
+            except TimeoutError:
+                self.rejected += 1
+                return False
+        try:
+            self._refill()
+            if self._tokens < tokens:
+                wait = (tokens - self._tokens) / self.rate
+                if deadline is not None and time.monotonic() + wait > deadline:
+                    self.rejected += 1
+                    return False
+                self.waited_seconds += wait
+                await asyncio.sleep(wait)
+                self._refill()
+            self._tokens -= tokens
+            self.acquired += tokens
+            return True
+        finally:
+            self._lock.release()
+
+    def stats(self) -> dict:
+        return {
+            "rate": self.rate,
+            "capacity": self.capacity,
+            "acquired": self.acquired,
+            "waited_seconds": round(self.waited_seconds, 2),
+            "rejected": self.rejected,
+        }
+
+
+def all_stats() -> dict:
+    """所有 TokenBucket 的統計，key 為建立時給的名稱。"""
+    return {name: bucket.stats() for name, bucket in _registry.items()}
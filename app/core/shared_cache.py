@@ -0,0 +1,200 @@
+"""跨 worker / 跨重啟共用的快取層：TTLCache 未命中時的第二層（SQLite 檔案）。
+
+TTLCache 只活在單一行程的記憶體：`uvicorn --workers 4` 時四個 worker 各自向上游取同一批代號，
+每次部署重啟也都從空快取開始。設定 CACHE_BACKEND=sqlite 與 CACHE_SQLITE_PATH 後，帶 backend 的 TTLCache 會：
+
+- 寫入時先放進記憶體，序列化（pickle）與寫檔交給背景執行緒（write-behind），不佔用 event loop；
+- 記憶體未命中時讀共用檔案，反序列化一次後放回記憶體，之後的命中不再解碼；
+- 到期時間以牆上時間記在檔案裡，各 worker 讀到的剩餘 TTL 一致。
+
+SQLite 以 WAL 模式開啟，讀取不會被其他 worker 的寫入擋住；寫入都在背景執行緒排隊。
+共用層只是加速：檔案鎖太久、讀寫失敗或寫入佇列滿了都只記次數、當作未命中，不影響請求。
+
+檔案內容會被 unpickle，能寫這個檔的人就能在 app 內執行任意程式碼，所以：
+CACHE_SQLITE_PATH 沒有預設值（未設定就只用記憶體），所在目錄不可為所有人可寫（例如 /tmp），
+檔案須為 app 自己的帳號所有，新建時權限為 0600。
+"""
+import logging
+import os
+import pickle
+import queue
+import sqlite3
+import stat
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# memory：只用各 worker 自己的記憶體（預設）；sqlite：多一層共用檔案（須另外設定 CACHE_SQLITE_PATH）
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "memory")
+CACHE_SQLITE_PATH = os.getenv("CACHE_SQLITE_PATH", "")
+
+# 等其他 worker 釋放寫鎖最多幾秒；快取寫不進去就算了（寫入在背景執行緒，讀取在 WAL 下不必等鎖）
+_BUSY_TIMEOUT_SECONDS = 0.2
+# 每寫入幾次順手清一次過期資料
+_PURGE_EVERY = 1000
+# 背景寫入佇列上限：SQLite 跟不上時直接丟掉新的寫入，不讓佇列無限長大
+_MAX_PENDING_WRITES = 10000
+
+
+def _check_path(path: str) -> None:
+    """拒絕別人也能寫的位置：所在目錄所有人可寫，或檔案已存在但不屬於目前帳號。"""
+    directory = os.path.dirname(os.path.abspath(path))
+    if os.stat(directory).st_mode & stat.S_IWOTH:
+        raise PermissionError(f"{directory} 所有人可寫，不能放共用快取檔")
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        os.close(os.open(path, os.O_CREAT | os.O_WRONLY, 0o600))
+        return
+    if st.st_uid != os.getuid():
+        raise PermissionError(f"{path} 不屬於目前帳號")
+
+
+class SQLiteBackend:
+    """以 (namespace, key) 存放已序列化的值與到期時間（epoch 秒，NULL 表示不過期）。
+
+    get() 同步讀取；set / delete / clear 只放進佇列，由單一背景執行緒依序執行。
+    """
+
+    def __init__(self, path: str):
+        _check_path(path)
+        self.path = path
+        self._local = threading.local()
+        self._writes_since_purge = 0
+        self._pending: queue.Queue = queue.Queue(maxsize=_MAX_PENDING_WRITES)
+        self.reads = 0
+        self.hits = 0
+        self.writes = 0
+        self.dropped_writes = 0
+        self.errors = 0
+        conn = self._conn()
+        conn.execute(
+            """CREATE TABLE IF NOT EXISTS cache_entries (
+                   namespace TEXT NOT NULL,
+                   key TEXT NOT NULL,
+                   value BLOB NOT NULL,
+                   expires_at REAL,
+                   PRIMARY KEY (namespace, key)
+               ) WITHOUT ROWID"""
+        )
+        threading.Thread(target=self._writer, name="shared-cache-writer", daemon=True).start()
+
+    def _conn(self) -> sqlite3.Connection:
+        """每個執行緒一條連線（sqlite3 連線不能跨執行緒共用）。"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=_BUSY_TIMEOUT_SECONDS, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _failed(self, action: str, e: Exception) -> None:
+        self.errors += 1
+        logger.warning(f"共用快取{action}失敗: {e}")
+
+    def get(self, namespace: str, key: str) -> tuple | None:
+        """回傳 (序列化的值, 到期 epoch 秒)；不存在、已過期或讀取失敗回 None。"""
+        self.reads += 1
+        try:
+            row = self._conn().execute(
+                "SELECT value, expires_at FROM cache_entries"
+                " WHERE namespace = ? AND key = ? AND (expires_at IS NULL OR expires_at > ?)",
+                (namespace, key, time.time()),
+            ).fetchone()
+        except sqlite3.Error as e:
+            self._failed("讀取", e)
+            return None
+        if row is not None:
+            self.hits += 1
+        return row
+
+    def _enqueue(self, op: str, *args) -> None:
+        try:
+            self._pending.put_nowait((op, args))
+        except queue.Full:
+            self.dropped_writes += 1
+
+    def set(self, namespace: str, key: str, value, expires_at: float | None) -> None:
+        """排入背景寫入；value 為原始物件，在背景執行緒才 pickle。"""
+        self._enqueue("set", namespace, key, value, expires_at)
+
+    def delete(self, namespace: str, key: str) -> None:
+        self._enqueue("delete", namespace, key)
+
+    def clear(self, namespace: str) -> None:
+        self._enqueue("clear", namespace)
+
+    def flush(self) -> None:
+        """等目前排隊中的寫入都完成（測試與關機用）。"""
+        self._pending.join()
+
+    def _writer(self) -> None:
+        while True:
+            op, args = self._pending.get()
+            try:
+                getattr(self, f"_{op}")(*args)
+            except sqlite3.Error as e:
+                self._failed("寫入", e)
+            except Exception as e:
+                # 序列化失敗（值裡有無法 pickle 的物件）：這筆不進共用層
+                self._failed("序列化", e)
+            finally:
+                self._pending.task_done()
+
+    def _set(self, namespace: str, key: str, value, expires_at: float | None) -> None:
+        blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        conn = self._conn()
+        conn.execute(
+            "INSERT OR REPLACE INTO cache_entries (namespace, key, value, expires_at) VALUES (?, ?, ?, ?)",
+            (namespace, key, blob, expires_at),
+        )
+        self.writes += 1
+        self._writes_since_purge += 1
+        if self._writes_since_purge >= _PURGE_EVERY:
+            self._writes_since_purge = 0
+            conn.execute("DELETE FROM cache_entries WHERE expires_at <= ?", (time.time(),))
+
+    def _delete(self, namespace: str, key: str) -> None:
+        self._conn().execute(
+            "DELETE FROM cache_entries WHERE namespace = ? AND key = ?", (namespace, key))
+
+    def _clear(self, namespace: str) -> None:
+        self._conn().execute("DELETE FROM cache_entries WHERE namespace = ?", (namespace,))
+
+    def stats(self) -> dict:
+        return {
+            "backend": "sqlite",
+            "path": self.path,
+            "reads": self.reads,
+            "hits": self.hits,
+            "hit_rate": round(self.hits / self.reads, 4) if self.reads else None,
+            "writes": self.writes,
+            "pending_writes": self._pending.qsize(),
+            "dropped_writes": self.dropped_writes,
+            "errors": self.errors,
+        }
+
+
+def _configured_backend() -> SQLiteBackend | None:
+    if CACHE_BACKEND == "sqlite":
+        if not CACHE_SQLITE_PATH:
+            logger.error("CACHE_BACKEND=sqlite 但未設定 CACHE_SQLITE_PATH，只使用記憶體快取")
+            return None
+        try:
+            return SQLiteBackend(CACHE_SQLITE_PATH)
+        except (sqlite3.Error, OSError) as e:
+            logger.error(f"共用快取無法開啟（{CACHE_SQLITE_PATH}），只使用記憶體快取: {e}")
+            return None
+    if CACHE_BACKEND != "memory":
+        logger.error(f"不支援的 CACHE_BACKEND={CACHE_BACKEND}，只使用記憶體快取")
+    return None
+
+
+# 依環境變數建立的共用層；未啟用時為 None
+backend = _configured_backend()
+
+
+def stats() -> dict:
+    return backend.stats() if backend is not None else {"backend": "memory"}
@@ -0,0 +1,119 @@
+"""Single-flight：同一個 key 同時只跑一次上游請求，其他併發呼叫等它的結果。
+
+快取過期的瞬間若有 30 個人同時打開同一支股票，沒有這層就會對 yfinance 送出
+30 個一模一樣的請求而被限流。in-flight 的 future 只存在於請求進行中，
+完成即移除，不會變成另一份快取。
+
+上游請求在獨立的 task 裡執行：發起的那個請求被取消（SSE 斷線、預熱逾時、背景刷新停止）
+只會取消它自己的等待，請求照樣跑完，其他搭便車的呼叫照樣拿到結果。
+"""
+import asyncio
+from typing import Awaitable, Callable, Iterable
+
+# 所有 SingleFlight 實例，供 /metrics 列出統計
+_registry: dict = {}
+
+
+def _consume_exception(fut: asyncio.Future) -> None:
+    # 沒有人在等的 future 若帶著例外被回收，asyncio 會印「never retrieved」警告
+    if not fut.cancelled():
+        fut.exception()
+
+
+class SingleFlight:
+    def __init__(self, name: str):
+        self.name = name
+        self._inflight: dict = {}
+        self.misses = 0      # 真的送出上游請求的次數
+        self.coalesced = 0   # 搭上別人請求、沒有另外送出的次數
+        self._tasks: set = set()  # 執行中的上游請求 task（保留參照以免被回收）
+        _registry[name] = self
+
+    def _claim(self, key) -> tuple[asyncio.Future, bool]:
+        """回傳 (future, 是否由自己負責執行)。"""
+        fut = self._inflight.get(key)
+        if fut is not None:
+            self.coalesced += 1
+            return fut, False
+        fut = asyncio.get_running_loop().create_future()
+        fut.add_done_callback(_consume_exception)
+        self._inflight[key] = fut
+        self.misses += 1
+        return fut, True
+
+    def _settle(self, key, fut: asyncio.Future, result=None, error: BaseException | None = None) -> None:
+        if self._inflight.get(key) is fut:
+            del self._inflight[key]
+        if fut.done():
+            return
+        if error is not None:
+            fut.set_exception(error)
+        else:
+            fut.set_result(result)
+
+    def _spawn(self, coro) -> None:
+        task = asyncio.get_running_loop().create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def do(self, key, fn: Callable[[], Awaitable]):
+        """執行 fn()；若同 key 已有進行中的呼叫，改為等待它的結果（例外也一併傳遞）。"""
+        fut, owner = self._claim(key)
+        if owner:
+            async def _run() -> None:
+                try:
+                    result = await fn()
+                except BaseException as e:
+                    self._settle(key, fut, error=e)
+                    return
+                self._settle(key, fut, result)
+
+            self._spawn(_run())
+        return await asyncio.shield(fut)
+
+    async def do_many(self, keys: Iterable, fn: Callable[[list], Awaitable[dict]]) -> dict:
+        """批次版：fn(自己負責的 keys) 回傳 {key: value}；其餘 key 等別人的結果。
+
+        回傳所有 keys 的 {key: value}，fn 沒給到的 key 值為 None。
+        """
+        owned = {}
+        futures = {}
+        for key in dict.fromkeys(keys):
+            fut, owner = self._claim(key)
+            futures[key] = fut
+            if owner:
+                owned[key] = fut
+
+        if owned:
+            async def _run() -> None:
+                try:
+                    fetched = await fn(list(owned))
+                except BaseException as e:
+                    for key, fut in owned.items():
+                        self._settle(key, fut, error=e)
+                    return
+                for key, fut in owned.items():
+                    self._settle(key, fut, fetched.get(key))
+
+            self._spawn(_run())
+
+        results = {}
+        for key, fut in futures.items():
+            results[key] = await asyncio.shield(fut)
+        return results
+
+    def __contains__(self, key) -> bool:
+        """key 目前是否有進行中的呼叫。"""
+        return key in self._inflight
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": len(self._inflight),
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+        }
+
+
+def all_stats() -> dict:
+    """所有 SingleFlight 的統計，key 為建立時給的名稱。"""
+    return {name: flight.stats() for name, flight in _registry.items()}
@@ -1,4 +1,4 @@
-"""資料庫備份：pg_dump 邏輯備份 + 自動輪替。
+"""資料庫備份：pg_dump 邏輯備份 + 自動輪替 + 還原。
 
 設計取捨：
 - 用 pg_dump 而非 volume 快照——可攜、可讀、可還原到任何 PostgreSQL。
@@ -6,97 +6,470 @@
   volume 掛掉時備份會一起陪葬。
 - 跑在 App 既有的 APScheduler 裡，不另外開 cron/launchd：備份機制跟著 repo 走，
   換機器部署不會忘了帶，也不依賴主機排程器。
+- 啟動時的那次備份排在 App 開始服務之後才跑，且近期已有備份就略過；
+  同一時間只允許一個備份在跑（BACKUP_DIR 內的檔案鎖，跨 worker 也有效）。
+
+兩種格式（BACKUP_FORMAT）：
+- directory（預設）：pg_dump -Fd -j，每張表一個壓縮檔，可平行備份、以 pg_restore -j 平行還原。
+  每個資料檔依內容 sha256 放進 BACKUP_DIR/objects/，快照裡的檔案是指向它的 hard link：
+  沒變的表（users、watchlists……）30 份快照只佔一份空間。輪替刪掉快照後，
+  已沒有任何快照引用（link 數剩 1）的物件一併清掉。
+- plain：純 SQL 串流進 gzip 檔（記憶體用量與資料庫大小無關，完整性檢查只看最後一小段），
+  可直接用 psql 還原，不需 pg_restore。
+
+還原：python -m app.models.backup restore --dbname restore_test --create（見 docs/backup-restore.md）。
 """
+import argparse
+import fcntl
 import gzip
+import hashlib
 import logging
 import os
+import resource
+import shutil
 import subprocess
-from datetime import datetime
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
 from pathlib import Path
 
 logger = logging.getLogger(__name__)
 
 BACKUP_DIR = Path(os.getenv("BACKUP_DIR", "/backups"))
+BACKUP_FORMAT = os.getenv("BACKUP_FORMAT", "directory")
+# directory 格式 pg_dump / pg_restore 的平行數（每個 job 各開一條資料庫連線）
+BACKUP_JOBS = int(os.getenv("BACKUP_JOBS", "4"))
 KEEP_COUNT = 30  # 保留最近幾份（含每日與每次啟動產生的）
 FILE_PREFIX = "stockwatch-"
 FILE_SUFFIX = ".sql.gz"
+SNAPSHOT_SUFFIX = ".dump"
+OBJECTS_DIR = "objects"
+# 啟動時若已有比這更新的備份就不再備份（每日排程會接手）
+RECENT_BACKUP_MAX_AGE = timedelta(hours=24)
+LOCK_FILE = ".backup.lock"
+DUMP_TIMEOUT_SECONDS = 300
+# pg_dump 輸出每次讀多少寫進 gzip；結尾留多少供完整性檢查
+_CHUNK_BYTES = 1024 * 1024
+_TAIL_BYTES = 200
+# gzip 壓縮等級：9 慢上數倍、檔案只小一點點
+_GZIP_LEVEL = 6
+# directory 格式裡描述整份 dump 的目錄檔；其餘每個檔案是一張表的資料
+_TOC_FILE = "toc.dat"
+
+# 最近一次備份的報告（大小、耗時、吞吐量、記憶體高峰），供 /metrics
+last_report: dict = {}
+
+
+class BackupInProgress(RuntimeError):
+    """已有另一個備份在跑（啟動備份與每日排程撞在一起，或多個 worker 同時啟動）。"""
 
 
-def _pg_dump_bytes() -> bytes:
-    """呼叫 pg_dump 取得純 SQL。失敗時把 stderr 一併拋出，方便查原因。"""
-    cmd = [
-        "pg_dump",
+def _conn_args(dbname: str | None = None) -> list:
+    return [
         "-h", os.getenv("POSTGRES_HOST", "postgres"),
         "-p", os.getenv("POSTGRES_PORT", "5432"),
         "-U", os.getenv("POSTGRES_USER", "stockwatch"),
-        "-d", os.getenv("POSTGRES_DB", "stockwatch"),
+        "-d", dbname or os.getenv("POSTGRES_DB", "stockwatch"),
+    ]
+
+
+def _pg_dump_cmd(dbname: str | None = None) -> list:
+    return [
+        "pg_dump", *_conn_args(dbname),
         "--no-owner",        # 還原到不同帳號的資料庫時不會卡權限
         "--no-privileges",
     ]
+
+
+def _pg_env() -> dict:
     env = dict(os.environ)
     env["PGPASSWORD"] = os.getenv("POSTGRES_PASSWORD", "")
+    return env
+
 
-    result = subprocess.run(cmd, capture_output=True, env=env, timeout=300)
+def _run_pg(cmd: list, timeout: float = DUMP_TIMEOUT_SECONDS) -> str:
+    """執行 PostgreSQL client 工具並回傳 stdout；失敗時把 stderr 一併拋出。"""
+    result = subprocess.run(cmd, capture_output=True, env=_pg_env(), timeout=timeout)
     if result.returncode != 0:
         raise RuntimeError(
-            f"pg_dump 失敗（returncode={result.returncode}）: "
+            f"{cmd[0]} 失敗（returncode={result.returncode}）: "
             f"{result.stderr.decode('utf-8', 'replace').strip()}"
         )
-    return result.stdout
+    return result.stdout.decode("utf-8", "replace")
+
+
+def _stream_dump(out, dbname: str | None = None) -> tuple:
+    """pg_dump 的輸出逐塊寫進 out（gzip 檔），回傳 (原始位元組數, 結尾 _TAIL_BYTES)。
+
+    不把整份 dump 放進記憶體：任何時候只持有一塊 _CHUNK_BYTES 與結尾緩衝。
+    逾時會直接砍掉 pg_dump；失敗時把 stderr 一併拋出，方便查原因。
+    """
+    with tempfile.TemporaryFile() as stderr:
+        proc = subprocess.Popen(_pg_dump_cmd(dbname), stdout=subprocess.PIPE, stderr=stderr, env=_pg_env())
+        timed_out = threading.Event()
+
+        def _kill() -> None:
+            timed_out.set()
+            proc.kill()
+
+        watchdog = threading.Timer(DUMP_TIMEOUT_SECONDS, _kill)
+        watchdog.start()
+        size = 0
+        tail = b""
+        try:
+            while chunk := proc.stdout.read(_CHUNK_BYTES):
+                out.write(chunk)
+                size += len(chunk)
+                tail = (tail + chunk)[-_TAIL_BYTES:]
+        finally:
+            watchdog.cancel()
+            proc.stdout.close()
+            returncode = proc.wait()
+        if returncode != 0:
+            stderr.seek(0)
+            reason = f"逾時（{DUMP_TIMEOUT_SECONDS} 秒）" if timed_out.is_set() else ""
+            raise RuntimeError(
+                f"pg_dump 失敗{reason}（returncode={returncode}）: "
+                f"{stderr.read().decode('utf-8', 'replace').strip()}"
+            )
+    return size, tail
 
 
-def _looks_complete(dump: bytes) -> bool:
+def _looks_complete(size: int, tail: bytes) -> bool:
     """粗略驗證 dump 不是空的或半截的。
 
     備份最危險的失敗模式是「檔案有產生但內容不完整」——那會讓人以為有備份。
     pg_dump 正常結束時最後一行是 `-- PostgreSQL database dump complete`。
     """
-    if len(dump) < 1024:
+    if size < 1024:
         return False
-    tail = dump[-200:]
     return b"PostgreSQL database dump complete" in tail
 
 
-def prune_old_backups() -> int:
-    """只保留最近 KEEP_COUNT 份，回傳刪除數量。"""
-    files = sorted(BACKUP_DIR.glob(f"{FILE_PREFIX}*{FILE_SUFFIX}"), reverse=True)
+def _dump_directory(target: Path, jobs: int, dbname: str | None = None) -> None:
+    """pg_dump -Fd -j：target 目錄不可事先存在（由 pg_dump 建立）。"""
+    _run_pg([*_pg_dump_cmd(dbname), "-Fd", "-j", str(jobs), "-f", str(target)])
+
+
+def _verify_directory(target: Path) -> int:
+    """以 pg_restore -l 讀一次目錄檔，確認 dump 可被還原；回傳其中的表資料數。"""
+    if not (target / _TOC_FILE).exists():
+        raise RuntimeError(f"{target.name} 缺少 {_TOC_FILE}，dump 不完整")
+    listing = _run_pg(["pg_restore", "-l", str(target)])
+    return sum(1 for line in listing.splitlines() if " TABLE DATA " in line)
+
+
+def _file_sha256(path: Path) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(_CHUNK_BYTES):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _dedup_into_store(snapshot: Path, store: Path) -> dict:
+    """把快照裡的每個資料檔換成指向內容相同物件的 hard link，新內容則加進物件庫。"""
+    store.mkdir(exist_ok=True)
+    stats = {"files": 0, "reused_files": 0, "new_bytes": 0, "reused_bytes": 0}
+    for path in sorted(snapshot.iterdir()):
+        if path.name == _TOC_FILE or not path.is_file():
+            continue
+        size = path.stat().st_size
+        obj = store / f"{_file_sha256(path)}{''.join(path.suffixes)}"
+        stats["files"] += 1
+        try:
+            if obj.exists():
+                # 先在旁邊建好 link 再換名，換到一半失敗也不會少檔案
+                tmp = path.with_name(path.name + ".link")
+                os.link(obj, tmp)
+                tmp.replace(path)
+                stats["reused_files"] += 1
+                stats["reused_bytes"] += size
+            else:
+                os.link(path, obj)
+                stats["new_bytes"] += size
+        except OSError as e:
+            # 檔案系統不支援 hard link 時照樣保留完整快照，只是沒有去重
+            logger.warning(f"備份去重失敗，{snapshot.name} 保留完整檔案: {e}")
+            stats["dedup_error"] = str(e)
+            break
+    return stats
+
+
+def _gc_objects(store: Path) -> int:
+    """刪掉已沒有任何快照引用的物件（link 數只剩物件庫自己），回傳刪除數量。"""
+    if not store.is_dir():
+        return 0
+    removed = 0
+    for obj in store.iterdir():
+        try:
+            if obj.stat().st_nlink <= 1:
+                obj.unlink()
+                removed += 1
+        except OSError as e:
+            logger.error(f"清除備份物件失敗 {obj.name}: {e}")
+    return removed
+
+
+def list_backups(backup_dir: Path | None = None) -> list:
+    """所有已完成的備份（plain 檔與 directory 快照），依時間由新到舊。"""
+    backup_dir = backup_dir or BACKUP_DIR
+    found = list(backup_dir.glob(f"{FILE_PREFIX}*{FILE_SUFFIX}"))
+    found += [p for p in backup_dir.glob(f"{FILE_PREFIX}*{SNAPSHOT_SUFFIX}") if p.is_dir()]
+    # 檔名都是 前綴 + 時間戳記，依檔名排序即依時間排序
+    return sorted(found, key=lambda p: p.name, reverse=True)
+
+
+def prune_old_backups(backup_dir: Path | None = None) -> int:
+    """只保留最近 KEEP_COUNT 份，回傳刪除數量；順帶清掉不再被引用的去重物件。"""
+    backup_dir = backup_dir or BACKUP_DIR
     removed = 0
-    for old in files[KEEP_COUNT:]:
+    for old in list_backups(backup_dir)[KEEP_COUNT:]:
         try:
-            old.unlink()
+            if old.is_dir():
+                shutil.rmtree(old)
+            else:
+                old.unlink()
             removed += 1
         except OSError as e:
             logger.error(f"刪除舊備份失敗 {old.name}: {e}")
+    _gc_objects(backup_dir / OBJECTS_DIR)
     return removed
 
 
+def latest_backup() -> Path | None:
+    backups = list_backups()
+    return backups[0] if backups else None
+
+
+def recent_backup(max_age: timedelta = RECENT_BACKUP_MAX_AGE) -> Path | None:
+    """最新一份備份若在 max_age 內完成就回傳它，否則 None。"""
+    latest = latest_backup()
+    if latest is None:
+        return None
+    if time.time() - latest.stat().st_mtime > max_age.total_seconds():
+        return None
+    return latest
+
+
 def run_backup() -> Path:
-    """執行一次備份，回傳產生的檔案路徑。同步操作，於 asyncio.to_thread 內呼叫。"""
+    """執行一次備份（格式依 BACKUP_FORMAT），回傳產生的檔案或目錄。同步操作，於 asyncio.to_thread 內呼叫。
+
+    已有備份在跑時拋 BackupInProgress，不會同時跑兩個 pg_dump。
+    """
+    global last_report
     BACKUP_DIR.mkdir(parents=True, exist_ok=True)
+    with open(BACKUP_DIR / LOCK_FILE, "w") as lock:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            raise BackupInProgress("已有備份在執行，略過這次")
+        try:
+            if BACKUP_FORMAT == "plain":
+                target, report = backup_plain(BACKUP_DIR)
+            else:
+                target, report = backup_directory(BACKUP_DIR, BACKUP_JOBS)
+            report["pruned"] = prune_old_backups()
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+    last_report = report
+    logger.info(f"備份完成: {report}")
+    return target
 
-    dump = _pg_dump_bytes()
-    if not _looks_complete(dump):
-        raise RuntimeError(f"pg_dump 輸出看起來不完整（{len(dump)} bytes），不寫入檔案")
 
-    stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
-    target = BACKUP_DIR / f"{FILE_PREFIX}{stamp}{FILE_SUFFIX}"
+def run_startup_backup() -> Path | None:
+    """啟動後的備份：近期已有備份就略過（回傳 None），否則照常備份。"""
+    recent = recent_backup()
+    if recent is not None:
+        logger.info(f"已有近期備份 {recent.name}，略過啟動備份")
+        return None
+    return run_backup()
+
+
+def _peak_rss_mb() -> float:
+    """本行程到目前為止的最高常駐記憶體（MB；Linux 的 ru_maxrss 單位為 KB）。"""
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def _stamp() -> str:
+    return datetime.now().strftime("%Y%m%d-%H%M%S")
+
+
+def backup_plain(backup_dir: Path, dbname: str | None = None) -> tuple:
+    """純 SQL 串流進 gzip 檔，回傳 (檔案路徑, 報告)。不加鎖、不輪替（由 run_backup 負責）。"""
+    target = backup_dir / f"{FILE_PREFIX}{_stamp()}{FILE_SUFFIX}"
 
     # 先寫暫存再改名：中途失敗不會留下看似成功的半截檔案
     tmp = target.with_suffix(".partial")
-    with gzip.open(tmp, "wb") as f:
-        f.write(dump)
+    rss_before = _peak_rss_mb()
+    start = time.perf_counter()
+    try:
+        with gzip.open(tmp, "wb", compresslevel=_GZIP_LEVEL) as f:
+            size, tail = _stream_dump(f, dbname)
+        if not _looks_complete(size, tail):
+            raise RuntimeError(f"pg_dump 輸出看起來不完整（{size} bytes），不保留檔案")
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
     tmp.rename(target)
+    seconds = time.perf_counter() - start
 
-    removed = prune_old_backups()
-    logger.info(
-        f"備份完成 {target.name}（原始 {len(dump)} bytes，"
-        f"壓縮後 {target.stat().st_size} bytes，清掉 {removed} 份舊檔）"
-    )
-    return target
+    return target, {
+        "format": "plain",
+        "file": target.name,
+        "raw_bytes": size,
+        "compressed_bytes": target.stat().st_size,
+        "seconds": round(seconds, 2),
+        "throughput_mb_s": round(size / 1024 / 1024 / seconds, 1) if seconds else None,
+        "peak_rss_mb": _peak_rss_mb(),
+        "peak_rss_growth_mb": round(_peak_rss_mb() - rss_before, 1),
+    }
 
 
-if __name__ == "__main__":
-    # 手動執行：python -m app.models.backup
+def backup_directory(backup_dir: Path, jobs: int, dbname: str | None = None) -> tuple:
+    """pg_dump -Fd -j 平行備份成快照目錄並對物件庫去重，回傳 (目錄路徑, 報告)。不加鎖、不輪替。"""
+    target = backup_dir / f"{FILE_PREFIX}{_stamp()}{SNAPSHOT_SUFFIX}"
+    partial = target.with_suffix(".partial")
+    start = time.perf_counter()
+    try:
+        _dump_directory(partial, jobs, dbname)
+        dump_seconds = time.perf_counter() - start
+        tables = _verify_directory(partial)
+        dedup = _dedup_into_store(partial, backup_dir / OBJECTS_DIR)
+    except BaseException:
+        shutil.rmtree(partial, ignore_errors=True)
+        raise
+    partial.rename(target)
+    seconds = time.perf_counter() - start
+    size = sum(p.stat().st_size for p in target.iterdir())
+
+    return target, {
+        "format": "directory",
+        "file": target.name,
+        "jobs": jobs,
+        "tables": tables,
+        "compressed_bytes": size,
+        "seconds": round(seconds, 2),
+        "dump_seconds": round(dump_seconds, 2),
+        "throughput_mb_s": round(size / 1024 / 1024 / seconds, 1) if seconds else None,
+        **dedup,
+    }
+
+
+def resolve_backup(name: str | None) -> Path:
+    """還原來源：未指定時用最新一份；可給完整路徑或 BACKUP_DIR 內的名稱。"""
+    if name is None:
+        latest = latest_backup()
+        if latest is None:
+            raise FileNotFoundError(f"{BACKUP_DIR} 內沒有任何備份")
+        return latest
+    path = Path(name)
+    if not path.exists():
+        path = BACKUP_DIR / name
+    if not path.exists():
+        raise FileNotFoundError(f"找不到備份 {name}")
+    return path
+
+
+def _restore_plain(path: Path, dbname: str) -> None:
+    """gzip 解壓後逐塊餵給 psql（ON_ERROR_STOP=1：任何錯誤就中止，不會得到殘缺的資料庫）。"""
+    with tempfile.TemporaryFile() as stderr:
+        proc = subprocess.Popen(
+            ["psql", *_conn_args(dbname), "-q", "-v", "ON_ERROR_STOP=1"],
+            stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=stderr, env=_pg_env(),
+        )
+        try:
+            with gzip.open(path, "rb") as f:
+                while chunk := f.read(_CHUNK_BYTES):
+                    proc.stdin.write(chunk)
+        except BrokenPipeError:
+            pass  # psql 已因錯誤結束，下面會拿到 returncode 與 stderr
+        finally:
+            try:
+                proc.stdin.close()
+            except BrokenPipeError:
+                pass
+            returncode = proc.wait()
+        if returncode != 0:
+            stderr.seek(0)
+            raise RuntimeError(
+                f"psql 還原失敗（returncode={returncode}）: "
+                f"{stderr.read().decode('utf-8', 'replace').strip()}"
+            )
+
+
+def restore(path: Path, dbname: str, jobs: int = BACKUP_JOBS, create: bool = False, clean: bool = False) -> dict:
+    """把備份還原到 dbname，回傳報告。directory 快照以 pg_restore -j 平行還原；plain 以 psql 還原。
+
+    create：先建立 dbname（需為不存在的資料庫）。clean：先刪掉既有物件再還原（只支援 directory）。
+    """
+    if create:
+        host_args = _conn_args()[:-2]
+        _run_pg(["createdb", *host_args, dbname])
+    start = time.perf_counter()
+    if path.is_dir():
+        cmd = ["pg_restore", *_conn_args(dbname), "-j", str(jobs),
+               "--no-owner", "--no-privileges", "--exit-on-error"]
+        if clean:
+            cmd += ["--clean", "--if-exists"]
+        _run_pg([*cmd, str(path)], timeout=None)
+    else:
+        if clean:
+            raise ValueError("plain 備份不含 DROP 指令，請還原到空的資料庫（--create）")
+        jobs = 1
+        _restore_plain(path, dbname)
+    report = {
+        "backup": path.name,
+        "dbname": dbname,
+        "jobs": jobs,
+        "seconds": round(time.perf_counter() - start, 2),
+    }
+    logger.info(f"還原完成: {report}")
+    return report
+
+
+def _print_backups() -> None:
+    for path in list_backups():
+        if path.is_dir():
+            files = [p for p in path.iterdir() if p.name != _TOC_FILE]
+            shared = sum(1 for p in files if p.stat().st_nlink > 2)
+            size = sum(p.stat().st_size for p in path.iterdir())
+            print(f"{path.name}\t{size} bytes\t{len(files)} 個資料檔（{shared} 個與其他快照共用）")
+        else:
+            print(f"{path.name}\t{path.stat().st_size} bytes")
+
+
+def main(argv: list | None = None) -> None:
+    parser = argparse.ArgumentParser(prog="python -m app.models.backup", description="StockWatch 資料庫備份與還原")
+    sub = parser.add_subparsers(dest="command")
+    sub.add_parser("backup", help="執行一次備份（預設）")
+    sub.add_parser("list", help="列出備份")
+    p_restore = sub.add_parser("restore", help="還原備份（預設最新一份）")
+    p_restore.add_argument("backup", nargs="?", help="備份名稱或路徑")
+    p_restore.add_argument("--dbname", required=True, help="還原到哪個資料庫")
+    p_restore.add_argument("--jobs", type=int, default=BACKUP_JOBS, help="pg_restore 平行數")
+    p_restore.add_argument("--create", action="store_true", help="先建立資料庫")
+    p_restore.add_argument("--clean", action="store_true", help="先刪掉既有物件（directory 快照）")
+    p_bench = sub.add_parser("bench", help="在暫存資料庫上量測各種備份 / 還原方式的耗時")
+    p_bench.add_argument("--rows", type=int, default=2_000_000, help="種子資料總列數")
+    p_bench.add_argument("--jobs", type=int, default=BACKUP_JOBS, help="平行數")
+    args = parser.parse_args(argv)
+
     logging.basicConfig(level=logging.INFO, format="%(message)s")
-    path = run_backup()
-    print(path)
+    if args.command == "restore":
+        restore(resolve_backup(args.backup), args.dbname, args.jobs, args.create, args.clean)
+    elif args.command == "list":
+        _print_backups()
+    elif args.command == "bench":
+        from app.models.backup_bench import run_bench
+        run_bench(args.rows, args.jobs)
+    else:
+        print(run_backup())
+
+
+if __name__ == "__main__":
+    # 手動執行：python -m app.models.backup [backup | list | restore | bench]
+    # 以匯入的模組執行，讓 backup_bench 與這裡共用同一份模組狀態
+    from app.models.backup import main as _main
+    _main()
@@ -0,0 +1,108 @@
+"""備份 / 還原基準測試：python -m app.models.backup bench [--rows N] [--jobs N]。
+
+在同一台 PostgreSQL 上建立暫存資料庫 stockwatch_bench，塞入幾張大表（總共 rows 列）與一張小的 users 表，
+依序量測：
+
+- plain（串流 gzip）與 directory（-j 1、-j N）備份的耗時與大小；
+- 只改一張表之後的第二份 directory 快照：多少資料檔沿用前一份（去重效果）；
+- 各格式還原到新資料庫的耗時。
+
+備份寫到暫存目錄，結束後連同暫存資料庫一併刪除，不影響 BACKUP_DIR 與正式資料庫。
+需要可建立資料庫的帳號。
+"""
+import tempfile
+import time
+import unicodedata
+from pathlib import Path
+
+from app.models import backup
+
+SOURCE_DB = "stockwatch_bench"
+RESTORE_DB = "stockwatch_bench_restore"
+# 大表張數：directory 格式以表為單位平行，至少要有幾張表 -j 才有意義
+_LARGE_TABLES = 4
+
+
+def _psql(dbname: str, sql: str) -> str:
+    return backup._run_pg(["psql", *backup._conn_args(dbname), "-v", "ON_ERROR_STOP=1", "-qtAc", sql], timeout=None)
+
+
+def _host_args() -> list:
+    return backup._conn_args()[:-2]
+
+
+def _drop(dbname: str) -> None:
+    backup._run_pg(["dropdb", *_host_args(), "--if-exists", dbname])
+
+
+def _seed(rows: int) -> None:
+    _drop(SOURCE_DB)
+    backup._run_pg(["createdb", *_host_args(), SOURCE_DB])
+    _psql(SOURCE_DB, """CREATE TABLE users AS
+                        SELECT g AS id, 'user' || g || '@example.com' AS email
+                        FROM generate_series(1, 1000) g""")
+    per_table = rows // _LARGE_TABLES
+    for i in range(_LARGE_TABLES):
+        _psql(SOURCE_DB, f"""CREATE TABLE bench_{i} AS
+                             SELECT g AS id, md5(g::text) AS a, (g * 0.01)::numeric(12, 2) AS price,
+                                    TIMESTAMPTZ '2026-01-01' + g * INTERVAL '1 second' AS ts
+                             FROM generate_series(1, {per_table}) g""")
+
+
+def _display_width(text: str) -> int:
+    """終端機顯示寬度：全形字佔兩格，中文標題才對得齊。"""
+    return sum(2 if unicodedata.east_asian_width(ch) in "WF" else 1 for ch in text)
+
+
+def _timed_restore(path: Path, jobs: int) -> float:
+    _drop(RESTORE_DB)
+    report = backup.restore(path, RESTORE_DB, jobs=jobs, create=True)
+    count = _psql(RESTORE_DB, "SELECT COUNT(*) FROM bench_0").strip()
+    if int(count) == 0:
+        raise RuntimeError(f"{path.name} 還原後 bench_0 是空的")
+    return report["seconds"]
+
+
+def run_bench(rows: int, jobs: int) -> list:
+    """執行整套量測並印出結果表，回傳 [(項目, 秒數, 說明), ...]。"""
+    results = []
+    start = time.perf_counter()
+    _seed(rows)
+    size = _psql(SOURCE_DB, f"SELECT pg_size_pretty(pg_database_size('{SOURCE_DB}'))").strip()
+    results.append(("seed", round(time.perf_counter() - start, 2), f"{rows} 列，資料庫 {size}"))
+
+    try:
+        with tempfile.TemporaryDirectory(prefix="stockwatch-bench-") as tmp:
+            backup_dir = Path(tmp)
+            plain, report = backup.backup_plain(backup_dir, SOURCE_DB)
+            results.append(("backup plain", report["seconds"],
+                            f"{report['compressed_bytes']} bytes，peak RSS {report['peak_rss_mb']} MB"))
+
+            snapshots = {}
+            for n in sorted({1, jobs}):
+                # 每份快照各用獨立的物件庫，量到的是完整備份的成本
+                snapshot_dir = backup_dir / f"j{n}"
+                snapshot_dir.mkdir()
+                snapshots[n], report = backup.backup_directory(snapshot_dir, n, SOURCE_DB)
+                results.append((f"backup directory -j {n}", report["seconds"],
+                                f"{report['compressed_bytes']} bytes，{report['tables']} 張表"))
+
+            # 只改 users 一張表後再備份一次：其餘大表應整份沿用前一份快照的物件
+            _psql(SOURCE_DB, "INSERT INTO users VALUES (1001, 'new@example.com')")
+            time.sleep(1)  # 快照名稱以秒為單位，避免同名
+            _, report = backup.backup_directory(backup_dir / f"j{jobs}", jobs, SOURCE_DB)
+            results.append(("backup directory（僅 users 變動）", report["seconds"],
+                            f"{report['reused_files']}/{report['files']} 個資料檔沿用，"
+                            f"新增 {report['new_bytes']} bytes"))
+
+            results.append(("restore plain（psql）", _timed_restore(plain, 1), ""))
+            for n, path in snapshots.items():
+                results.append((f"restore directory -j {n}", _timed_restore(path, n), ""))
+    finally:
+        _drop(RESTORE_DB)
+        _drop(SOURCE_DB)
+
+    width = max(_display_width(name) for name, _, _ in results)
+    for name, seconds, note in results:
+        print(f"{name}{' ' * (width - _display_width(name))}  {seconds:8.2f}s  {note}")
+    return results
@@ -1,7 +1,12 @@
 import psycopg2
+from psycopg2 import extensions
 from psycopg2.extras import RealDictCursor
+from psycopg2.pool import PoolError
 import logging
 import os
+import threading
+import time
+from contextlib import contextmanager
 from dotenv import load_dotenv
 
 # 載入環境變數
@@ -9,22 +14,193 @@ load_dotenv()
 
 logger = logging.getLogger(__name__)
 
-def get_db_connection():
-    """獲取資料庫連接，並設定時區為 Asia/Taipei"""
-    conn = psycopg2.connect(
+# 連線池上限對齊 asyncio.to_thread 預設 executor 的 worker 數（min(32, CPU + 4)）：
+# 所有 _db_* 都在 to_thread 內執行，同時在跑的 DB 操作不會超過這個數
+POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", min(32, (os.cpu_count() or 1) + 4)))
+# 池滿時最多等多久拿到連線，超過就丟 PoolError，不讓請求無限期卡住
+POOL_WAIT_TIMEOUT = float(os.getenv("DB_POOL_WAIT_TIMEOUT", "30"))
+# 閒置超過這個秒數的連線，借出前先 ping 一次，避免拿到已被伺服器斷掉的連線
+_IDLE_PING_SECONDS = 60
+
+
+def _connect():
+    """建立一條實體連線。時區以連線參數帶入，建立時即生效，不必再多一次 SET + commit。"""
+    return psycopg2.connect(
         dbname=os.getenv('POSTGRES_DB'),
         user=os.getenv('POSTGRES_USER'),
         password=os.getenv('POSTGRES_PASSWORD'),
         host=os.getenv('POSTGRES_HOST', 'localhost'),
-        port=os.getenv('POSTGRES_PORT', '5432')
+        port=os.getenv('POSTGRES_PORT', '5432'),
+        options="-c timezone=Asia/Taipei",
     )
-    
-    # 設定時區為 Asia/Taipei
-    cursor = conn.cursor()
-    cursor.execute("SET timezone = 'Asia/Taipei'")
-    conn.commit()
-    
-    return conn
+
+
+def get_db_connection():
+    """獲取一條不經連線池的獨立連線（時區為 Asia/Taipei），用完須自行 close()。
+
+    App 內的查詢請改用 db_connection()；這個函式留給測試與一次性工具。
+    """
+    return _connect()
+
+
+class ConnectionPool:
+    """執行緒安全的連線池：借出時池滿就等待，歸還時把連線恢復到乾淨狀態。
+
+    psycopg2 內建的 ThreadedConnectionPool 池滿時直接丟錯、且只保留 minconn 條閒置連線，
+    不符合「to_thread 併發尖峰時排隊等」的用法，故自行實作。
+    """
+
+    def __init__(self, max_size: int, wait_timeout: float):
+        self._max_size = max_size
+        self._wait_timeout = wait_timeout
+        self._slots = threading.BoundedSemaphore(max_size)
+        self._lock = threading.Lock()
+        self._idle = []  # [(conn, 歸還時間)]，LIFO：優先重用最近用過的連線
+        self._opened = 0
+        self._checkouts = 0
+        self._timeouts = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._held_total = 0.0
+        self._held_max = 0.0
+
+    def _discard(self, conn) -> None:
+        """關閉一條不再放回池中的連線；_opened 只在這裡（與 close_all）減少。"""
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+        with self._lock:
+            self._opened -= 1
+
+    def _take_idle(self):
+        while True:
+            with self._lock:
+                if not self._idle:
+                    return None, None
+                conn, since = self._idle.pop()
+            if not conn.closed:
+                return conn, since
+            self._discard(conn)
+
+    def _is_alive(self, conn) -> bool:
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def acquire(self):
+        start = time.perf_counter()
+        if not self._slots.acquire(timeout=self._wait_timeout):
+            with self._lock:
+                self._timeouts += 1
+            raise PoolError(f"等待資料庫連線逾時（{self._wait_timeout} 秒）")
+        waited = time.perf_counter() - start
+        try:
+            conn = None
+            while conn is None:
+                conn, since = self._take_idle()
+                if conn is None:
+                    conn = _connect()
+                    with self._lock:
+                        self._opened += 1
+                elif time.monotonic() - since > _IDLE_PING_SECONDS and not self._is_alive(conn):
+                    self._discard(conn)
+                    conn = None
+        except Exception:
+            self._slots.release()
+            raise
+        with self._lock:
+            self._checkouts += 1
+            self._wait_total += waited
+            self._wait_max = max(self._wait_max, waited)
+        return conn
+
+    def release(self, conn, held: float, discard: bool = False) -> None:
+        try:
+            if not discard and not conn.closed:
+                status = conn.info.transaction_status
+                if status == extensions.TRANSACTION_STATUS_UNKNOWN:
+                    discard = True  # 與伺服器的連線已斷
+                elif status != extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()  # 呼叫端沒 commit 的交易一律作廢，與過去 close() 行為一致
+        except psycopg2.Error:
+            discard = True
+        try:
+            if discard or conn.closed:
+                self._discard(conn)
+            else:
+                with self._lock:
+                    self._idle.append((conn, time.monotonic()))
+            with self._lock:
+                self._held_total += held
+                self._held_max = max(self._held_max, held)
+        finally:
+            self._slots.release()
+
+    def stats(self) -> dict:
+        with self._lock:
+            checkouts = self._checkouts
+            return {
+                "max_size": self._max_size,
+                "open": self._opened,
+                "idle": len(self._idle),
+                "checkouts": checkouts,
+                "timeouts": self._timeouts,
+                "wait_avg_ms": round(self._wait_total / checkouts * 1000, 3) if checkouts else 0.0,
+                "wait_max_ms": round(self._wait_max * 1000, 3),
+                "checkout_avg_ms": round(self._held_total / checkouts * 1000, 3) if checkouts else 0.0,
+                "checkout_max_ms": round(self._held_max * 1000, 3),
+            }
+
+    def close_all(self) -> None:
+        with self._lock:
+            idle, self._idle = self._idle, []
+            self._opened -= len(idle)
+        for conn, _ in idle:
+            try:
+                conn.close()
+            except psycopg2.Error:
+                pass
+
+
+_pool = ConnectionPool(POOL_MAX_SIZE, POOL_WAIT_TIMEOUT)
+
+
+@contextmanager
+def db_connection():
+    """從連線池借一條連線，離開 with 區塊時自動歸還（未 commit 的交易會 rollback）。
+
+    用法：
+        with db_connection() as conn:
+            cur = conn.cursor()
+            ...
+            conn.commit()
+    """
+    conn = _pool.acquire()
+    start = time.perf_counter()
+    discard = False
+    try:
+        yield conn
+    except (psycopg2.OperationalError, psycopg2.InterfaceError):
+        # 連線層級的錯誤：這條連線不可信，丟掉不放回池中
+        discard = True
+        raise
+    finally:
+        _pool.release(conn, time.perf_counter() - start, discard=discard)
+
+
+def pool_stats() -> dict:
+    """連線池指標：借出次數、等待時間、借用時間等，供 /metrics 顯示。"""
+    return _pool.stats()
+
+
+def close_pool() -> None:
+    """關閉所有閒置連線，於 lifespan 結束時呼叫。"""
+    _pool.close_all()
 
 
 
@@ -41,32 +217,29 @@ def upsert_user(email: str, name: str, picture: str) -> dict:
         dict: 包含用戶資料的字典
     """
     try:
-        conn = get_db_connection()
-        cur = conn.cursor(cursor_factory=RealDictCursor)
-        
-        # 使用 INSERT ON CONFLICT 進行 upsert
-        sql = """
-            INSERT INTO users (email, name, picture_url, last_login, created_at, updated_at)
-            VALUES (%s, %s, %s, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)
-            ON CONFLICT (email) 
-            DO UPDATE SET
-                name = EXCLUDED.name,
-                picture_url = EXCLUDED.picture_url,
-                last_login = CURRENT_TIMESTAMP,
-                updated_at = CURRENT_TIMESTAMP
-            RETURNING email, name, picture_url;
-        """
-        
-        cur.execute(sql, (email, name, picture))
-        user = cur.fetchone()
-        conn.commit()
-        
-        return dict(user)
+        with db_connection() as conn:
+            cur = conn.cursor(cursor_factory=RealDictCursor)
+            try:
+                # 使用 INSERT ON CONFLICT 進行 upsert
+                sql = """
+                    INSERT INTO users (email, name, picture_url, last_login, created_at, updated_at)
+                    VALUES (%s, %s, %s, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)
+                    ON CONFLICT (email) 
+                    DO UPDATE SET
+                        name = EXCLUDED.name,
+                        picture_url = EXCLUDED.picture_url,
+                        last_login = CURRENT_TIMESTAMP,
+                        updated_at = CURRENT_TIMESTAMP
+                    RETURNING email, name, picture_url;
+                """
+
+                cur.execute(sql, (email, name, picture))
+                user = cur.fetchone()
+                conn.commit()
+
+                return dict(user)
+            finally:
+                cur.close()
     except Exception as e:
         logger.error(f"資料庫操作錯誤: {str(e)}")
         raise Exception("資料庫操作錯誤")
-    finally:
-        if 'cur' in locals():
-            cur.close()
-        if 'conn' in locals():
-            conn.close()
@@ -5,7 +5,7 @@
 """
 import logging
 
-from app.models.db import get_db_connection
+from app.models.db import db_connection
 
 logger = logging.getLogger(__name__)
 
@@ -15,87 +15,154 @@ DEFAULT_WATCHLIST_NAME = "自選股"
 
 def ensure_watchlist_groups() -> None:
     """建立 watchlists 表並把既有自選股遷入各使用者的預設清單。"""
-    conn = get_db_connection()
-    cur = conn.cursor()
-    try:
-        # 1. 清單表
-        cur.execute(
-            """CREATE TABLE IF NOT EXISTS watchlists (
-                   id SERIAL PRIMARY KEY,
-                   user_email VARCHAR(255) NOT NULL
-                       REFERENCES users(email) ON DELETE CASCADE,
-                   name VARCHAR(50) NOT NULL,
-                   display_order INTEGER NOT NULL,
-                   created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
-                   updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
-               );"""
-        )
-        cur.execute(
-            """CREATE INDEX IF NOT EXISTS idx_watchlists_user
-                   ON watchlists(user_email, display_order);"""
-        )
-        # 同一使用者不分大小寫不可同名
-        cur.execute(
-            """CREATE UNIQUE INDEX IF NOT EXISTS idx_watchlists_user_name
-                   ON watchlists(user_email, lower(name));"""
-        )
-
-        # 2. 已有自選股但還沒有任何清單的使用者，補一個預設清單
-        cur.execute(
-            """INSERT INTO watchlists (user_email, name, display_order)
-               SELECT DISTINCT ws.user_email, %s, 0
-               FROM watchlist_stocks ws
-               WHERE NOT EXISTS (
-                   SELECT 1 FROM watchlists w WHERE w.user_email = ws.user_email
-               );""",
-            (DEFAULT_WATCHLIST_NAME,),
-        )
-
-        # 3. 歸屬欄位（先允許 NULL，填完再上約束）
-        cur.execute(
-            "ALTER TABLE watchlist_stocks ADD COLUMN IF NOT EXISTS watchlist_id INTEGER;"
-        )
-
-        # 4. 既有列指向該使用者排序最前的清單
-        cur.execute(
-            """UPDATE watchlist_stocks ws
-               SET watchlist_id = (
-                   SELECT w.id FROM watchlists w
-                   WHERE w.user_email = ws.user_email
-                   ORDER BY w.display_order, w.id
-                   LIMIT 1
-               )
-               WHERE ws.watchlist_id IS NULL;"""
-        )
-
-        # 5. 外鍵（information_schema 無此約束時才加，避免重複執行報錯）
-        cur.execute(
-            """DO $$
-               BEGIN
-                   IF NOT EXISTS (
-                       SELECT 1 FROM information_schema.table_constraints
-                       WHERE constraint_name = 'fk_watchlist_stocks_watchlist'
-                         AND table_name = 'watchlist_stocks'
-                   ) THEN
-                       ALTER TABLE watchlist_stocks
-                           ADD CONSTRAINT fk_watchlist_stocks_watchlist
-                           FOREIGN KEY (watchlist_id)
-                           REFERENCES watchlists(id) ON DELETE CASCADE;
-                   END IF;
-               END $$;"""
-        )
-        cur.execute(
-            "ALTER TABLE watchlist_stocks ALTER COLUMN watchlist_id SET NOT NULL;"
-        )
-
-        # 6. 換唯一索引：(user_email, ticker) → (watchlist_id, ticker)，解鎖多重歸屬
-        cur.execute("DROP INDEX IF EXISTS idx_unique_user_ticker;")
-        cur.execute(
-            """CREATE UNIQUE INDEX IF NOT EXISTS idx_unique_watchlist_ticker
-                   ON watchlist_stocks(watchlist_id, ticker);"""
-        )
-
-        conn.commit()
-    finally:
-        cur.close()
-        conn.close()
+    with db_connection() as conn:
+        cur = conn.cursor()
+        try:
+            # 1. 清單表
+            cur.execute(
+                """CREATE TABLE IF NOT EXISTS watchlists (
+                       id SERIAL PRIMARY KEY,
+                       user_email VARCHAR(255) NOT NULL
+                           REFERENCES users(email) ON DELETE CASCADE,
+                       name VARCHAR(50) NOT NULL,
+                       display_order INTEGER NOT NULL,
+                       created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+                       updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+                   );"""
+            )
+            cur.execute(
+                """CREATE INDEX IF NOT EXISTS idx_watchlists_user
+                       ON watchlists(user_email, display_order);"""
+            )
+            # 同一使用者不分大小寫不可同名
+            cur.execute(
+                """CREATE UNIQUE INDEX IF NOT EXISTS idx_watchlists_user_name
+                       ON watchlists(user_email, lower(name));"""
+            )
+
+            # 2. 已有自選股但還沒有任何清單的使用者，補一個預設清單
+            cur.execute(
+                """INSERT INTO watchlists (user_email, name, display_order)
+                   SELECT DISTINCT ws.user_email, %s, 0
+                   FROM watchlist_stocks ws
+                   WHERE NOT EXISTS (
+                       SELECT 1 FROM watchlists w WHERE w.user_email = ws.user_email
+                   );""",
+                (DEFAULT_WATCHLIST_NAME,),
+            )
+
+            # 3. 歸屬欄位（先允許 NULL，填完再上約束）
+            cur.execute(
+                "ALTER TABLE watchlist_stocks ADD COLUMN IF NOT EXISTS watchlist_id INTEGER;"
+            )
+
+            # 4. 既有列指向該使用者排序最前的清單
+            cur.execute(
+                """UPDATE watchlist_stocks ws
+                   SET watchlist_id = (
+                       SELECT w.id FROM watchlists w
+                       WHERE w.user_email = ws.user_email
+                       ORDER BY w.display_order, w.id
+                       LIMIT 1
+                   )
+                   WHERE ws.watchlist_id IS NULL;"""
+            )
+
+            # 5. 外鍵（information_schema 無此約束時才加，避免重複執行報錯）
+            cur.execute(
+                """DO $$
+                   BEGIN
+                       IF NOT EXISTS (
+                           SELECT 1 FROM information_schema.table_constraints
+                           WHERE constraint_name = 'fk_watchlist_stocks_watchlist'
+                             AND table_name = 'watchlist_stocks'
+                       ) THEN
+                           ALTER TABLE watchlist_stocks
+                               ADD CONSTRAINT fk_watchlist_stocks_watchlist
+                               FOREIGN KEY (watchlist_id)
+                               REFERENCES watchlists(id) ON DELETE CASCADE;
+                       END IF;
+                   END $$;"""
+            )
+            cur.execute(
+                "ALTER TABLE watchlist_stocks ALTER COLUMN watchlist_id SET NOT NULL;"
+            )
+
+            # 6. 換唯一索引：(user_email, ticker) → (watchlist_id, ticker)，解鎖多重歸屬
+            cur.execute("DROP INDEX IF EXISTS idx_unique_user_ticker;")
+            cur.execute(
+                """CREATE UNIQUE INDEX IF NOT EXISTS idx_unique_watchlist_ticker
+                       ON watchlist_stocks(watchlist_id, ticker);"""
+            )
+
+            conn.commit()
+        finally:
+            cur.close()
+
+
+def ensure_price_bars() -> None:
+    """建立 K 線本地儲存表：price_bars 存 OHLCV，price_bar_series 記錄每條序列的回補範圍與更新時間。"""
+    with db_connection() as conn:
+        cur = conn.cursor()
+        try:
+            # ts 為交易所當地時間（不含時區），與 yfinance 回傳的 index 直接對應
+            cur.execute(
+                """CREATE TABLE IF NOT EXISTS price_bars (
+                       ticker VARCHAR(20) NOT NULL,
+                       bar_interval VARCHAR(8) NOT NULL,
+                       ts TIMESTAMP NOT NULL,
+                       open DOUBLE PRECISION,
+                       high DOUBLE PRECISION,
+                       low DOUBLE PRECISION,
+                       close DOUBLE PRECISION NOT NULL,
+                       volume BIGINT NOT NULL DEFAULT 0,
+                       PRIMARY KEY (ticker, bar_interval, ts)
+                   );"""
+            )
+            cur.execute(
+                """CREATE TABLE IF NOT EXISTS price_bar_series (
+                       ticker VARCHAR(20) NOT NULL,
+                       bar_interval VARCHAR(8) NOT NULL,
+                       period VARCHAR(8) NOT NULL,
+                       refreshed_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+                       PRIMARY KEY (ticker, bar_interval)
+                   );"""
+            )
+            conn.commit()
+        finally:
+            cur.close()
+
+
+def ensure_quote_ticks() -> None:
+    """建立盤中報價紀錄表：quote_ticks 依日期分區（分區由 app/api/quote_ticks 建立與清除），
+    quote_ticks_5m 存降採樣後的 5 分鐘 K。"""
+    with db_connection() as conn:
+        cur = conn.cursor()
+        try:
+            cur.execute(
+                """CREATE TABLE IF NOT EXISTS quote_ticks (
+                       ticker VARCHAR(20) NOT NULL,
+                       ts TIMESTAMPTZ NOT NULL,
+                       price DOUBLE PRECISION NOT NULL
+                   ) PARTITION BY RANGE (ts);"""
+            )
+            # 建在分區表上的索引會自動套用到每個分區
+            cur.execute(
+                """CREATE INDEX IF NOT EXISTS idx_quote_ticks_ticker_ts
+                       ON quote_ticks(ticker, ts);"""
+            )
+            cur.execute(
+                """CREATE TABLE IF NOT EXISTS quote_ticks_5m (
+                       ticker VARCHAR(20) NOT NULL,
+                       ts TIMESTAMPTZ NOT NULL,
+                       open DOUBLE PRECISION NOT NULL,
+                       high DOUBLE PRECISION NOT NULL,
+                       low DOUBLE PRECISION NOT NULL,
+                       close DOUBLE PRECISION NOT NULL,
+                       samples INTEGER NOT NULL,
+                       PRIMARY KEY (ticker, ts)
+                   );"""
+            )
+            conn.commit()
+        finally:
+            cur.close()
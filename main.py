@@ -1,17 +1,29 @@
 import logging
 from contextlib import asynccontextmanager
+from datetime import datetime, timedelta, timezone
 
-from fastapi import FastAPI
+from fastapi import Depends, FastAPI
+from fastapi.responses import JSONResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import HTTPBearer
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.cron import CronTrigger
-
-from app.api import auth, stock, chat, watchlists
-from app.models.db import get_db_connection
-from app.models.backup import run_backup
-from app.models.migrations import ensure_watchlist_groups
+from apscheduler.triggers.date import DateTrigger
+
+from app.api import auth, stock, chat, watchlists, quote_ticks, summary_pipeline
+from app.api.quote_hub import quote_hub
+from app.api.quote_refresher import refresher as quote_refresher
+from app.api.quote_writer import quote_writer
+from app.api.symbol_index import symbol_index
+from app.api.warmup import warmup
+from app.core.http import init_sessions, close_sessions
+from app.core import cache, ratelimit, shared_cache, singleflight
+from app.core.security import current_user_email
+from app.models.db import db_connection, pool_stats, close_pool
+from app.models import backup
+from app.models.backup import BackupInProgress, run_backup, run_startup_backup
+from app.models.migrations import ensure_price_bars, ensure_quote_ticks, ensure_watchlist_groups
 
 logger = logging.getLogger(__name__)
 
@@ -20,38 +32,40 @@ logger = logging.getLogger(__name__)
 # 要恢復請一併把 static/main.js 的 AI_CHAT_ENABLED 也改回 true。
 AI_CHAT_ENABLED = False
 
+# App 開始服務後多久才跑啟動備份
+STARTUP_BACKUP_DELAY = timedelta(seconds=60)
+
 
 def _ensure_summary_table() -> None:
     """建立 stock_summaries 表（idempotent）。同步操作，於 to_thread 內呼叫。"""
-    conn = get_db_connection()
-    cur = conn.cursor()
-    try:
-        cur.execute(
-            """CREATE TABLE IF NOT EXISTS stock_summaries (
-                   ticker TEXT PRIMARY KEY,
-                   summary TEXT,
-                   generated_at TIMESTAMPTZ DEFAULT NOW()
-               );"""
-        )
-        conn.commit()
-    finally:
-        cur.close()
-        conn.close()
+    with db_connection() as conn:
+        cur = conn.cursor()
+        try:
+            cur.execute(
+                """CREATE TABLE IF NOT EXISTS stock_summaries (
+                       ticker TEXT PRIMARY KEY,
+                       summary TEXT,
+                       generated_at TIMESTAMPTZ DEFAULT NOW()
+                   );"""
+            )
+            # 摘要輸入資料（新聞、財報）的指紋：沒變就不必再呼叫 LLM
+            cur.execute(
+                "ALTER TABLE stock_summaries ADD COLUMN IF NOT EXISTS context_hash TEXT;"
+            )
+            conn.commit()
+        finally:
+            cur.close()
 
 
 async def _refresh_all_summaries() -> None:
-    """排程工作：對所有自選股逐支重新產生摘要並 upsert（序列）。"""
+    """排程工作：對所有自選股重新產生摘要並 upsert（有上限的並行管線，見 summary_pipeline）。"""
     import asyncio
     try:
         tickers = await asyncio.to_thread(stock._db_distinct_watchlist_tickers)
     except Exception as e:
         logger.error(f"排程取得自選股清單失敗: {e}")
         return
-    for ticker in tickers:
-        try:
-            await stock.generate_stock_summary(ticker)
-        except Exception as e:
-            logger.error(f"排程產生摘要失敗: {ticker} {e}")
+    await summary_pipeline.refresh_summaries(tickers)
 
 
 async def _daily_backup() -> None:
@@ -59,16 +73,45 @@ async def _daily_backup() -> None:
     import asyncio
     try:
         await asyncio.to_thread(run_backup)
+    except BackupInProgress as e:
+        logger.warning(f"每日備份: {e}")
     except Exception as e:
         logger.error(f"每日備份失敗: {e}")
 
 
+async def _startup_backup() -> None:
+    """排程工作：啟動後備份一次（近期已有備份則略過），確保隨時都有一份近期備份，設定錯誤也會在 log 曝光。"""
+    import asyncio
+    try:
+        await asyncio.to_thread(run_startup_backup)
+    except BackupInProgress as e:
+        logger.warning(f"啟動時備份: {e}")
+    except Exception as e:
+        logger.error(f"啟動時備份失敗: {e}")
+
+
+async def _maintain_quote_ticks() -> None:
+    """排程工作：盤中報價紀錄的分區預建、降採樣與保留期清理。"""
+    import asyncio
+    try:
+        report = await asyncio.to_thread(quote_ticks.maintain)
+        logger.info(f"quote_ticks 維護完成: {report}")
+    except Exception as e:
+        logger.error(f"quote_ticks 維護失敗: {e}")
+
+
 scheduler = AsyncIOScheduler()
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     import asyncio
+    # 上游 API 的共用連線池：整個 app 生命週期重用，不再每次請求重新握手
+    try:
+        await init_sessions()
+    except Exception as e:
+        logger.error(f"建立 HTTP session 失敗: {e}")
+
     # 建表（失敗不可讓 app 崩潰）
     try:
         await asyncio.to_thread(_ensure_summary_table)
@@ -81,11 +124,28 @@ async def lifespan(app: FastAPI):
     except Exception as e:
         logger.error(f"watchlist groups 遷移失敗: {e}")
 
-    # 啟動時先備份一次：確保隨時都有一份近期備份，設定錯誤也會立刻在 log 曝光
+    # K 線本地儲存表（失敗時 /history 會退回直接下載）
     try:
-        await asyncio.to_thread(run_backup)
+        await asyncio.to_thread(ensure_price_bars)
     except Exception as e:
-        logger.error(f"啟動時備份失敗: {e}")
+        logger.error(f"建立 price_bars 表失敗: {e}")
+
+    # 盤中報價紀錄表與當日/近日分區（失敗時 24h 走勢圖照舊向上游取）
+    try:
+        await asyncio.to_thread(ensure_quote_ticks)
+        await asyncio.to_thread(quote_ticks.maintain)
+    except Exception as e:
+        logger.error(f"建立 quote_ticks 表失敗: {e}")
+
+    # autocomplete 本地索引：以資料庫內看過的代號與公司名稱預先填入
+    try:
+        count = await asyncio.to_thread(stock.seed_symbol_index)
+        logger.info(f"代號索引已載入 {count} 筆")
+    except Exception as e:
+        logger.error(f"載入代號索引失敗: {e}")
+
+    # 上次存下的報價先放進快取（標記 stale），第一次開頁不必每列都等上游
+    await warmup.preload()
 
     # 啟動排程（失敗不可讓 app 崩潰）
     try:
@@ -101,17 +161,50 @@ async def lifespan(app: FastAPI):
             id="daily_backup",
             replace_existing=True,
         )
+        scheduler.add_job(
+            _maintain_quote_ticks,
+            CronTrigger(hour=0, minute=10, timezone="Asia/Taipei"),
+            id="quote_ticks_maintenance",
+            replace_existing=True,
+        )
+        # 啟動備份不擋在開始服務之前：等預熱跑一陣子後在背景執行
+        scheduler.add_job(
+            _startup_backup,
+            DateTrigger(run_date=datetime.now(timezone.utc) + STARTUP_BACKUP_DELAY),
+            id="startup_backup",
+            replace_existing=True,
+        )
         scheduler.start()
     except Exception as e:
         logger.error(f"啟動排程失敗: {e}")
 
+    # 報價寫入資料庫改由背景批次進行，請求路徑不再等資料庫
+    quote_writer.start()
+
+    # 背景刷新自選股報價，讓使用者請求幾乎都命中快取
+    try:
+        quote_refresher.start()
+    except Exception as e:
+        logger.error(f"啟動背景報價刷新失敗: {e}")
+
+    # 背景預取最多人收藏的代號的報價、sparkline 與 3m 走勢；進度見 /health
+    warmup.start()
+
     yield
 
+    await warmup.stop()
+    await quote_refresher.stop()
+    # 刷新停了才不會再有新報價進來；把緩衝區剩下的寫完再關連線池
+    await quote_writer.stop()
+
     try:
         scheduler.shutdown(wait=False)
     except Exception as e:
         logger.error(f"關閉排程失敗: {e}")
 
+    await close_sessions()
+    close_pool()
+
 
 app = FastAPI(lifespan=lifespan)
 
@@ -168,6 +261,52 @@ async def get_version():
     return {"version": ASSET_VERSION}
 
 
+def _db_ping() -> None:
+    with db_connection() as conn:
+        cur = conn.cursor()
+        try:
+            cur.execute("SELECT 1")
+        finally:
+            cur.close()
+
+
+@app.get("/health")
+async def get_health():
+    """公開端點（不需登入）：就緒檢查。快取預熱完成且資料庫連得上才回 200，否則 503。"""
+    import asyncio
+    try:
+        await asyncio.wait_for(asyncio.to_thread(_db_ping), timeout=3)
+        db_ok = True
+    except Exception as e:
+        logger.error(f"健康檢查連不上資料庫: {e}")
+        db_ok = False
+    ready = warmup.ready and db_ok
+    return JSONResponse(
+        {"status": "ready" if ready else "warming" if db_ok else "degraded",
+         "database": db_ok, "warmup": warmup.stats()},
+        status_code=200 if ready else 503,
+    )
+
+
+@app.get("/metrics")
+async def get_metrics(_: str = Depends(current_user_email)):
+    """營運指標（需登入）：資料庫連線池、上游請求合併次數、各快取命中率等。"""
+    return {
+        "db_pool": pool_stats(),
+        "singleflight": singleflight.all_stats(),
+        "caches": cache.all_stats(),
+        "shared_cache": shared_cache.stats(),
+        "quote_refresher": quote_refresher.stats(),
+        "quote_stream": quote_hub.stats(),
+        "quote_writer": quote_writer.stats(),
+        "rate_limits": ratelimit.all_stats(),
+        "symbol_index": symbol_index.stats(),
+        "warmup": warmup.stats(),
+        "summary_refresh": summary_pipeline.last_report,
+        "backup": backup.last_report,
+    }
+
+
 # 註冊路由
 app.include_router(auth.router, tags=["auth"])
 app.include_router(stock.router, tags=["stock"])
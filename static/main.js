@@ -467,22 +467,74 @@ async function loadSummary(ticker, refresh) {
         }
     };
     if (!refresh) _redraw();
+    // 串流中逐字更新摘要文字：只改文字節點，不重繪整個展開面板（走勢圖不必跟著重畫）
+    var _appendText = function(text) {
+        var prev = summaryData[ticker];
+        summaryData[ticker] = (prev === 'loading' ? '' : prev) + text;
+        if (expandedTicker !== ticker) return;
+        var el = document.querySelector('.stock-detail .summary-text');
+        if (el) el.textContent = summaryData[ticker];
+        else _redraw();
+    };
     try {
-        var url = '/ai-summary/' + ticker;
+        var url = '/ai-summary/' + ticker + '/stream';
         if (refresh) url += '?refresh=true';
-        const res = await authFetch(url);
-        const data = await res.json();
-        if (data.cooldown) {
+        const res = await authFetch(url, { cache: 'no-store' });
+        if (!res.ok || !res.body) throw new Error('HTTP ' + res.status);
+
+        const reader = res.body.pipeThrough(new TextDecoderStream()).getReader();
+        let buffer = '';
+        let result = null;
+        while (!result) {
+            const { value, done } = await reader.read();
+            if (done) break;
+            buffer += value;
+            let end;
+            while ((end = buffer.indexOf('\n\n')) >= 0) {
+                const block = buffer.slice(0, end);
+                buffer = buffer.slice(end + 2);
+                const lines = block.split('\n');
+                const event = (lines.find(line => line.startsWith('event: ')) || '').slice(7);
+                const data = lines.filter(line => line.startsWith('data: ')).map(line => line.slice(6)).join('\n');
+                if (!data) continue;
+                const payload = JSON.parse(data);
+                if (event === 'token') _appendText(payload.text);
+                else if (event === 'done' || event === 'error') result = payload;
+            }
+        }
+        if (result && result.cooldown) {
+            summaryData[ticker] = result.summary || '';
             _showToast('摘要在一小時內已更新，暫時無法重新產生');
             return;
         }
-        summaryData[ticker] = data.summary || '';
+        summaryData[ticker] = (result && result.summary) || '';
+        // 舊摘要：後端已在背景重新產生，稍後再取一次換成新的
+        if (result && result.stale) _recheckStaleSummary(ticker, 0);
     } catch {
         summaryData[ticker] = '';
     }
     _redraw();
 }
 
+// 先顯示舊摘要，之後每 30 秒靜默重取（不顯示載入骨架），拿到新的就換上，最多 3 次
+function _recheckStaleSummary(ticker, attempt) {
+    if (attempt >= 3) return;
+    setTimeout(async function() {
+        try {
+            const res = await authFetch('/ai-summary/' + ticker);
+            const data = await res.json();
+            if (data.stale) { _recheckStaleSummary(ticker, attempt + 1); return; }
+            if (data.summary && data.summary !== summaryData[ticker]) {
+                summaryData[ticker] = data.summary;
+                if (expandedTicker === ticker) {
+                    var detail = document.querySelector('.stock-detail');
+                    if (detail) { detail.innerHTML = detailHtml(ticker); scheduleChartRender(ticker); }
+                }
+            }
+        } catch {}
+    }, 30000);
+}
+
 function refreshSummary(ticker) {
     var btn = document.querySelector('.summary-refresh-btn');
     if (btn) btn.classList.add('spinning');
@@ -1372,56 +1424,128 @@ function getPollingInterval() {
     return 300000;
 }
 
+// 輪詢只是串流斷線時的備援：串流連著就不排下一輪
 function schedulePoll() {
     if (pollTimer) clearTimeout(pollTimer);
+    pollTimer = null;
+    if (quoteStream && quoteStream.live) return;
     pollTimer = setTimeout(async () => {
         await updateStockPrices();
         schedulePoll();
     }, getPollingInterval());
 }
 
+// 把一批報價 {ticker: data} 併進目前的股票列並重繪
+function applyQuotes(quotes) {
+    if (!stocks || !stocks.length) return;
+
+    const prev = {};
+    stocks.forEach(s => { prev[s.ticker] = s.price; });
+
+    const updated = stocks.map(stock => {
+        const data = quotes[stock.ticker];
+        if (!data || data.error) return stock;
+        return {
+            ...stock,
+            ...data,
+            company_name: data.company_name || stock.company_name,
+            logo_url: data.logo_url || stock.logo_url,
+        };
+    });
+
+    // 標記價格有變動的股票，讓 renderStocks 做一次微閃爍
+    priceFlash = {};
+    updated.forEach(s => {
+        const before = prev[s.ticker];
+        if (before != null && typeof s.price === 'number' && s.price !== before) {
+            priceFlash[s.ticker] = s.price > before ? 'up' : 'down';
+        }
+    });
+
+    stocks = updated;
+    renderStocks();
+    updateLastUpdateTime();
+}
+
 async function updateStockPrices() {
     if (!stocks || !stocks.length) return;
 
     try {
-        const prev = {};
-        stocks.forEach(s => { prev[s.ticker] = s.price; });
-
-        const updated = await Promise.all(stocks.map(async (stock) => {
-            try {
-                const response = await authFetch('/stockprice/' + stock.ticker, { cache: 'no-store' });
-                if (!response.ok) throw new Error('HTTP ' + response.status);
-                const data = await response.json();
-                if (data.error) return stock;
-                return {
-                    ...stock,
-                    ...data,
-                    company_name: data.company_name || stock.company_name,
-                    logo_url: data.logo_url || stock.logo_url,
-                };
-            } catch {
-                return stock;
-            }
-        }));
-
-        // 標記價格有變動的股票，讓 renderStocks 做一次微閃爍
-        priceFlash = {};
-        updated.forEach(s => {
-            const before = prev[s.ticker];
-            if (before != null && typeof s.price === 'number' && s.price !== before) {
-                priceFlash[s.ticker] = s.price > before ? 'up' : 'down';
-            }
+        // 整個清單一次批次取價：每輪只打一個請求，而不是每列各打一次
+        const response = await authFetch('/stockprices', {
+            method: 'POST',
+            cache: 'no-store',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ tickers: stocks.map(s => s.ticker) })
         });
-
-        stocks = updated;
-        renderStocks();
-        updateLastUpdateTime();
+        if (!response.ok) throw new Error('HTTP ' + response.status);
+        applyQuotes(await response.json());
     } catch (error) {
         console.error('更新股票價格時發生錯誤:', error);
     }
 }
 
 
+/* ═══════ QUOTE STREAM ═══════ */
+
+// 後端 /stream/quotes 只在報價變動時推送；連著的時候不再輪詢。
+// EventSource 無法帶 Authorization header，故以 fetch 讀取 SSE 串流自行解析。
+let quoteStream = null;   // { controller, watchlistId, live }
+const STREAM_RETRY_MS = 10000;
+
+function closeQuoteStream() {
+    if (quoteStream) quoteStream.controller.abort();
+    quoteStream = null;
+}
+
+async function openQuoteStream(watchlistId) {
+    closeQuoteStream();
+    const stream = { controller: new AbortController(), watchlistId: watchlistId, live: false };
+    quoteStream = stream;
+
+    try {
+        const response = await authFetch('/stream/quotes?watchlist_id=' + watchlistId, {
+            cache: 'no-store',
+            signal: stream.controller.signal,
+        });
+        if (!response.ok || !response.body) throw new Error('HTTP ' + response.status);
+
+        stream.live = true;
+        schedulePoll(); // 串流已連上，取消排定中的輪詢
+
+        const reader = response.body.pipeThrough(new TextDecoderStream()).getReader();
+        let buffer = '';
+        while (true) {
+            const { value, done } = await reader.read();
+            if (done) break;
+            buffer += value;
+            let end;
+            while ((end = buffer.indexOf('\n\n')) >= 0) {
+                const block = buffer.slice(0, end);
+                buffer = buffer.slice(end + 2);
+                const data = block.split('\n')
+                    .filter(line => line.startsWith('data: '))
+                    .map(line => line.slice(6))
+                    .join('\n');
+                if (data && currentWatchlistId === watchlistId) applyQuotes(JSON.parse(data));
+            }
+        }
+    } catch (error) {
+        if (stream.controller.signal.aborted) return; // 主動關閉（切換清單），不必重連
+        console.error('報價串流中斷:', error);
+    }
+
+    if (quoteStream !== stream) return; // 已被新的串流取代
+    // 串流斷了：先退回輪詢（立刻補一次價），稍後再嘗試重連
+    quoteStream = null;
+    updateStockPrices();
+    schedulePoll();
+    setTimeout(() => {
+        if (!quoteStream && currentWatchlistId === watchlistId) openQuoteStream(watchlistId);
+    }, STREAM_RETRY_MS);
+}
+
+
 /* ═══════ TIME ═══════ */
 
 function updateLastUpdateTime() {
@@ -1439,7 +1563,7 @@ function updateLastUpdateTime() {
 // 抓目前清單的股票並重繪（切換清單、初始化都走這裡）
 async function loadCurrentWatchlistStocks() {
     const email = getCurrentUserEmail();
-    if (!email || !currentWatchlistId) { stocks = []; renderStocks(); return; }
+    if (!email || !currentWatchlistId) { closeQuoteStream(); stocks = []; renderStocks(); return; }
 
     const requestedWatchlistId = currentWatchlistId; // 記住這次請求對應的清單，避免舊回應蓋掉新清單
     expandedTicker = null;   // 換清單時收合展開中的個股
@@ -1454,9 +1578,10 @@ async function loadCurrentWatchlistStocks() {
     stocks = data;
     renderStocks();
     renderSettingsStockList();
-    updateStockPrices();
-    schedulePoll();
     updateLastUpdateTime();
+    // 串流連上時第一筆就是整份快照；連不上則由輪詢接手
+    schedulePoll();
+    openQuoteStream(requestedWatchlistId);
 }
 
 async function initializeStocks() {
@@ -0,0 +1,236 @@
+"""/ai-summary stale-while-revalidate 測試：資料庫讀取與摘要產生皆以 patch 取代。"""
+import asyncio
+import json
+import unittest
+from datetime import datetime, timedelta, timezone
+from unittest.mock import patch
+
+from app.api import stock
+
+
+def _cached(age: timedelta) -> dict:
+    return {
+        "ticker": "AAPL",
+        "summary": "舊摘要",
+        "generated_at": datetime.now(timezone.utc) - age,
+        "context_hash": "h",
+    }
+
+
+class TestAiSummaryStaleWhileRevalidate(unittest.TestCase):
+    def setUp(self):
+        self.generated = []
+
+    async def _generate(self, ticker):
+        self.generated.append(ticker)
+        await asyncio.sleep(0.02)
+        return "新摘要"
+
+    def _run(self, cached, calls=1, refresh=False):
+        async def scenario():
+            with patch.object(stock, "_db_fetch_summary", return_value=cached), \
+                    patch.object(stock, "generate_stock_summary", self._generate):
+                results = await asyncio.gather(*(
+                    stock.get_ai_summary("AAPL", refresh=refresh, _="u@example.com")
+                    for _ in range(calls)
+                ))
+                # 等背景工作跑完
+                while stock._summary_tasks:
+                    await asyncio.gather(*stock._summary_tasks)
+                return results
+        return asyncio.run(scenario())
+
+    def test_fresh_summary_returned_without_regeneration(self):
+        (result,) = self._run(_cached(timedelta(hours=2)))
+        self.assertEqual(result["summary"], "舊摘要")
+        self.assertNotIn("stale", result)
+        self.assertEqual(self.generated, [])
+
+    def test_stale_summary_returned_and_regenerated_once(self):
+        results = self._run(_cached(timedelta(hours=30)), calls=5)
+        for result in results:
+            self.assertEqual(result["summary"], "舊摘要")
+            self.assertTrue(result["stale"])
+        self.assertEqual(self.generated, ["AAPL"])
+
+    def test_missing_summary_generated_synchronously_once(self):
+        results = self._run(None, calls=3)
+        self.assertEqual([r["summary"] for r in results], ["新摘要"] * 3)
+        self.assertEqual(self.generated, ["AAPL"])
+
+    def test_refresh_still_synchronous(self):
+        (result,) = self._run(_cached(timedelta(hours=30)), refresh=True)
+        self.assertEqual(result["summary"], "新摘要")
+        self.assertNotIn("stale", result)
+
+
+class TestAiSummaryStream(unittest.TestCase):
+    def setUp(self):
+        self.saved = []
+
+    async def _tokens(self, ticker, context_text, *, is_fx=False):
+        for text in ["第一段", "第二段"]:
+            yield text
+
+    def _events(self, cached=None, unchanged=None):
+        async def _context(ticker):
+            return "context"
+
+        async def _reuse(ticker, fingerprint):
+            return unchanged
+
+        async def scenario():
+            with patch.object(stock, "_db_fetch_summary", return_value=cached), \
+                    patch.object(stock, "collect_summary_context", _context), \
+                    patch.object(stock, "reuse_unchanged_summary", _reuse), \
+                    patch.object(stock, "_stream_deepseek_summary", self._tokens), \
+                    patch.object(stock, "_db_upsert_summary", lambda *args: self.saved.append(args)):
+                response = await stock.stream_ai_summary("AAPL", _="u@example.com")
+                self.assertEqual(response.media_type, "text/event-stream")
+                chunks = [chunk async for chunk in response.body_iterator]
+                while stock._summary_tasks:
+                    await asyncio.gather(*stock._summary_tasks)
+                return chunks
+        events = []
+        for chunk in asyncio.run(scenario()):
+            lines = chunk.strip().split("\n")
+            events.append((lines[0][len("event: "):], json.loads(lines[1][len("data: "):])))
+        return events
+
+    def test_tokens_relayed_then_persisted(self):
+        events = self._events()
+        self.assertEqual([e for e, _ in events], ["token", "token", "done"])
+        self.assertEqual(events[-1][1]["summary"], "第一段第二段")
+        self.assertEqual(len(self.saved), 1)
+        ticker, summary, fingerprint = self.saved[0]
+        self.assertEqual((ticker, summary), ("AAPL", "第一段第二段"))
+        self.assertEqual(fingerprint, stock._context_fingerprint("AAPL", "context"))
+
+    def test_cached_summary_sent_as_single_done(self):
+        events = self._events(cached=_cached(timedelta(hours=1)))
+        self.assertEqual(events, [("done", {
+            "ticker": "AAPL", "summary": "舊摘要",
+            "generated_at": events[0][1]["generated_at"],
+        })])
+
+    def test_missing_context_keeps_existing_summary(self):
+        async def _context(ticker):
+            raise stock.SummaryContextUnavailable(f"{ticker} 取不到新聞與財報資料")
+
+        async def _llm(*args, **kwargs):
+            raise AssertionError("資料蒐集不到時不應呼叫 LLM")
+
+        with patch.object(stock, "collect_summary_context", _context), \
+                patch.object(stock, "_call_deepseek_summary", _llm), \
+                patch.object(stock, "_db_fetch_summary", return_value=_cached(timedelta(hours=30))):
+            self.assertEqual(asyncio.run(stock.generate_stock_summary("AAPL")), "舊摘要")
+        with patch.object(stock, "collect_summary_context", _context), \
+                patch.object(stock, "_db_fetch_summary", return_value=None):
+            self.assertEqual(asyncio.run(stock.generate_stock_summary("AAPL")), "")
+
+    def test_unchanged_context_skips_llm(self):
+        events = self._events(unchanged="沿用的摘要")
+        self.assertEqual([e for e, _ in events], ["done"])
+        self.assertEqual(events[0][1]["summary"], "沿用的摘要")
+        self.assertEqual(self.saved, [])
+
+
+class TestAiSummaryStreamSingleFlight(unittest.TestCase):
+    """同一支同時的串流、一般請求共用一次 LLM 呼叫；串流斷線時照樣寫入。"""
+
+    def setUp(self):
+        self.saved = []
+        self.llm_calls = 0
+
+    async def _tokens(self, ticker, context_text, *, is_fx=False):
+        self.llm_calls += 1
+        for text in ["第一段", "第二段", "第三段"]:
+            await asyncio.sleep(0.01)
+            yield text
+
+    def _scenario(self, body):
+        async def _context(ticker):
+            return "context"
+
+        async def _reuse(ticker, fingerprint):
+            return None
+
+        async def scenario():
+            with patch.object(stock, "_db_fetch_summary", return_value=None), \
+                    patch.object(stock, "collect_summary_context", _context), \
+                    patch.object(stock, "reuse_unchanged_summary", _reuse), \
+                    patch.object(stock, "_stream_deepseek_summary", self._tokens), \
+                    patch.object(stock, "_db_upsert_summary", lambda *args: self.saved.append(args)):
+                result = await body()
+                while stock.summary_flight._tasks:
+                    await asyncio.gather(*stock.summary_flight._tasks)
+                return result
+        return asyncio.run(scenario())
+
+    @staticmethod
+    async def _collect(response) -> list:
+        events = []
+        async for chunk in response.body_iterator:
+            lines = chunk.strip().split("\n")
+            events.append((lines[0][len("event: "):], json.loads(lines[1][len("data: "):])))
+        return events
+
+    def test_concurrent_streams_share_one_generation(self):
+        async def body():
+            async def stream(delay):
+                await asyncio.sleep(delay)
+                return await self._collect(await stock.stream_ai_summary("AAPL", _="u@example.com"))
+
+            async def plain(delay):
+                await asyncio.sleep(delay)
+                return await stock.get_ai_summary("AAPL", _="u@example.com")
+
+            # 第二個串流與一般請求在第一段送出後才進來
+            return await asyncio.gather(stream(0), stream(0.015), plain(0.015))
+
+        first, second, plain = self._scenario(body)
+        self.assertEqual(self.llm_calls, 1)
+        self.assertEqual(len(self.saved), 1)
+        for events in (first, second):
+            self.assertEqual([e for e, _ in events], ["token"] * 3 + ["done"])
+            self.assertEqual("".join(d["text"] for e, d in events if e == "token"), "第一段第二段第三段")
+            self.assertEqual(events[-1][1]["summary"], "第一段第二段第三段")
+        self.assertEqual(plain["summary"], "第一段第二段第三段")
+        self.assertEqual(stock._summary_streams, {})
+
+    def test_disconnect_still_persists(self):
+        async def body():
+            response = await stock.stream_ai_summary("AAPL", _="u@example.com")
+            iterator = response.body_iterator
+            first = await iterator.__anext__()
+            await iterator.aclose()  # 使用者收到第一段就離開
+            return first
+
+        first = self._scenario(body)
+        self.assertIn("第一段", first)
+        self.assertEqual(self.llm_calls, 1)
+        self.assertEqual([args[:2] for args in self.saved], [("AAPL", "第一段第二段第三段")])
+        self.assertEqual(stock._summary_streams, {})
+
+    def test_stream_behind_plain_request_not_leaked(self):
+        async def _call(ticker, context_text, *, is_fx=False):
+            return "".join([text async for text in self._tokens(ticker, context_text, is_fx=is_fx)])
+
+        async def body():
+            # 一般請求先擁有 summary_flight：串流只等結果，沒有逐段輸出
+            plain = asyncio.ensure_future(stock.get_ai_summary("AAPL", _="u@example.com"))
+            while "AAPL" not in stock.summary_flight:
+                await asyncio.sleep(0.001)
+            events = await self._collect(await stock.stream_ai_summary("AAPL", _="u@example.com"))
+            return events, await plain
+
+        with patch.object(stock, "_call_deepseek_summary", _call):
+            events, plain = self._scenario(body)
+        self.assertEqual(self.llm_calls, 1)
+        self.assertEqual([e for e, _ in events], ["done"])
+        self.assertEqual(events[-1][1]["summary"], plain["summary"])
+        self.assertEqual(stock._summary_streams, {})
+
+
+if __name__ == "__main__":
+    unittest.main()
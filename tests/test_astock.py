@@ -0,0 +1,88 @@
+"""新浪批次報價測試：GBK 回應整段解析、部分代號空白或缺漏、分批。以假 session 取代上游。"""
+import asyncio
+import unittest
+from unittest.mock import patch
+
+from app.api.providers import astock
+
+_HK_TENCENT = "TENCENT,騰訊控股,380.0,378.2,385.0,377.0,383.4,5.2,1.375,383.2,383.4,1,2,3,4,5,6,2026/10/16,16:08"
+_CN_PUFA = "浦發銀行,10.01,10.00,10.25,10.30,9.98,10.24,10.25,123456,1234567.0"
+
+
+class _FakeResponse:
+    status = 200
+
+    def __init__(self, body: bytes):
+        self._body = body
+
+    async def read(self):
+        return self._body
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+class _FakeSina:
+    """依 list= 內的代號回 hq_str_ 行；lines 沒給的代號整行缺漏（與新浪對不存在代號的行為不同，也要能處理）。"""
+
+    def __init__(self, lines: dict):
+        self.lines = lines
+        self.requests = []
+
+    def get(self, url, **kwargs):
+        symbols = url.split("list=", 1)[1].split(",")
+        self.requests.append(symbols)
+        body = "\n".join(
+            f'var hq_str_{symbol}="{self.lines[symbol]}";' for symbol in symbols if symbol in self.lines
+        )
+        return _FakeResponse(body.encode("gbk"))
+
+
+class TestSinaBatch(unittest.TestCase):
+    def _fetch(self, tickers, fake):
+        with patch.object(astock, "get_session", lambda name: fake):
+            return asyncio.run(astock.fetch_astock_quotes(tickers))
+
+    def test_hk_and_cn_in_one_request(self):
+        fake = _FakeSina({"hk00700": _HK_TENCENT, "sh600000": _CN_PUFA})
+        results = self._fetch(["0700.HK", "600000.SS"], fake)
+        self.assertEqual(fake.requests, [["hk00700", "sh600000"]])
+        self.assertEqual(results["0700.HK"]["company_name"], "騰訊控股")
+        self.assertEqual(results["0700.HK"]["price"], 383.4)
+        self.assertEqual(results["600000.SS"]["company_name"], "浦發銀行")
+        self.assertEqual(results["600000.SS"]["price_change"], 0.25)
+
+    def test_partial_and_missing_symbols(self):
+        fake = _FakeSina({
+            "hk00700": _HK_TENCENT,
+            "hk99999": "",                      # 新浪對不存在的代號回空字串
+            "sz000001": "平安銀行,11.0,11.0",     # 欄位不足
+        })
+        results = self._fetch(["0700.HK", "99999.HK", "000001.SZ", "300750.SZ"], fake)  # 300750 整行缺漏
+        self.assertEqual(set(results), {"0700.HK"})
+
+    def test_zero_price_rejected(self):
+        suspended = _CN_PUFA.replace("10.25,10.30", "0.00,0.00", 1)
+        results = self._fetch(["600000.SS"], _FakeSina({"sh600000": suspended}))
+        self.assertEqual(results, {})
+
+    def test_same_symbol_different_spelling(self):
+        fake = _FakeSina({"hk00700": _HK_TENCENT})
+        results = self._fetch(["0700.HK", "700.hk"], fake)
+        self.assertEqual(fake.requests, [["hk00700"]])
+        self.assertEqual(set(results), {"0700.HK", "700.hk"})
+        self.assertEqual(results["700.hk"]["ticker"], "700.hk")
+
+    def test_split_into_chunks(self):
+        tickers = [f"{600000 + i}.SS" for i in range(450)]
+        fake = _FakeSina({f"sh{600000 + i}": _CN_PUFA for i in range(450)})
+        results = self._fetch(tickers, fake)
+        self.assertEqual([len(r) for r in fake.requests], [200, 200, 50])
+        self.assertEqual(len(results), 450)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,269 @@
+"""備份測試：檔案寫到暫存目錄。
+
+plain 格式的 pg_dump 以輸出假資料的子行程取代；directory 快照的去重以假的 dump 目錄測，
+還原則打真實資料庫（需 POSTGRES_HOST=localhost，帳號可建立資料庫）。
+"""
+import gzip
+import os
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from pathlib import Path
+from unittest.mock import patch
+
+from app.models import backup
+
+_DUMP = b"-- dump\n" + b"INSERT INTO users VALUES (1);\n" * 100 + b"-- PostgreSQL database dump complete\n"
+
+
+def _fake_pg_dump(script: str) -> list:
+    return [sys.executable, "-c", script]
+
+
+def _emitting(payload: bytes) -> list:
+    return _fake_pg_dump(f"import sys; sys.stdout.buffer.write({payload!r})")
+
+
+class BackupTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.dir = Path(self.tmp.name)
+        for name, value in (("BACKUP_DIR", self.dir), ("BACKUP_FORMAT", "plain")):
+            patcher = patch.object(backup, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.addCleanup(self.tmp.cleanup)
+
+    def _fake(self, cmd: list):
+        return patch.object(backup, "_pg_dump_cmd", return_value=cmd)
+
+    def _backups(self):
+        return sorted(self.dir.glob(f"{backup.FILE_PREFIX}*{backup.FILE_SUFFIX}"))
+
+
+class TestStartupBackup(BackupTestCase):
+    def test_runs_when_no_backup(self):
+        with self._fake(_emitting(_DUMP)):
+            path = backup.run_startup_backup()
+        self.assertEqual(self._backups(), [path])
+        with gzip.open(path) as f:
+            self.assertEqual(f.read(), _DUMP)
+
+    def test_skips_when_recent_backup_exists(self):
+        (self.dir / f"{backup.FILE_PREFIX}20261018-030000{backup.FILE_SUFFIX}").write_bytes(b"x")
+        with patch.object(backup, "_stream_dump") as dump:
+            self.assertIsNone(backup.run_startup_backup())
+        dump.assert_not_called()
+
+    def test_runs_when_latest_backup_is_old(self):
+        old = self.dir / f"{backup.FILE_PREFIX}20261001-030000{backup.FILE_SUFFIX}"
+        old.write_bytes(b"x")
+        stale = time.time() - backup.RECENT_BACKUP_MAX_AGE.total_seconds() - 60
+        os.utime(old, (stale, stale))
+        with self._fake(_emitting(_DUMP)):
+            self.assertIsNotNone(backup.run_startup_backup())
+        self.assertEqual(len(self._backups()), 2)
+
+
+class TestOverlapGuard(BackupTestCase):
+    def test_second_backup_is_rejected_while_first_runs(self):
+        started, release = threading.Event(), threading.Event()
+
+        def _slow_dump(out, dbname=None):
+            started.set()
+            release.wait(5)
+            out.write(_DUMP)
+            return len(_DUMP), _DUMP[-backup._TAIL_BYTES:]
+
+        with patch.object(backup, "_stream_dump", side_effect=_slow_dump):
+            first = threading.Thread(target=backup.run_backup)
+            first.start()
+            started.wait(5)
+            with self.assertRaises(backup.BackupInProgress):
+                backup.run_backup()
+            release.set()
+            first.join(5)
+        self.assertEqual(len(self._backups()), 1)
+        # 鎖在完成後釋放，下一次可以正常跑
+        with self._fake(_emitting(_DUMP)):
+            backup.run_backup()
+
+    def test_incomplete_dump_releases_lock(self):
+        with self._fake(_emitting(b"-- truncated")):
+            with self.assertRaises(RuntimeError):
+                backup.run_backup()
+        with self._fake(_emitting(_DUMP)):
+            self.assertTrue(backup.run_backup().exists())
+
+
+class TestStreaming(BackupTestCase):
+    def test_large_dump_streams_through_gzip(self):
+        # 約 24 MB、每塊內容不同，確認跨塊的結尾檢查與還原後內容一致
+        script = (
+            "import sys\n"
+            "for i in range(300000):\n"
+            "    sys.stdout.buffer.write(b'INSERT INTO t VALUES (%d, 0123456789abcdef);\\n' % i)\n"
+            "sys.stdout.buffer.write(b'-- PostgreSQL database dump complete\\n')\n"
+        )
+        with self._fake(_fake_pg_dump(script)):
+            path = backup.run_backup()
+        report = backup.last_report
+        self.assertEqual(report["file"], path.name)
+        self.assertGreater(report["raw_bytes"], 10 * backup._CHUNK_BYTES)
+        self.assertLess(report["compressed_bytes"], report["raw_bytes"])
+        self.assertIsNotNone(report["throughput_mb_s"])
+        with gzip.open(path) as f:
+            restored = f.read()
+        self.assertEqual(len(restored), report["raw_bytes"])
+        self.assertTrue(restored.startswith(b"INSERT INTO t VALUES (0,"))
+
+    def test_missing_trailer_leaves_no_file(self):
+        payload = b"INSERT INTO users VALUES (1);\n" * 100
+        with self._fake(_emitting(payload)):
+            with self.assertRaisesRegex(RuntimeError, "不完整"):
+                backup.run_backup()
+        self.assertEqual(list(self.dir.iterdir()), [self.dir / backup.LOCK_FILE])
+
+    def test_pg_dump_error_includes_stderr(self):
+        script = "import sys; sys.stderr.write('connection refused'); sys.exit(1)"
+        with self._fake(_fake_pg_dump(script)):
+            with self.assertRaisesRegex(RuntimeError, "returncode=1.*connection refused"):
+                backup.run_backup()
+        self.assertEqual(self._backups(), [])
+
+    def test_timeout_kills_pg_dump(self):
+        with self._fake(_fake_pg_dump("import time; time.sleep(30)")), \
+                patch.object(backup, "DUMP_TIMEOUT_SECONDS", 0.2):
+            with self.assertRaisesRegex(RuntimeError, "逾時"):
+                backup.run_backup()
+
+
+def _fake_directory_dump(tables: dict):
+    """假的 pg_dump -Fd：依 tables（檔名 → 內容）建立 dump 目錄。"""
+    def _dump(target, jobs, dbname=None):
+        target.mkdir()
+        (target / "toc.dat").write_bytes(b"toc" * 100)
+        for name, content in tables.items():
+            (target / name).write_bytes(content)
+    return _dump
+
+
+class TestDirectorySnapshots(BackupTestCase):
+    def setUp(self):
+        super().setUp()
+        patcher = patch.object(backup, "BACKUP_FORMAT", "directory")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.tables = {"3001.dat.gz": b"users" * 100, "3002.dat.gz": b"bars" * 1000}
+
+    def _snapshot(self):
+        with patch.object(backup, "_dump_directory", _fake_directory_dump(self.tables)), \
+                patch.object(backup, "_verify_directory", return_value=len(self.tables)), \
+                patch.object(backup, "_stamp", return_value=f"20261018-0300{len(backup.list_backups()):02d}"):
+            return backup.run_backup()
+
+    def _objects(self):
+        return sorted((self.dir / backup.OBJECTS_DIR).iterdir())
+
+    def test_unchanged_tables_are_stored_once(self):
+        first = self._snapshot()
+        self.tables["3002.dat.gz"] = b"bars changed" * 1000
+        second = self._snapshot()
+        self.assertEqual(backup.last_report["reused_files"], 1)
+        self.assertEqual(backup.last_report["new_bytes"], len(self.tables["3002.dat.gz"]))
+        # 沒變的 users 是同一個檔案（inode），變了的是新物件
+        self.assertTrue((first / "3001.dat.gz").samefile(second / "3001.dat.gz"))
+        self.assertFalse((first / "3002.dat.gz").samefile(second / "3002.dat.gz"))
+        self.assertEqual(len(self._objects()), 3)
+        self.assertEqual((second / "3002.dat.gz").read_bytes(), self.tables["3002.dat.gz"])
+        self.assertEqual(backup.latest_backup(), second)
+
+    def test_prune_collects_unreferenced_objects(self):
+        self._snapshot()
+        self.tables["3002.dat.gz"] = b"bars changed" * 1000
+        with patch.object(backup, "KEEP_COUNT", 1):
+            second = self._snapshot()
+        self.assertEqual(backup.list_backups(), [second])
+        # 只剩第二份快照引用的兩個物件
+        self.assertEqual(len(self._objects()), 2)
+
+    def test_failed_verification_leaves_nothing(self):
+        with patch.object(backup, "_dump_directory", _fake_directory_dump(self.tables)), \
+                patch.object(backup, "_verify_directory", side_effect=RuntimeError("toc 壞了")):
+            with self.assertRaises(RuntimeError):
+                backup.run_backup()
+        self.assertEqual(backup.list_backups(), [])
+        self.assertEqual(sorted(p.name for p in self.dir.iterdir()), [backup.LOCK_FILE])
+
+
+def _psql(dbname, sql):
+    return backup._run_pg(["psql", *backup._conn_args(dbname), "-qtAc", sql]).strip()
+
+
+class TestRestoreRoundTrip(BackupTestCase):
+    """真實 pg_dump / pg_restore：備份一個小資料庫，再還原到新資料庫比對內容。"""
+    SOURCE = "stockwatch_backup_test"
+    TARGET = "stockwatch_restore_test"
+
+    def setUp(self):
+        super().setUp()
+        host = backup._conn_args()[:-2]
+        for db in (self.SOURCE, self.TARGET):
+            backup._run_pg(["dropdb", *host, "--if-exists", db])
+            self.addCleanup(backup._run_pg, ["dropdb", *host, "--if-exists", db])
+        backup._run_pg(["createdb", *host, self.SOURCE])
+        _psql(self.SOURCE, "CREATE TABLE users (id INT PRIMARY KEY, email TEXT);"
+                           "INSERT INTO users SELECT g, 'u' || g FROM generate_series(1, 500) g;"
+                           "CREATE TABLE bars AS SELECT g AS id, g * 1.5 AS close FROM generate_series(1, 20000) g;")
+
+    def _assert_restored(self):
+        self.assertEqual(_psql(self.TARGET, "SELECT COUNT(*), SUM(id) FROM users"), "500|125250")
+        self.assertEqual(_psql(self.TARGET, "SELECT COUNT(*) FROM bars"), "20000")
+
+    def test_directory_snapshot_parallel_restore(self):
+        path, report = backup.backup_directory(self.dir, 2, self.SOURCE)
+        self.assertEqual(report["tables"], 2)
+        # 再做一份：內容沒變，資料檔全部沿用
+        time.sleep(1)
+        _, again = backup.backup_directory(self.dir, 2, self.SOURCE)
+        self.assertEqual(again["reused_files"], again["files"])
+        result = backup.restore(path, self.TARGET, jobs=2, create=True)
+        self.assertEqual(result["jobs"], 2)
+        self._assert_restored()
+        # --clean 可覆蓋已存在的資料庫
+        _psql(self.TARGET, "DELETE FROM users")
+        backup.restore(path, self.TARGET, jobs=2, clean=True)
+        self._assert_restored()
+
+    def test_plain_restore(self):
+        path, _ = backup.backup_plain(self.dir, self.SOURCE)
+        backup.restore(path, self.TARGET, create=True)
+        self._assert_restored()
+        with self.assertRaises(ValueError):
+            backup.restore(path, self.TARGET, clean=True)
+
+    def test_resolve_backup(self):
+        path, _ = backup.backup_plain(self.dir, self.SOURCE)
+        self.assertEqual(backup.resolve_backup(None), path)
+        self.assertEqual(backup.resolve_backup(path.name), path)
+        with self.assertRaises(FileNotFoundError):
+            backup.resolve_backup("stockwatch-nope.dump")
+
+
+class TestCommandLine(unittest.TestCase):
+    def test_restore_requires_dbname(self):
+        with self.assertRaises(SystemExit), patch("sys.stderr"):
+            backup.main(["restore"])
+
+    def test_restore_dispatch(self):
+        with patch.object(backup, "resolve_backup", return_value=Path("x.dump")) as resolve, \
+                patch.object(backup, "restore") as restore:
+            backup.main(["restore", "x.dump", "--dbname", "restore_test", "--jobs", "3", "--create"])
+        resolve.assert_called_once_with("x.dump")
+        restore.assert_called_once_with(Path("x.dump"), "restore_test", 3, True, False)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,138 @@
+"""K 線本地儲存測試。
+
+slice_period 為純函式；sync/load 打真實資料庫（需 POSTGRES_HOST=localhost），
+上游下載以 patch 取代，用來確認第一次完整回補、之後只抓新 bar。
+"""
+import unittest
+from unittest.mock import patch
+
+import pandas as pd
+
+from app.api import bar_store
+from app.models.db import get_db_connection
+from app.models.migrations import ensure_price_bars
+
+TEST_TICKER = "BARTEST.T"
+
+
+def _bars(start: str, closes, freq: str = "D") -> pd.DataFrame:
+    idx = pd.date_range(start, periods=len(closes), freq=freq, name="ts")
+    close = pd.Series(closes, index=idx, dtype=float)
+    return pd.DataFrame({
+        "Open": close, "High": close + 1, "Low": close - 1, "Close": close,
+        "Volume": pd.Series(100.0, index=idx),
+    })
+
+
+def _execute(sql, params=None):
+    conn = get_db_connection()
+    cur = conn.cursor()
+    try:
+        cur.execute(sql, params)
+        conn.commit()
+    finally:
+        cur.close()
+        conn.close()
+
+
+class TestSlicePeriod(unittest.TestCase):
+    def test_months_and_years(self):
+        bars = _bars("2024-01-01", range(400))
+        last = bars.index[-1]
+        three = bar_store.slice_period(bars, "3mo")
+        self.assertEqual(three.index[-1], last)
+        self.assertGreater(three.index[0], last - pd.DateOffset(months=3))
+        self.assertEqual(len(bar_store.slice_period(bars, "1y")), 366)
+        self.assertEqual(len(bar_store.slice_period(bars, "max")), 400)
+
+    def test_days_count_trading_days(self):
+        """Nd 以有資料的日子計，一天多根分 K 整天保留。"""
+        bars = _bars("2024-01-01 00:00", range(6 * 24), freq="h")
+        one = bar_store.slice_period(bars, "1d")
+        self.assertEqual(len(one), 24)
+        self.assertTrue((one.index.normalize() == bars.index[-1].normalize()).all())
+        self.assertEqual(len(bar_store.slice_period(bars, "5d")), 5 * 24)
+
+    def test_empty(self):
+        self.assertTrue(bar_store.slice_period(bar_store._empty_bars(), "1y").empty)
+
+
+class TestRangePlanner(unittest.TestCase):
+    """各 range 從同一條日 K 切出，指標在整條序列上算。"""
+
+    def test_ma_warm_at_range_start(self):
+        from app.api import stock
+        bars = _bars("2023-01-01", [100 + i % 7 for i in range(500)])
+        data = stock._compute_history(bars, "3mo", "1d")
+        self.assertEqual(len(data["dates"]), len(bar_store.slice_period(bars, "3mo")))
+        self.assertIsNotNone(data["ma120"][0])
+        self.assertEqual(data["close"][-1], bars["Close"].iloc[-1])
+
+    def test_sparkline_from_daily_series(self):
+        from app.api import stock
+        bars = _bars("2024-01-01", range(100))
+        points = stock._sparkline_points(bars)
+        self.assertLessEqual(len(points), 30)
+        self.assertEqual(points[-1], 99.0)
+
+    def test_empty_series(self):
+        from app.api import stock
+        self.assertEqual(stock._compute_history(bar_store._empty_bars(), "1y", "1d")["close"], [])
+
+
+class TestSync(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        ensure_price_bars()
+
+    def setUp(self):
+        for table in ("price_bars", "price_bar_series"):
+            _execute(f"DELETE FROM {table} WHERE ticker = %s", (TEST_TICKER,))
+
+    tearDown = setUp
+
+    def _expire(self):
+        _execute(
+            "UPDATE price_bar_series SET refreshed_at = NOW() - INTERVAL '1 day' WHERE ticker = %s",
+            (TEST_TICKER,),
+        )
+
+    def test_backfill_then_incremental(self):
+        full = _bars("2024-01-01", [10, 11, 12, 13])
+        with patch.object(bar_store, "download", return_value=full) as dl:
+            bars = bar_store.load(TEST_TICKER, "1d")
+        self.assertEqual(dl.call_args.kwargs, {"period": bar_store.BACKFILL_PERIODS["1d"]})
+        self.assertEqual(bars["Close"].tolist(), [10, 11, 12, 13])
+
+        # 剛同步過：不問上游
+        with patch.object(bar_store, "download") as dl:
+            bar_store.load(TEST_TICKER, "1d")
+        dl.assert_not_called()
+
+        # 過期：從倒數第二根開始抓，最後一根被覆寫、新 bar 接上
+        self._expire()
+        tail = _bars("2024-01-03", [12, 13.5, 14])
+        with patch.object(bar_store, "download", return_value=tail) as dl:
+            bars = bar_store.load(TEST_TICKER, "1d")
+        self.assertEqual(dl.call_args.kwargs, {"start": "2024-01-03"})
+        self.assertEqual(bars["Close"].tolist(), [10, 11, 12, 13.5, 14])
+
+    def test_adjustment_change_triggers_backfill(self):
+        with patch.object(bar_store, "download", return_value=_bars("2024-01-01", [10, 11, 12])):
+            bar_store.load(TEST_TICKER, "1d")
+        self._expire()
+        # 重疊的已收盤 bar 價格變了（除息還原）→ 整段重抓
+        adjusted = _bars("2024-01-01", [9, 10, 11, 12])
+        with patch.object(bar_store, "download",
+                          side_effect=[_bars("2024-01-02", [10, 11.5]), adjusted]) as dl:
+            bars = bar_store.load(TEST_TICKER, "1d")
+        self.assertEqual(dl.call_count, 2)
+        self.assertEqual(bars["Close"].tolist(), [9, 10, 11, 12])
+
+    def test_empty_upstream_stores_nothing(self):
+        with patch.object(bar_store, "download", return_value=bar_store._empty_bars()):
+            self.assertTrue(bar_store.load(TEST_TICKER, "1d").empty)
+
+
+if __name__ == "__main__":
+    unittest.main()
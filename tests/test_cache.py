@@ -0,0 +1,178 @@
+"""TTLCache 單元測試：不需資料庫與網路。"""
+import asyncio
+import os
+import tempfile
+import threading
+import time
+import unittest
+from unittest.mock import patch
+
+from app.core.cache import TTLCache, all_stats
+from app.core import shared_cache
+from app.core.shared_cache import SQLiteBackend
+
+
+class TestTTLCache(unittest.TestCase):
+    def test_lru_eviction_keeps_recently_used(self):
+        cache = TTLCache("test-lru", maxsize=2, ttl=60)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")          # a 變成最近使用
+        cache.set("c", 3)       # 淘汰最久沒用的 b
+        self.assertIn("a", cache)
+        self.assertNotIn("b", cache)
+        self.assertIn("c", cache)
+        self.assertEqual(cache.stats()["evictions"], 1)
+
+    def test_entry_expires_after_ttl(self):
+        cache = TTLCache("test-ttl", maxsize=10, ttl=0.01)
+        cache.set("a", 1)
+        self.assertEqual(cache.get("a"), 1)
+        time.sleep(0.02)
+        self.assertIsNone(cache.get("a"))
+        stats = cache.stats()
+        self.assertEqual((stats["hits"], stats["misses"], stats["expirations"]), (1, 1, 1))
+        self.assertEqual(stats["size"], 0)
+
+    def test_ttl_policy_decides_per_entry(self):
+        """報價快取的用法：依值（市場狀態）決定該筆活多久。"""
+        cache = TTLCache("test-policy", maxsize=10,
+                         ttl_policy=lambda v: 0.01 if v["market_state"] == "REGULAR" else 60)
+        cache.set("AAPL", {"market_state": "REGULAR"})
+        cache.set("2330.TW", {"market_state": "CLOSED"})
+        time.sleep(0.02)
+        self.assertNotIn("AAPL", cache)
+        self.assertIn("2330.TW", cache)
+
+    def test_memory_estimate_tracks_entries(self):
+        cache = TTLCache("test-memory", maxsize=10, ttl=60)
+        cache.set("big", {"close": [1.0] * 1000})
+        self.assertGreater(cache.stats()["memory_bytes"], 8000)
+        cache.pop("big")
+        self.assertEqual(cache.stats()["memory_bytes"], 0)
+
+    def test_registered_for_metrics(self):
+        TTLCache("test-registry", maxsize=1, ttl=1)
+        self.assertIn("test-registry", all_stats())
+
+
+class TestSharedBackend(unittest.TestCase):
+    """兩個 TTLCache 共用同一個 SQLite 檔，模擬兩個 worker。"""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        path = os.path.join(self.tmp.name, "cache.sqlite3")
+        self.worker_a = TTLCache("test-shared", maxsize=10, ttl=60, backend=SQLiteBackend(path))
+        self.worker_b = TTLCache("test-shared", maxsize=10, ttl=60, backend=SQLiteBackend(path))
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_other_worker_sees_value(self):
+        history = {"ticker": "AAPL", "close": [1.5] * 1000, "dates": ["2026-01-02"] * 1000}
+        self.worker_a.set("AAPL:3m", history)
+        self.worker_a.backend.flush()
+        self.assertEqual(self.worker_b.get("AAPL:3m"), history)
+        self.assertEqual(self.worker_b.stats()["shared_hits"], 1)
+        # 之後直接命中記憶體，不再讀共用層
+        self.worker_b.get("AAPL:3m")
+        self.assertEqual(self.worker_b.stats()["shared_hits"], 1)
+        self.assertEqual(self.worker_b.backend.stats()["reads"], 1)
+
+    def test_async_get_reads_shared_off_loop(self):
+        history = {"ticker": "AAPL", "close": [1.5] * 1000}
+        self.worker_a.set("AAPL:3m", history)
+        self.worker_a.backend.flush()
+        threads = []
+        load = self.worker_b._load_shared
+
+        def _load_shared(key):
+            threads.append(threading.get_ident())
+            return load(key)
+
+        async def scenario():
+            loop_thread = threading.get_ident()
+            with patch.object(self.worker_b, "_load_shared", _load_shared):
+                value = await self.worker_b.aget("AAPL:3m")
+                again = await self.worker_b.aget("AAPL:3m")  # 已放回記憶體
+                missing = await self.worker_b.aget("MSFT:3m", "none")
+            return loop_thread, value, again, missing
+
+        loop_thread, value, again, missing = asyncio.run(scenario())
+        self.assertEqual((value, again, missing), (history, history, "none"))
+        self.assertEqual(len(threads), 2)
+        self.assertNotIn(loop_thread, threads)
+        stats = self.worker_b.stats()
+        self.assertEqual((stats["hits"], stats["shared_hits"], stats["misses"]), (2, 1, 1))
+
+    def test_expiry_is_shared(self):
+        self.worker_a.set("AAPL", {"price": 1}, ttl=0.05)
+        self.worker_a.backend.flush()
+        self.assertIsNotNone(self.worker_b.get("AAPL"))
+        time.sleep(0.06)
+        self.assertIsNone(self.worker_b.get("AAPL"))
+        self.worker_a.pop("AAPL")
+        self.worker_a.backend.flush()
+        self.assertIsNone(self.worker_b.backend.get("test-shared", "AAPL"))
+
+    def test_pop_and_clear_reach_shared_layer(self):
+        self.worker_a.set("a", 1)
+        self.worker_a.set("b", 2)
+        self.worker_a.pop("a")
+        self.worker_a.backend.flush()
+        self.assertIsNone(self.worker_b.get("a"))
+        self.worker_a.clear()
+        self.worker_a.backend.flush()
+        self.assertIsNone(self.worker_b.get("b"))
+
+    def test_serialized_and_written_off_caller_thread(self):
+        threads = []
+
+        class Probe:
+            def __reduce__(self):
+                threads.append(threading.get_ident())
+                return (dict, ())
+
+        self.worker_a.set("probe", Probe())
+        self.worker_a.backend.flush()
+        self.assertEqual(len(threads), 1)
+        self.assertNotEqual(threads[0], threading.get_ident())
+        self.assertEqual(self.worker_b.get("probe"), {})
+
+    def test_unpicklable_value_stays_in_memory(self):
+        self.worker_a.set("lock", threading.Lock())
+        self.worker_a.backend.flush()
+        self.assertIsNotNone(self.worker_a.get("lock"))
+        self.assertIsNone(self.worker_b.get("lock"))
+        self.assertEqual(self.worker_a.backend.stats()["errors"], 1)
+
+    def test_unavailable_backend_degrades_to_memory(self):
+        self.worker_a.backend._conn().close()
+        self.worker_a.set("a", 1)
+        self.assertEqual(self.worker_a.get("a"), 1)
+        self.assertIsNone(self.worker_a.get("b"))
+        self.assertGreater(self.worker_a.backend.stats()["errors"], 0)
+
+
+class TestSharedBackendPath(unittest.TestCase):
+    """共用快取檔會被 unpickle，不能放在別人也能寫的地方。"""
+
+    def test_world_writable_directory_rejected(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            os.chmod(tmp, 0o777)
+            with self.assertRaises(PermissionError):
+                SQLiteBackend(os.path.join(tmp, "cache.sqlite3"))
+
+    def test_new_file_is_private(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "cache.sqlite3")
+            SQLiteBackend(path)
+            self.assertEqual(os.stat(path).st_mode & 0o777, 0o600)
+
+    def test_sqlite_backend_requires_explicit_path(self):
+        with patch.object(shared_cache, "CACHE_BACKEND", "sqlite"), \
+                patch.object(shared_cache, "CACHE_SQLITE_PATH", ""):
+            self.assertIsNone(shared_cache._configured_backend())
+
+if __name__ == "__main__":
+    unittest.main()
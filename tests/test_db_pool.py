@@ -0,0 +1,98 @@
+"""連線池測試：丟棄的連線（已關閉、ping 失敗、歸還時出錯）都要從 open 計數扣掉。以假連線取代 psycopg2.connect。"""
+import unittest
+from unittest.mock import patch
+
+import psycopg2
+from psycopg2 import extensions
+
+from app.models import db
+
+
+class _FakeCursor:
+    def __init__(self, conn):
+        self._conn = conn
+
+    def execute(self, sql):
+        if self._conn.dead:
+            raise psycopg2.OperationalError("server closed the connection unexpectedly")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+class _FakeInfo:
+    transaction_status = extensions.TRANSACTION_STATUS_IDLE
+
+
+class _FakeConn:
+    def __init__(self):
+        self.closed = 0
+        self.dead = False
+        self.info = _FakeInfo()
+
+    def cursor(self):
+        return _FakeCursor(self)
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        self.closed = 1
+
+
+class TestConnectionPool(unittest.TestCase):
+    def setUp(self):
+        self.opened = []
+
+        def _connect():
+            conn = _FakeConn()
+            self.opened.append(conn)
+            return conn
+
+        patcher = patch.object(db, "_connect", _connect)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.pool = db.ConnectionPool(max_size=2, wait_timeout=0.1)
+
+    def _cycle(self, discard=False):
+        conn = self.pool.acquire()
+        self.pool.release(conn, 0.0, discard=discard)
+        return conn
+
+    def test_closed_idle_connection_not_counted(self):
+        first = self._cycle()
+        first.close()  # 閒置時被伺服器或別處關掉
+        second = self._cycle()
+        self.assertIsNot(second, first)
+        self.assertEqual(self.pool.stats()["open"], 1)
+
+    def test_stale_connection_failing_ping_not_counted(self):
+        first = self._cycle()
+        first.dead = True
+        with patch.object(db, "_IDLE_PING_SECONDS", -1):
+            second = self._cycle()
+        self.assertIsNot(second, first)
+        self.assertTrue(first.closed)
+        self.assertEqual(self.pool.stats()["open"], 1)
+
+    def test_discarded_on_release_not_counted(self):
+        self._cycle(discard=True)
+        stats = self.pool.stats()
+        self.assertEqual((stats["open"], stats["idle"]), (0, 0))
+
+    def test_open_count_stays_bounded(self):
+        for _ in range(20):
+            conn = self._cycle()
+            conn.close()
+        stats = self.pool.stats()
+        self.assertEqual((stats["open"], stats["idle"]), (1, 1))
+        self.assertLessEqual(stats["open"], stats["max_size"])
+        self.pool.close_all()
+        self.assertEqual(self.pool.stats()["open"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
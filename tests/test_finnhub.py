@@ -0,0 +1,78 @@
+"""Finnhub 報價測試：額度用盡時不等待、回 None 交給 yfinance；公司資料只在有多餘 token 時查。以假 session 取代上游。"""
+import asyncio
+import unittest
+from unittest.mock import patch
+
+from app.api.providers import finnhub
+from app.core.ratelimit import TokenBucket
+
+
+class _FakeResponse:
+    status = 200
+
+    def __init__(self, payload):
+        self._payload = payload
+
+    async def json(self, content_type=None):
+        return self._payload
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+class _FakeFinnhub:
+    def __init__(self):
+        self.paths = []
+
+    def get(self, url, params=None, **kwargs):
+        path = url.rsplit("/api/v1", 1)[1]
+        self.paths.append(path)
+        if path == "/quote":
+            return _FakeResponse({"c": 101.0, "pc": 100.0, "d": 1.0, "dp": 1.0})
+        return _FakeResponse({"name": f"{params['symbol']} Inc", "logo": "logo"})
+
+
+class TestFinnhubQuote(unittest.TestCase):
+    def setUp(self):
+        finnhub._company_cache.clear()
+        self.fake = _FakeFinnhub()
+
+    tearDown = setUp
+
+    def _fetch(self, bucket, tickers):
+        async def scenario():
+            return await asyncio.gather(*(finnhub.fetch_finnhub_quote(t, "key") for t in tickers))
+
+        with patch.object(finnhub, "get_session", lambda name: self.fake), \
+                patch.object(finnhub, "finnhub_bucket", bucket), \
+                patch.object(finnhub, "_QUOTE_TOKEN_WAIT_SECONDS", 0.05):
+            return asyncio.run(scenario())
+
+    def test_profile_fetched_once_then_cached(self):
+        bucket = TokenBucket("test_finnhub_profile", rate=100, capacity=5)
+        (first,) = self._fetch(bucket, ["AAPL"])
+        (second,) = self._fetch(bucket, ["AAPL"])
+        self.assertEqual(self.fake.paths, ["/quote", "/stock/profile2", "/quote"])
+        self.assertEqual((first["company_name"], second["company_name"]), ("AAPL Inc", "AAPL Inc"))
+
+    def test_profile_skipped_without_spare_token(self):
+        bucket = TokenBucket("test_finnhub_spare", rate=0.01, capacity=1)
+        (data,) = self._fetch(bucket, ["AAPL"])
+        self.assertEqual(self.fake.paths, ["/quote"])
+        self.assertEqual((data["price"], data["company_name"]), (101.0, ""))
+        self.assertIsNone(finnhub._company_cache.get("AAPL"))  # 沒查到不快取，下次有額度再查
+
+    def test_exhausted_bucket_returns_none_without_request(self):
+        bucket = TokenBucket("test_finnhub_exhausted", rate=0.01, capacity=2)
+        (first,) = self._fetch(bucket, ["AAPL"])
+        (second,) = self._fetch(bucket, ["MSFT"])
+        self.assertEqual(first["company_name"], "AAPL Inc")
+        self.assertIsNone(second)  # 交給呼叫端改走 yfinance
+        self.assertEqual(self.fake.paths, ["/quote", "/stock/profile2"])
+        self.assertEqual(bucket.stats()["rejected"], 1)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,67 @@
+"""共用 aiohttp session 測試：同一 loop 內重用、換 loop 或關閉後重建、lifespan 建立與釋放。不需網路。"""
+import asyncio
+import unittest
+
+from app.core import http
+
+
+class TestSharedSessions(unittest.TestCase):
+    def tearDown(self):
+        http._sessions.clear()
+
+    def test_reused_within_loop(self):
+        async def scenario():
+            first = http.get_session("twse")
+            second = http.get_session("twse")
+            other = http.get_session("sina")
+            await http.close_sessions()
+            return first, second, other
+
+        first, second, other = asyncio.run(scenario())
+        self.assertIs(first, second)
+        self.assertIsNot(first, other)
+        self.assertTrue(first.closed and other.closed)
+
+    def test_connector_limits_per_host(self):
+        async def scenario():
+            limits = {name: http.get_session(name).connector.limit for name in ("twse", "finnhub", "other")}
+            await http.close_sessions()
+            return limits
+
+        self.assertEqual(asyncio.run(scenario()), {"twse": 4, "finnhub": 20, "other": 10})
+
+    def test_recreated_after_close_or_new_loop(self):
+        async def first_loop():
+            session = http.get_session("twse")
+            await session.close()
+            reopened = http.get_session("twse")
+            self.assertIsNot(reopened, session)
+            await reopened.close()
+            return reopened
+
+        old = asyncio.run(first_loop())
+
+        async def second_loop():
+            # 上一個 loop 建的 session 不能再用（例如測試各自 asyncio.run）
+            session = http.get_session("twse")
+            await http.close_sessions()
+            return session
+
+        self.assertIsNot(asyncio.run(second_loop()), old)
+
+    def test_lifespan_init_and_close(self):
+        async def scenario():
+            await http.init_sessions()
+            sessions = [session for _, session in http._sessions.values()]
+            names = set(http._sessions)
+            await http.close_sessions()
+            return names, sessions
+
+        names, sessions = asyncio.run(scenario())
+        self.assertEqual(names, set(http._HOSTS))
+        self.assertTrue(all(session.closed for session in sessions))
+        self.assertEqual(http._sessions, {})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,95 @@
+"""技術指標單元測試：向量化結果須與舊版逐點計算的純 Python 實作一致。不需資料庫與網路。"""
+import math
+import random
+import unittest
+
+import pandas as pd
+
+from app.api import indicators
+
+
+def _ma_reference(close: list, window: int) -> list:
+    n = len(close)
+    if n < window:
+        return [None] * n
+    result = [None] * (window - 1)
+    for i in range(window - 1, n):
+        result.append(round(sum(close[i - window + 1: i + 1]) / window, 4))
+    return result
+
+
+def _bollinger_reference(close: list, window: int = 20, num_std: int = 2) -> tuple[list, list]:
+    n = len(close)
+    upper = [None] * n
+    lower = [None] * n
+    for i in range(window - 1, n):
+        seg = close[i - window + 1: i + 1]
+        mean = sum(seg) / window
+        std = math.sqrt(sum((x - mean) ** 2 for x in seg) / window)
+        upper[i] = round(mean + num_std * std, 4)
+        lower[i] = round(mean - num_std * std, 4)
+    return upper, lower
+
+
+def _assert_lists_close(test, got, want):
+    test.assertEqual(len(got), len(want))
+    for g, w in zip(got, want):
+        if w is None:
+            test.assertIsNone(g)
+        else:
+            test.assertAlmostEqual(g, w, places=3)
+
+
+class TestIndicators(unittest.TestCase):
+    def setUp(self):
+        rng = random.Random(42)
+        price = 100.0
+        closes = []
+        for _ in range(300):
+            price *= 1 + rng.uniform(-0.03, 0.03)
+            closes.append(round(price, 4))
+        self.closes = closes
+        self.series = pd.Series(closes)
+
+    def test_moving_averages_match_reference(self):
+        out = indicators.compute(self.series, ("ma20", "ma60", "ma120"))
+        for window in (20, 60, 120):
+            _assert_lists_close(self, indicators.to_list(out[f"ma{window}"]),
+                                _ma_reference(self.closes, window))
+
+    def test_bollinger_matches_reference(self):
+        out = indicators.compute(self.series, ("bb",))
+        upper, lower = _bollinger_reference(self.closes)
+        _assert_lists_close(self, indicators.to_list(out["bb_upper"]), upper)
+        _assert_lists_close(self, indicators.to_list(out["bb_lower"]), lower)
+
+    def test_short_series_is_all_none(self):
+        out = indicators.compute(pd.Series([1.0, 2.0, 3.0]), ("ma20", "bb"))
+        self.assertEqual(indicators.to_list(out["ma20"]), [None, None, None])
+        self.assertEqual(indicators.to_list(out["bb_upper"]), [None, None, None])
+
+    def test_max_drawdown(self):
+        self.assertEqual(indicators.max_drawdown(pd.Series([100.0, 120.0, 90.0, 130.0])), -25.0)
+        self.assertEqual(indicators.max_drawdown(pd.Series([1.0, 2.0, 3.0])), 0.0)
+
+    def test_rsi_bounds_and_warmup(self):
+        rsi = indicators.compute(self.series, ("rsi14",))["rsi14"]
+        self.assertTrue(rsi.iloc[:14].isna().all())
+        valid = rsi.dropna()
+        self.assertTrue(((valid >= 0) & (valid <= 100)).all())
+        rising = indicators.compute(pd.Series(range(1, 40), dtype=float), ("rsi14",))["rsi14"]
+        self.assertEqual(rising.iloc[-1], 100.0)
+
+    def test_macd_outputs(self):
+        out = indicators.compute(self.series, ("macd",))
+        self.assertEqual(set(out), {"macd", "macd_signal", "macd_hist"})
+        self.assertTrue(out["macd"].iloc[:25].isna().all())
+        self.assertAlmostEqual(out["macd_hist"].iloc[-1],
+                               out["macd"].iloc[-1] - out["macd_signal"].iloc[-1])
+
+    def test_unknown_indicator_is_ignored(self):
+        self.assertEqual(indicators.compute(self.series, ("nope",)), {})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,128 @@
+"""報價推播測試：訂閱 / 取消訂閱、只推有變動的報價、慢連線只留最新值、串流斷線時取消訂閱。不需資料庫與網路。"""
+import asyncio
+import json
+import unittest
+from unittest.mock import patch
+
+from app.api import stock
+from app.api.quote_hub import QuoteHub
+
+
+def _quote(ticker, price):
+    return {"ticker": ticker, "price": price, "market_state": "REGULAR"}
+
+
+class TestQuoteHub(unittest.TestCase):
+    def test_publish_reaches_only_subscribers(self):
+        async def scenario():
+            hub = QuoteHub()
+            a = hub.subscribe(["AAPL", "MSFT"])
+            b = hub.subscribe(["MSFT"])
+            hub.publish("AAPL", _quote("AAPL", 1))
+            hub.publish("NVDA", _quote("NVDA", 1))  # 沒人訂閱：不記錄
+            hub.publish("MSFT", _quote("MSFT", 2))
+            return hub, await a.next_batch(0.1), await b.next_batch(0.1)
+
+        hub, batch_a, batch_b = asyncio.run(scenario())
+        self.assertEqual(set(batch_a), {"AAPL", "MSFT"})
+        self.assertEqual(set(batch_b), {"MSFT"})
+        self.assertNotIn("NVDA", hub._last)
+        self.assertEqual(hub.stats(), {"tickers": 2, "subscriptions": 2})
+
+    def test_unchanged_quote_not_pushed(self):
+        async def scenario():
+            hub = QuoteHub()
+            sub = hub.subscribe(["AAPL"])
+            hub.publish("AAPL", _quote("AAPL", 1))
+            first = await sub.next_batch(0.1)
+            hub.publish("AAPL", _quote("AAPL", 1))
+            second = await sub.next_batch(0.05)
+            return first, second
+
+        first, second = asyncio.run(scenario())
+        self.assertEqual(first["AAPL"]["price"], 1)
+        self.assertEqual(second, {})
+
+    def test_slow_subscriber_keeps_latest_only(self):
+        async def scenario():
+            hub = QuoteHub()
+            sub = hub.subscribe(["AAPL"])
+            for price in (1, 2, 3):
+                hub.publish("AAPL", _quote("AAPL", price))
+            return await sub.next_batch(0.1)
+
+        self.assertEqual(asyncio.run(scenario()), {"AAPL": _quote("AAPL", 3)})
+
+    def test_unsubscribe_cleans_up(self):
+        async def scenario():
+            hub = QuoteHub()
+            a = hub.subscribe(["AAPL", "MSFT"])
+            b = hub.subscribe(["MSFT"])
+            hub.publish("AAPL", _quote("AAPL", 1))
+            hub.publish("MSFT", _quote("MSFT", 1))
+            a.close()
+            after_a = (set(hub._subscribers), set(hub._last))
+            b.close()
+            # 再訂閱時之前的推送紀錄已清掉：同樣的報價會重新推送
+            c = hub.subscribe(["MSFT"])
+            hub.publish("MSFT", _quote("MSFT", 1))
+            return hub, after_a, await c.next_batch(0.1)
+
+        hub, after_a, batch = asyncio.run(scenario())
+        self.assertEqual(after_a, ({"MSFT"}, {"MSFT"}))
+        self.assertEqual(set(batch), {"MSFT"})
+        self.assertEqual(hub.stats(), {"tickers": 1, "subscriptions": 1})
+
+    def test_active_tickers(self):
+        hub = QuoteHub()
+        hub.subscribe(["AAPL"])
+        hub.note_request(["2330.TW"])
+        self.assertEqual(hub.active_tickers(60), {"AAPL", "2330.TW"})
+        self.assertEqual(hub.active_tickers(-1), {"AAPL"})
+
+
+class _FakeRequest:
+    def __init__(self):
+        self.disconnected = False
+
+    async def is_disconnected(self):
+        return self.disconnected
+
+
+class TestStreamQuotes(unittest.TestCase):
+    def test_snapshot_then_changes_then_unsubscribe_on_disconnect(self):
+        hub = QuoteHub()
+        request = _FakeRequest()
+
+        async def _snapshot(tickers):
+            return {t: _quote(t, 1) for t in tickers}
+
+        async def scenario():
+            with patch.object(stock, "quote_hub", hub), \
+                    patch.object(stock, "_quotes_for", _snapshot), \
+                    patch.object(stock, "_db_fetch_watchlist_stocks",
+                                 lambda email, wid: [{"ticker": "AAPL"}, {"ticker": "MSFT"}]), \
+                    patch.object(stock, "_STREAM_HEARTBEAT_SECONDS", 0.05):
+                response = await stock.stream_quotes(request, watchlist_id=1, user_email="u@example.com")
+                body = response.body_iterator
+                chunks = [await body.__anext__()]
+                subscribed = hub.stats()
+                hub.publish("MSFT", _quote("MSFT", 2))
+                chunks.append(await body.__anext__())
+                chunks.append(await body.__anext__())  # 沒有變動：心跳
+                request.disconnected = True
+                chunks += [chunk async for chunk in body]
+                return chunks, subscribed
+
+        chunks, subscribed = asyncio.run(scenario())
+        self.assertEqual(subscribed, {"tickers": 2, "subscriptions": 1})
+        snapshot = json.loads(chunks[0].split("data: ", 1)[1])
+        self.assertEqual(set(snapshot), {"AAPL", "MSFT"})
+        change = json.loads(chunks[1].split("data: ", 1)[1])
+        self.assertEqual(change, {"MSFT": _quote("MSFT", 2)})
+        self.assertEqual(chunks[2], ": ping\n\n")
+        self.assertEqual(hub.stats(), {"tickers": 0, "subscriptions": 0})
+
+
+if __name__ == "__main__":
+    unittest.main()
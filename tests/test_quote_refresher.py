@@ -0,0 +1,161 @@
+"""背景報價刷新測試：只刷新有人在看的代號、依市場狀態與 Finnhub 額度決定間隔、各 provider 各自並行。
+上游與資料庫皆以 patch 取代。"""
+import asyncio
+import time
+import unittest
+from unittest.mock import patch
+
+from app.api import quote_refresher, stock
+from app.api.providers import finnhub
+from app.api.quote_hub import QuoteHub
+from app.core.ratelimit import TokenBucket
+
+
+class TestQuoteRefresher(unittest.TestCase):
+    def setUp(self):
+        self.hub = QuoteHub()
+        self.fetched = []
+        self.refresher = quote_refresher.QuoteRefresher()
+        self.refresher._tickers = ["AAPL", "MSFT", "NVDA", "2330.TW", "USDTWD=X"]
+        self.refresher._tickers_loaded_at = float("inf")  # 不讀資料庫
+
+        async def _fetch(tickers):
+            self.fetched.append(sorted(tickers))
+            return {t: {"ticker": t} for t in tickers}
+
+        states = {market: (lambda: "REGULAR") for market in quote_refresher._MARKET_STATE_FNS}
+        patches = [
+            patch.object(quote_refresher, "quote_hub", self.hub),
+            patch.object(stock, "_fetch_quotes", _fetch),
+            patch.object(stock.settings, "FINNHUB_API_KEY", "test-key"),
+            patch.dict(quote_refresher._MARKET_STATE_FNS, states),
+            patch.object(stock, "finnhub_refresh_seconds", 0.0),
+        ]
+        for p in patches:
+            p.start()
+            self.addCleanup(p.stop)
+
+    def _tick(self):
+        async def scenario():
+            await self.refresher._tick()
+            await asyncio.gather(*self.refresher._inflight.values())
+
+        asyncio.run(scenario())
+
+    def test_only_active_tickers_refreshed(self):
+        self._tick()
+        self.assertEqual(self.fetched, [])
+
+        sub = self.hub.subscribe(["AAPL"])
+        self.hub.note_request(["2330.TW", "GME"])  # GME 不在任何清單：不刷新
+        self._tick()
+        self.assertEqual(sorted(self.fetched), [["2330.TW"], ["AAPL"]])
+        self.assertEqual(self.refresher.stats()["active"], 2)
+
+        # 訂閱關閉、請求紀錄過期後就不再刷新
+        sub.close()
+        with patch.object(quote_refresher, "_ACTIVE_SECONDS", 0):
+            self.refresher._next_due.clear()
+            self._tick()
+        self.assertEqual(len(self.fetched), 2)
+
+    def test_cadence_by_market_state(self):
+        self.hub.note_request(["2330.TW", "USDTWD=X", "AAPL"])
+        start = time.monotonic()
+        self._tick()
+        due = {t: at - start for t, at in self.refresher._next_due.items()}
+        self.assertAlmostEqual(due["2330.TW"], quote_refresher._CADENCE["REGULAR"], delta=0.5)
+        self.assertAlmostEqual(due["USDTWD=X"], quote_refresher._OTHER_CADENCE, delta=0.5)
+        # 只有一支美股在看：額度夠，照 REGULAR 間隔
+        self.assertAlmostEqual(due["AAPL"], quote_refresher._CADENCE["REGULAR"], delta=0.5)
+
+    def test_finnhub_cadence_stretched_to_fit_rate_limit(self):
+        tickers = [f"US{i}" for i in range(30)]
+        self.refresher._tickers = tickers
+        self.hub.note_request(tickers)
+        start = time.monotonic()
+        with patch.object(quote_refresher, "finnhub_bucket", TokenBucket("test_finnhub", rate=1.0)):
+            self._tick()
+        # 30 支 / (1 次/秒 × 一半額度) = 每支 60 秒一次，合計每分鐘 30 次
+        interval = self.refresher._next_due["US0"] - start
+        self.assertAlmostEqual(interval, 60, delta=0.5)
+        per_minute = len(tickers) * 60 / interval
+        self.assertLessEqual(per_minute, 60 * quote_refresher._FINNHUB_SHARE + 0.5)
+        # 快取活得比刷新間隔久：下一次刷新前，前端輪詢都命中快取
+        ttl = stock._quote_ttl({"ticker": "US0", "market_state": "REGULAR"})
+        self.assertGreater(ttl, interval)
+        self.assertEqual(stock._quote_ttl({"ticker": "2330.TW", "market_state": "REGULAR"}), 4)
+
+    def test_groups_run_independently(self):
+        """美股那組卡住時，台股照常依間隔刷新；卡住的那組不重複排入。"""
+        release = asyncio.Event()
+
+        async def _fetch(tickers):
+            self.fetched.append(sorted(tickers))
+            if tickers == ["AAPL"]:
+                await release.wait()
+            return {t: {"ticker": t} for t in tickers}
+
+        self.hub.note_request(["AAPL", "2330.TW"])
+
+        async def scenario():
+            with patch.object(stock, "_fetch_quotes", _fetch):
+                await self.refresher._tick()
+                await asyncio.sleep(0.01)
+                in_flight = self.refresher.stats()["in_flight"]
+                self.refresher._next_due.clear()  # 兩支都到期
+                await self.refresher._tick()
+                await asyncio.sleep(0.01)
+                release.set()
+                await asyncio.gather(*self.refresher._inflight.values())
+                return in_flight
+
+        in_flight = asyncio.run(scenario())
+        self.assertEqual(in_flight, ["finnhub"])
+        self.assertEqual(self.fetched, [["AAPL"], ["2330.TW"], ["2330.TW"]])
+        self.assertNotIn("AAPL", self.refresher._next_due)  # 等那組回來後的下一輪再排
+        self.assertEqual(self.refresher.stats()["refreshed"], 3)
+
+
+class _FakeResponse:
+    def __init__(self, payload):
+        self.status = 200
+        self._payload = payload
+
+    async def json(self, content_type=None):
+        return self._payload
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+class _FakeSession:
+    def __init__(self):
+        self.urls = []
+
+    def get(self, url, **kwargs):
+        self.urls.append(url)
+        if url.endswith("/quote"):
+            return _FakeResponse({"c": 10.0, "pc": 9.0, "d": 1.0, "dp": 11.1})
+        return _FakeResponse({"name": "Test Corp", "logo": None})
+
+
+class TestFinnhubBucket(unittest.TestCase):
+    def test_every_finnhub_request_takes_a_token(self):
+        session = _FakeSession()
+        bucket = TokenBucket("test_finnhub_quote", rate=1000)
+        finnhub._company_cache.pop("ZZFH")
+        with patch.object(finnhub, "get_session", lambda name: session), \
+                patch.object(finnhub, "finnhub_bucket", bucket):
+            data = asyncio.run(finnhub.fetch_finnhub_quote("ZZFH", "key"))
+            asyncio.run(finnhub.fetch_finnhub_quote("ZZFH", "key"))  # 公司資料已快取
+        self.assertEqual(data["company_name"], "Test Corp")
+        self.assertEqual(len(session.urls), 3)
+        self.assertEqual(bucket.acquired, 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,115 @@
+"""盤中報價紀錄測試：分區維護、降採樣、以自家紀錄組 24h 走勢。
+
+打真實資料庫（需 POSTGRES_HOST=localhost）。
+"""
+import unittest
+from datetime import datetime, timedelta
+
+from app.api import quote_ticks
+from app.models.db import get_db_connection
+from app.models.migrations import ensure_quote_ticks
+
+TEST_TICKER = "9999.TW"
+
+
+def _execute(sql, params=None, fetch=False):
+    conn = get_db_connection()
+    cur = conn.cursor()
+    try:
+        cur.execute(sql, params)
+        rows = cur.fetchall() if fetch else None
+        conn.commit()
+        return rows
+    finally:
+        cur.close()
+        conn.close()
+
+
+def _session(start: datetime, minutes: int, price: float = 100.0) -> list:
+    """每 5 分鐘兩筆報價（格子內第二筆為收盤）。"""
+    rows = []
+    for i in range(0, minutes + 1, 5):
+        ts = start + timedelta(minutes=i)
+        rows.append((TEST_TICKER, ts, price + i))
+        rows.append((TEST_TICKER, ts + timedelta(minutes=2), price + i + 0.5))
+    return rows
+
+
+class TestQuoteTicks(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        ensure_quote_ticks()
+        cls.today = datetime.now(quote_ticks._PARTITION_TZ).date()
+        quote_ticks.maintain(today=cls.today)
+        cls.midnight = quote_ticks._day_bounds(cls.today)[0]
+
+    def setUp(self):
+        for table in ("quote_ticks", "quote_ticks_5m"):
+            _execute(f"DELETE FROM {table} WHERE ticker = %s", (TEST_TICKER,))
+
+    tearDown = setUp
+
+    def test_partitions_created_ahead(self):
+        names = {r[0] for r in _execute(
+            """SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+               JOIN pg_class p ON p.oid = i.inhparent WHERE p.relname = 'quote_ticks'""",
+            fetch=True)}
+        for offset in range(quote_ticks.PARTITION_DAYS_AHEAD + 1):
+            day = self.today + timedelta(days=offset)
+            self.assertIn(quote_ticks._partition_name(day), names)
+
+    def _record(self, rows):
+        quote_ticks._db_insert_ticks(rows)
+
+    def test_intraday_bars_from_ticks(self):
+        self._record(_session(self.midnight + timedelta(hours=1), 60)
+                     + _session(self.midnight + timedelta(hours=6), 120, price=200.0))
+        bars = quote_ticks.load_intraday_bars(TEST_TICKER, now=self.midnight + timedelta(hours=8, minutes=3))
+        self.assertIsNotNone(bars)
+        self.assertEqual(len(bars), 13 + 25)
+        self.assertEqual(bars.index[-1], datetime.combine(self.today, datetime.min.time()) + timedelta(hours=8))
+        # 每格取最後一筆
+        self.assertEqual(bars["Close"].iloc[-1], 320.5)
+        self.assertTrue((bars["Volume"] == 0).all())
+
+    def test_incomplete_session_falls_back(self):
+        # 沒有更早的交易時段：無法確認開盤就在記錄
+        self._record(_session(self.midnight + timedelta(hours=6), 120))
+        now = self.midnight + timedelta(hours=8, minutes=3)
+        self.assertIsNone(quote_ticks.load_intraday_bars(TEST_TICKER, now=now))
+
+        # 有前一段，但最新一段中間缺了一大塊
+        self._record(_session(self.midnight + timedelta(hours=1), 60))
+        _execute(
+            "DELETE FROM quote_ticks WHERE ticker = %s AND ts > %s AND ts < %s",
+            (TEST_TICKER, self.midnight + timedelta(hours=6, minutes=10),
+             self.midnight + timedelta(hours=7, minutes=30)),
+        )
+        self.assertIsNone(quote_ticks.load_intraday_bars(TEST_TICKER, now=now))
+
+    def test_stale_records_fall_back(self):
+        self._record(_session(self.midnight + timedelta(hours=1), 60)
+                     + _session(self.midnight + timedelta(hours=6), 120))
+        later = self.midnight + timedelta(days=1, hours=6)
+        self.assertIsNone(quote_ticks.load_intraday_bars(TEST_TICKER, now=later))
+
+    def test_non_exchange_ticker(self):
+        self.assertIsNone(quote_ticks.load_intraday_bars("USDTWD=X"))
+
+    def test_downsample_closed_day(self):
+        self._record(_session(self.midnight + timedelta(hours=1), 10))
+        quote_ticks.maintain(today=self.today + timedelta(days=1))
+        rows = _execute(
+            "SELECT open, high, low, close, samples FROM quote_ticks_5m WHERE ticker = %s ORDER BY ts",
+            (TEST_TICKER,), fetch=True)
+        self.assertEqual(rows, [(100.0, 100.5, 100.0, 100.5, 2), (105.0, 105.5, 105.0, 105.5, 2),
+                                (110.0, 110.5, 110.0, 110.5, 2)])
+        # 原始資料仍在保留期內，與 5 分 K 合併讀取不重複
+        bars = quote_ticks.load_intraday_bars(TEST_TICKER, now=self.midnight + timedelta(hours=2))
+        self.assertIsNone(bars)  # 只有一段，不算完整；但不應拋錯
+        merged = quote_ticks._db_fetch_buckets(TEST_TICKER, self.midnight)
+        self.assertEqual(len({b for b, _ in merged}), 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
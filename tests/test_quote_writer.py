@@ -0,0 +1,144 @@
+"""報價 write-behind 測試：同代號合併、批次寫入、失敗時保留待寫、壞資料不卡住整批、最短寫入間隔、
+報價紀錄分區不存在時補建後整批重試。
+
+寫入測試打真實資料庫（需 POSTGRES_HOST=localhost）。
+"""
+import asyncio
+import unittest
+from datetime import datetime, timedelta, timezone
+from unittest.mock import patch
+
+from app.api import quote_ticks, quote_writer as qw
+from app.models.db import get_db_connection
+from app.models.migrations import ensure_quote_ticks
+
+TICKERS = ("WBTEST1", "WBTEST2")
+
+
+def _quote(ticker, price):
+    return {
+        "ticker": ticker, "price": price, "prev_close": 10.0,
+        "price_change": price - 10.0, "price_change_percent": (price - 10.0) * 10,
+        "company_name": "Write Behind", "market_state": "REGULAR",
+    }
+
+
+def _query(sql, params=None):
+    conn = get_db_connection()
+    cur = conn.cursor()
+    try:
+        cur.execute(sql, params)
+        rows = cur.fetchall()
+        conn.commit()
+        return rows
+    finally:
+        cur.close()
+        conn.close()
+
+
+class TestQuoteWriter(unittest.TestCase):
+    def setUp(self):
+        _query("DELETE FROM stock_prices WHERE ticker = ANY(%s) RETURNING ticker", (list(TICKERS),))
+        self.writer = qw.QuoteWriter()
+
+    tearDown = setUp
+
+    def test_latest_per_ticker_in_one_batch(self):
+        self.writer.submit(_quote("WBTEST1", 11.0))
+        self.writer.submit(_quote("WBTEST1", 12.5))
+        self.writer.submit(_quote("WBTEST2", 9.0))
+        self.assertEqual(self.writer.stats()["pending"], 2)
+
+        written = asyncio.run(self.writer.flush())
+        self.assertEqual(written, 2)
+        rows = dict(_query(
+            "SELECT ticker, price FROM stock_prices WHERE ticker = ANY(%s)", (list(TICKERS),)
+        ))
+        self.assertEqual(float(rows["WBTEST1"]), 12.5)
+        self.assertEqual(float(rows["WBTEST2"]), 9.0)
+        self.assertEqual(self.writer.stats()["pending"], 0)
+
+    def test_failed_flush_keeps_rows(self):
+        self.writer.submit(_quote("WBTEST1", 11.0))
+        with patch.object(qw, "_db_upsert_stock_prices", side_effect=RuntimeError("db down")):
+            self.assertEqual(asyncio.run(self.writer.flush()), 0)
+        stats = self.writer.stats()
+        self.assertEqual((stats["pending"], stats["failures"]), (1, 1))
+
+    def test_bad_row_does_not_block_batch(self):
+        self.writer.submit(_quote("WBTEST1", 11.0))
+        self.writer.submit(_quote("WBTEST-WAY-TOO-LONG-TICKER", 1.0))   # 超過 VARCHAR(20)
+        self.writer.submit(_quote("WBTEST2", 1e12))                     # 超過 DECIMAL(10,2)
+        self.assertEqual(asyncio.run(self.writer.flush()), 1)
+        stats = self.writer.stats()
+        self.assertEqual((stats["pending"], stats["dropped"], stats["failures"]), (0, 2, 0))
+        rows = _query("SELECT ticker FROM stock_prices WHERE ticker = ANY(%s)", (list(TICKERS),))
+        self.assertEqual(rows, [("WBTEST1",)])
+
+        # 之後的寫入照常
+        self.writer.submit(_quote("WBTEST2", 9.0))
+        self.assertEqual(asyncio.run(self.writer.flush()), 1)
+
+    def test_gives_up_after_repeated_failures(self):
+        self.writer.submit(_quote("WBTEST1", 11.0))
+        with patch.object(qw, "_db_upsert_stock_prices", side_effect=RuntimeError("db down")):
+            for _ in range(qw._MAX_ATTEMPTS):
+                asyncio.run(self.writer.flush())
+        stats = self.writer.stats()
+        self.assertEqual((stats["pending"], stats["dropped"]), (0, 1))
+
+    def test_min_write_interval_per_ticker(self):
+        self.writer.submit(_quote("WBTEST1", 11.0))
+        self.assertEqual(asyncio.run(self.writer.flush()), 1)
+        self.writer.submit(_quote("WBTEST1", 12.0))
+        self.writer.submit(_quote("WBTEST2", 9.0))
+        # WBTEST1 剛寫過，這次只寫 WBTEST2；WBTEST1 的最新報價留著等間隔到
+        self.assertEqual(asyncio.run(self.writer.flush()), 1)
+        self.assertEqual(self.writer.stats()["pending"], 1)
+        with patch.object(qw, "_MIN_WRITE_SECONDS", 0):
+            self.assertEqual(asyncio.run(self.writer.flush()), 1)
+        rows = _query("SELECT price FROM stock_prices WHERE ticker = 'WBTEST1'")
+        self.assertEqual(float(rows[0][0]), 12.0)
+
+    def test_stop_drains(self):
+        async def scenario():
+            self.writer.start()
+            self.writer.submit(_quote("WBTEST2", 7.0))
+            await self.writer.flush()
+            # 還沒到最短間隔的報價，關閉時也要寫進去
+            self.writer.submit(_quote("WBTEST2", 8.0))
+            await self.writer.stop()
+
+        asyncio.run(scenario())
+        rows = _query("SELECT price FROM stock_prices WHERE ticker = 'WBTEST2'")
+        self.assertEqual(float(rows[0][0]), 8.0)
+
+    def test_missing_tick_partition_created_and_retried(self):
+        ensure_quote_ticks()
+        # 遠在預建範圍之外的日子：分區一定還不存在
+        fetched_at = datetime.now(timezone.utc) + timedelta(days=40)
+        day = quote_ticks.partition_day(fetched_at)
+        partition = quote_ticks._partition_name(day)
+        drop = f"DROP TABLE IF EXISTS {partition}; SELECT 1"
+        _query(drop)
+        self.addCleanup(_query, drop)
+        calls = []
+
+        def _insert(rows):
+            calls.append(len(rows))
+            quote_ticks._db_insert_ticks(rows)
+
+        for ticker in TICKERS:
+            self.writer._ticks[ticker] = (_quote(ticker, 11.0), fetched_at)
+        with patch.object(qw, "_db_insert_ticks", _insert):
+            asyncio.run(self.writer.flush())
+        # 第一次整批失敗、補建分區後整批重試成功，沒有逐列寫
+        self.assertEqual(calls, [2, 2])
+        self.assertEqual(self.writer.stats()["ticks_written"], 2)
+        self.assertEqual(self.writer.stats()["tick_failures"], 0)
+        rows = _query(f"SELECT ticker FROM {partition} ORDER BY ticker")
+        self.assertEqual([r[0] for r in rows], list(TICKERS))
+
+
+if __name__ == "__main__":
+    unittest.main()
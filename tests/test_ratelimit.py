@@ -0,0 +1,65 @@
+"""Token bucket 限流測試。"""
+import asyncio
+import time
+import unittest
+
+from app.core.ratelimit import TokenBucket
+
+
+class TestTokenBucket(unittest.TestCase):
+    def test_burst_then_rate(self):
+        """容量內立即通過，超出後依速率放行。"""
+        bucket = TokenBucket("test_burst", rate=20, capacity=5)
+
+        async def scenario():
+            start = time.monotonic()
+            await asyncio.gather(*(bucket.acquire() for _ in range(10)))
+            return time.monotonic() - start
+
+        elapsed = asyncio.run(scenario())
+        # 前 5 個用掉容量，其餘 5 個以每秒 20 個補充：約 0.25 秒
+        self.assertGreaterEqual(elapsed, 0.2)
+        self.assertLess(elapsed, 0.6)
+        self.assertEqual(bucket.stats()["acquired"], 10)
+
+    def test_multi_token_acquire(self):
+        bucket = TokenBucket("test_multi", rate=10, capacity=2)
+
+        async def scenario():
+            await bucket.acquire(2)
+            start = time.monotonic()
+            await bucket.acquire(2)
+            return time.monotonic() - start
+
+        self.assertGreaterEqual(asyncio.run(scenario()), 0.15)
+
+    def test_timeout_gives_up_without_taking(self):
+        bucket = TokenBucket("test_timeout", rate=1, capacity=1)
+
+        async def scenario():
+            first = await bucket.acquire(timeout=0)
+            start = time.monotonic()
+            second = await bucket.acquire(timeout=0.1)  # 要等約 1 秒才補滿：直接放棄
+            return first, second, time.monotonic() - start
+
+        first, second, elapsed = asyncio.run(scenario())
+        self.assertEqual((first, second), (True, False))
+        self.assertLess(elapsed, 0.05)
+        self.assertEqual((bucket.stats()["acquired"], bucket.stats()["rejected"]), (1, 1))
+
+    def test_timeout_counts_queueing(self):
+        bucket = TokenBucket("test_queue", rate=5, capacity=1)
+
+        async def scenario():
+            await bucket.acquire()
+            waiting = asyncio.ensure_future(bucket.acquire())  # 排在前面、持有鎖約 0.2 秒
+            await asyncio.sleep(0)
+            late = await bucket.acquire(timeout=0.05)
+            await waiting
+            return late
+
+        self.assertFalse(asyncio.run(scenario()))
+
+
+if __name__ == "__main__":
+    unittest.main()
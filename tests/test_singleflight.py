@@ -0,0 +1,111 @@
+"""SingleFlight 單元測試：不需資料庫與網路。"""
+import asyncio
+import unittest
+
+from app.core.singleflight import SingleFlight
+
+
+class TestSingleFlight(unittest.TestCase):
+    def test_concurrent_calls_share_one_upstream_call(self):
+        flight = SingleFlight("test-do")
+        calls = []
+
+        async def fetch():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return "value"
+
+        async def main():
+            tasks = [asyncio.create_task(flight.do("AAPL", fetch)) for _ in range(30)]
+            await asyncio.sleep(0)
+            self.assertIn("AAPL", flight)
+            return await asyncio.gather(*tasks)
+
+        results = asyncio.run(main())
+        self.assertNotIn("AAPL", flight)
+        self.assertEqual(results, ["value"] * 30)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(flight.stats(), {"in_flight": 0, "misses": 1, "coalesced": 29})
+
+    def test_exception_propagates_to_waiters(self):
+        flight = SingleFlight("test-error")
+
+        async def fetch():
+            await asyncio.sleep(0.01)
+            raise RuntimeError("限流")
+
+        async def main():
+            return await asyncio.gather(
+                *(flight.do("AAPL", fetch) for _ in range(3)), return_exceptions=True
+            )
+
+        results = asyncio.run(main())
+        self.assertTrue(all(isinstance(r, RuntimeError) for r in results))
+        self.assertEqual(flight.stats()["in_flight"], 0)
+
+    def test_do_many_only_fetches_keys_not_in_flight(self):
+        flight = SingleFlight("test-many")
+        batches = []
+
+        async def fetch(keys):
+            batches.append(sorted(keys))
+            await asyncio.sleep(0.01)
+            return {k: k.lower() for k in keys}
+
+        async def main():
+            return await asyncio.gather(
+                flight.do_many(["AAPL", "MSFT"], fetch),
+                flight.do_many(["MSFT", "NVDA"], fetch),
+            )
+
+        first, second = asyncio.run(main())
+        self.assertEqual(first, {"AAPL": "aapl", "MSFT": "msft"})
+        self.assertEqual(second, {"MSFT": "msft", "NVDA": "nvda"})
+        self.assertEqual(batches, [["AAPL", "MSFT"], ["NVDA"]])
+        self.assertEqual(flight.stats()["coalesced"], 1)
+
+
+    def test_cancelled_owner_does_not_fail_waiters(self):
+        """發起者被取消（例如 SSE 斷線）時，請求照樣跑完，等待者拿到結果。"""
+        flight = SingleFlight("test-cancel")
+        calls = []
+
+        async def fetch():
+            calls.append(1)
+            await asyncio.sleep(0.02)
+            return "value"
+
+        async def main():
+            owner = asyncio.create_task(flight.do("AAPL", fetch))
+            await asyncio.sleep(0)
+            waiter = asyncio.create_task(flight.do("AAPL", fetch))
+            await asyncio.sleep(0)
+            owner.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await owner
+            return await waiter
+
+        self.assertEqual(asyncio.run(main()), "value")
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(flight.stats()["in_flight"], 0)
+
+    def test_cancelled_batch_owner_does_not_fail_waiters(self):
+        flight = SingleFlight("test-cancel-many")
+
+        async def fetch(keys):
+            await asyncio.sleep(0.02)
+            return {k: k.lower() for k in keys}
+
+        async def main():
+            owner = asyncio.create_task(flight.do_many(["AAPL", "MSFT"], fetch))
+            await asyncio.sleep(0)
+            waiter = asyncio.create_task(flight.do_many(["MSFT"], fetch))
+            await asyncio.sleep(0)
+            owner.cancel()
+            return await waiter
+
+        self.assertEqual(asyncio.run(main()), {"MSFT": "msft"})
+
+
+if __name__ == "__main__":
+    unittest.main()
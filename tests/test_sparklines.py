@@ -0,0 +1,142 @@
+"""sparkline 測試：從與走勢圖共用的日 K 序列切出近一個月收盤價，只快取成功結果；
+批次版一次 yf.download 同步所有過期序列。bar 來源、資料庫與 yf.download 皆以 patch 取代。"""
+import asyncio
+import unittest
+from unittest.mock import patch
+
+import pandas as pd
+
+from app.api import bar_store, stock
+
+
+def _bars(days=60):
+    idx = pd.date_range(end=pd.Timestamp.now().normalize(), periods=days, freq="D")
+    close = [100.0 + d for d in range(days)]
+    return pd.DataFrame({"Open": close, "High": close, "Low": close, "Close": close, "Volume": 1000}, index=idx)
+
+
+class TestSparkline(unittest.TestCase):
+    def setUp(self):
+        stock.sparkline_cache.clear()
+        self.loads = []
+
+    tearDown = setUp
+
+    def _run(self, tickers, bars):
+        async def _load_bars(ticker_yf, interval):
+            self.loads.append((ticker_yf, interval))
+            await asyncio.sleep(0.01)
+            return bars
+
+        async def scenario():
+            with patch.object(stock, "_load_bars", _load_bars):
+                return await asyncio.gather(*(stock._sparkline_for(t) for t in tickers))
+
+        return asyncio.run(scenario())
+
+    def test_sliced_from_daily_bars(self):
+        (data,) = self._run(["00700.HK"], _bars())
+        # 港股代號先正規化成 yfinance 格式；與 1m/3m 走勢同一條日 K
+        self.assertEqual(self.loads, [("0700.HK", "1d")])
+        self.assertLessEqual(len(data["points"]), 30)
+        self.assertEqual(data["points"][-1], 159.0)
+        self.assertEqual(stock.sparkline_cache.get("00700.HK"), data)
+
+    def test_concurrent_requests_load_once(self):
+        results = self._run(["AAPL"] * 5, _bars())
+        self.assertEqual(len(self.loads), 1)
+        self.assertTrue(all(r == results[0] for r in results))
+
+    def test_empty_not_cached(self):
+        (data,) = self._run(["NOPE"], _bars().iloc[0:0])
+        self.assertEqual(data, {"ticker": "NOPE", "points": []})
+        self.assertIsNone(stock.sparkline_cache.get("NOPE"))
+
+
+def _frame(symbols, days=60):
+    idx = pd.date_range(end=pd.Timestamp.now().normalize(), periods=days, freq="D")
+    columns = pd.MultiIndex.from_product([symbols, ["Open", "High", "Low", "Close", "Volume"]])
+    frame = pd.DataFrame(index=idx, columns=columns, dtype=float)
+    for i, symbol in enumerate(symbols):
+        for field in ("Open", "High", "Low", "Close"):
+            frame[(symbol, field)] = [100.0 * (i + 1) + d for d in range(days)]
+        frame[(symbol, "Volume")] = 1000.0
+    return frame
+
+
+class TestBulkSparklines(unittest.TestCase):
+    """本地序列以 dict 取代 price_bars；fresh 內的代號視為剛同步過。"""
+
+    def setUp(self):
+        stock.sparkline_cache.clear()
+        self.store = {}
+        self.fresh = set()
+        self.writes = []
+
+        def _state(ticker, interval):
+            if ticker not in self.store:
+                return None
+            age = 0.0 if ticker in self.fresh else 86400.0
+            tail = [(ts, close) for ts, close in self.store[ticker]["Close"].tail(2).items()]
+            return bar_store.BACKFILL_PERIODS[interval], age, tail
+
+        def _write(ticker, interval, period, bars, replace):
+            self.writes.append((ticker, interval, period, replace))
+            self.store[ticker] = bars
+
+        patches = [
+            patch.object(bar_store, "_db_series_state", _state),
+            patch.object(bar_store, "_db_write_bars", _write),
+            patch.object(bar_store, "_db_read_bars",
+                         lambda ticker, interval: self.store.get(ticker, bar_store._empty_bars())),
+        ]
+        for p in patches:
+            p.start()
+            self.addCleanup(p.stop)
+        self.addCleanup(stock.sparkline_cache.clear)
+
+    def test_split_per_symbol(self):
+        with patch.object(bar_store.yf, "download", return_value=_frame(["AAPL", "0700.HK"])) as dl:
+            data = bar_store.download_many(["AAPL", "0700.HK", "NOPE"], "1d", "2y")
+        dl.assert_called_once()
+        self.assertEqual(dl.call_args.args[0], ["AAPL", "0700.HK", "NOPE"])
+        self.assertEqual(dl.call_args.kwargs["group_by"], "ticker")
+        self.assertEqual(set(data), {"AAPL", "0700.HK"})
+        self.assertEqual(data["AAPL"]["Close"].iloc[-1], 159.0)
+        self.assertEqual(data["0700.HK"]["Close"].iloc[0], 200.0)
+
+    def test_one_download_for_all_misses_written_to_bar_store(self):
+        # MSFT 本地序列剛同步過：不再下載，直接從本地切
+        self.store["MSFT"] = _bars()
+        self.fresh.add("MSFT")
+        with patch.object(bar_store.yf, "download", return_value=_frame(["AAPL", "0700.HK"])) as dl:
+            data = asyncio.run(stock._sparklines_for(["AAPL", "00700.HK", "MSFT", "NOPE"]))
+        dl.assert_called_once()
+        # 港股代號先正規化成 yfinance 格式，與走勢圖同一條日 K
+        self.assertEqual(dl.call_args.args[0], ["AAPL", "0700.HK", "NOPE"])
+        self.assertEqual(sorted(self.writes), [("0700.HK", "1d", "2y", True), ("AAPL", "1d", "2y", True)])
+        self.assertEqual(data["AAPL"]["points"][-1], 159.0)
+        self.assertEqual(data["00700.HK"]["points"][-1], 259.0)
+        self.assertEqual(data["MSFT"]["points"][-1], 159.0)
+        self.assertEqual(data["NOPE"], {"ticker": "NOPE", "points": []})
+        self.assertEqual(stock.sparkline_cache.get("00700.HK"), data["00700.HK"])
+        self.assertIsNone(stock.sparkline_cache.get("NOPE"))
+
+    def test_cached_skip_download(self):
+        stock.sparkline_cache.set("AAPL", {"ticker": "AAPL", "points": [1.0]})
+        with patch.object(bar_store.yf, "download") as dl:
+            data = asyncio.run(stock._sparklines_for(["AAPL"]))
+        dl.assert_not_called()
+        self.assertEqual(data["AAPL"]["points"], [1.0])
+
+    def test_same_points_as_single_endpoint(self):
+        with patch.object(bar_store.yf, "download", return_value=_frame(["AAPL"])):
+            bulk = asyncio.run(stock._sparklines_for(["AAPL"]))["AAPL"]
+        stock.sparkline_cache.clear()
+        self.fresh.add("AAPL")
+        single = asyncio.run(stock._sparkline_for("AAPL"))
+        self.assertEqual(bulk, single)
+
+
+if __name__ == "__main__":
+    unittest.main()
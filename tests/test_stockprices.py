@@ -0,0 +1,90 @@
+"""POST /stockprices 批次報價測試：依 provider 分組一次取、快取命中不打上游、失敗代號回 error。上游皆以 patch 取代。"""
+import asyncio
+import unittest
+from unittest.mock import patch
+
+from app.api import stock
+
+
+def _quote(ticker, price=10.0):
+    return {
+        "ticker": ticker, "price": price, "prev_close": price - 1, "price_change": 1.0,
+        "price_change_percent": 10.0, "company_name": f"{ticker} Corp", "logo_url": "logo",
+        "market_state": "REGULAR", "extended_price": None, "extended_type": None,
+        "extended_change": None, "extended_change_percent": None,
+    }
+
+
+class TestStockPricesBatch(unittest.TestCase):
+    def setUp(self):
+        self.calls = {"twse": [], "astock": [], "finnhub": [], "yfinance": []}
+        stock.yahoo_cache.clear()
+
+        async def _twse(tickers):
+            self.calls["twse"].append(list(tickers))
+            return {t: _quote(t) for t in tickers if not t.startswith("9999")}
+
+        async def _astock(tickers):
+            self.calls["astock"].append(list(tickers))
+            return {t: _quote(t) for t in tickers}
+
+        async def _finnhub(ticker, api_key):
+            self.calls["finnhub"].append(ticker)
+            return None if ticker == "BADUS" else _quote(ticker)
+
+        def _yf(ticker):
+            self.calls["yfinance"].append(ticker)
+            return _quote(ticker) if ticker == "USDTWD=X" else None
+
+        patches = [
+            patch.object(stock, "fetch_twse_quotes", _twse),
+            patch.object(stock, "fetch_astock_quotes", _astock),
+            patch.object(stock, "fetch_finnhub_quote", _finnhub),
+            patch.object(stock, "_fetch_yf_quote_sync", _yf),
+            patch.object(stock.settings, "FINNHUB_API_KEY", "test-key"),
+            patch.object(stock.quote_writer, "submit", lambda data: None),
+        ]
+        for p in patches:
+            p.start()
+            self.addCleanup(p.stop)
+        self.addCleanup(stock.yahoo_cache.clear)
+
+    def _post(self, tickers):
+        request = stock.StockPricesRequest(tickers=tickers)
+        return asyncio.run(stock.get_stock_prices(request, _="u@example.com"))
+
+    def test_grouped_by_provider_in_one_call(self):
+        tickers = ["2330.TW", "6510.TWO", "0700.HK", "600000.SS", "AAPL", "MSFT", "USDTWD=X"]
+        results = self._post(tickers)
+        self.assertEqual(list(results), tickers)
+        self.assertTrue(all(results[t]["price"] == 10.0 for t in tickers))
+        self.assertEqual(self.calls["twse"], [["2330.TW", "6510.TWO"]])
+        self.assertEqual(self.calls["astock"], [["0700.HK", "600000.SS"]])
+        self.assertEqual(sorted(self.calls["finnhub"]), ["AAPL", "MSFT"])
+        self.assertEqual(self.calls["yfinance"], ["USDTWD=X"])
+
+    def test_cached_quotes_skip_upstream(self):
+        self._post(["2330.TW", "AAPL"])
+        self.calls = {name: [] for name in self.calls}
+        results = self._post(["2330.TW", "AAPL", "MSFT"])
+        self.assertEqual(self.calls["twse"], [])
+        self.assertEqual(self.calls["finnhub"], ["MSFT"])
+        self.assertEqual(set(results), {"2330.TW", "AAPL", "MSFT"})
+
+    def test_failures_reported_per_ticker(self):
+        results = self._post(["2330.TW", "9999.TW", "BADUS"])
+        self.assertEqual(results["2330.TW"]["price"], 10.0)
+        # provider 取不到時 fallback 到 yfinance，仍取不到就回 error
+        self.assertEqual(sorted(self.calls["yfinance"]), ["9999.TW", "BADUS"])
+        for ticker in ("9999.TW", "BADUS"):
+            self.assertEqual(results[ticker], {"error": "無法獲取股票資訊", "ticker": ticker})
+
+    def test_duplicates_and_blank_dropped_and_capped(self):
+        results = self._post(["AAPL", "", "AAPL"] + [f"T{i}.TW" for i in range(stock.MAX_BATCH_TICKERS + 10)])
+        self.assertEqual(len(results), stock.MAX_BATCH_TICKERS)
+        self.assertEqual(self.calls["finnhub"], ["AAPL"])
+        self.assertEqual(len(self.calls["twse"][0]), stock.MAX_BATCH_TICKERS - 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
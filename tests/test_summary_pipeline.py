@@ -0,0 +1,103 @@
+"""摘要批次刷新管線測試：並行上限、重試與報告。上游與資料庫皆以 patch 取代。"""
+import asyncio
+import unittest
+from unittest.mock import patch
+
+from app.api import stock, summary_pipeline
+from app.core.ratelimit import TokenBucket
+
+
+class TestSummaryPipeline(unittest.TestCase):
+    def setUp(self):
+        self.in_flight = 0
+        self.peak = 0
+        self.saved = []
+        self.calls = {}
+        patches = [
+            patch.object(summary_pipeline, "_BACKOFF_BASE_SECONDS", 0.01),
+            patch.object(summary_pipeline, "LLM_CONCURRENCY", 2),
+            patch.dict(summary_pipeline._BUCKETS,
+                       {name: TokenBucket(f"test_{name}", rate=1000) for name in summary_pipeline._BUCKETS}),
+            patch.object(stock, "collect_summary_context", self._context),
+            patch.object(stock, "_call_deepseek_summary", self._llm),
+            patch.object(stock, "_db_upsert_summary", lambda t, s, h: self.saved.append(t)),
+            patch.object(stock, "reuse_unchanged_summary", self._reuse),
+        ]
+        for p in patches:
+            p.start()
+            self.addCleanup(p.stop)
+
+    async def _context(self, ticker):
+        self.calls[f"context {ticker}"] = self.calls.get(f"context {ticker}", 0) + 1
+        if ticker == "NODATA":
+            raise stock.SummaryContextUnavailable(f"{ticker} 取不到新聞與財報資料")
+        return f"context {ticker}"
+
+    async def _reuse(self, ticker, fingerprint):
+        return "old summary" if ticker == "QUIET" else None
+
+    async def _llm(self, ticker, context_text, *, is_fx=False):
+        self.calls[ticker] = self.calls.get(ticker, 0) + 1
+        self.in_flight += 1
+        self.peak = max(self.peak, self.in_flight)
+        await asyncio.sleep(0.01)
+        self.in_flight -= 1
+        if ticker == "FLAKY" and self.calls[ticker] < 2:
+            return ""  # 第一次回空：應重試
+        if ticker == "BROKEN":
+            raise RuntimeError("upstream down")
+        return f"summary {ticker}"
+
+    def test_concurrency_retry_and_report(self):
+        tickers = [f"T{i}" for i in range(6)] + ["FLAKY", "BROKEN", "QUIET"]
+        report = asyncio.run(summary_pipeline.refresh_summaries(tickers))
+
+        self.assertLessEqual(self.peak, 2)
+        self.assertEqual(self.calls["FLAKY"], 2)
+        self.assertEqual(self.calls["BROKEN"], summary_pipeline.MAX_ATTEMPTS)
+        self.assertNotIn("QUIET", self.calls)  # 輸入沒變：不呼叫 LLM
+        self.assertEqual(set(self.saved), set(tickers) - {"BROKEN", "QUIET"})
+        self.assertEqual(report["total"], 9)
+        self.assertEqual(report["succeeded"], 8)
+        self.assertEqual(report["unchanged"], 1)
+        self.assertEqual(list(report["failed_tickers"]), ["BROKEN"])
+        # FLAKY 重試 1 次，BROKEN 重試到上限
+        self.assertEqual(report["retries"], 1 + summary_pipeline.MAX_ATTEMPTS - 1)
+        self.assertIsNotNone(report["llm_latency"]["p95"])
+        self.assertIs(summary_pipeline.last_report, report)
+
+    def test_missing_context_retried_then_keeps_existing_summary(self):
+        report = asyncio.run(summary_pipeline.refresh_summaries(["NODATA", "T0"]))
+        self.assertEqual(self.calls["context NODATA"], summary_pipeline.MAX_ATTEMPTS)
+        self.assertNotIn("NODATA", self.calls)  # 沒有資料：不呼叫 LLM
+        self.assertEqual(self.saved, ["T0"])  # 也不覆寫既有摘要
+        self.assertEqual((report["succeeded"], report["skipped"], report["failed"]), (1, 1, 0))
+
+    def test_shares_generation_with_endpoint(self):
+        async def scenario():
+            return await asyncio.gather(
+                summary_pipeline.refresh_summaries(["T0"]),
+                stock.summary_flight.do("T0", lambda: stock.generate_stock_summary("T0")),
+            )
+
+        report, summary = asyncio.run(scenario())
+        self.assertEqual(self.calls["T0"], 1)
+        self.assertEqual(self.saved, ["T0"])
+        self.assertEqual(summary, "summary T0")
+        self.assertEqual(report["succeeded"], 1)
+
+
+class TestContextFingerprint(unittest.TestCase):
+    def test_normalization(self):
+        a = stock._context_fingerprint("AAPL", "近期新聞標題：\n- A  headline\n- B headline")
+        b = stock._context_fingerprint("AAPL", "近期新聞標題：\n- B headline\n\n- A headline  ")
+        self.assertEqual(a, b)
+
+    def test_content_and_ticker_matter(self):
+        base = stock._context_fingerprint("AAPL", "- A headline")
+        self.assertNotEqual(base, stock._context_fingerprint("AAPL", "- C headline"))
+        self.assertNotEqual(base, stock._context_fingerprint("MSFT", "- A headline"))
+
+
+if __name__ == "__main__":
+    unittest.main()
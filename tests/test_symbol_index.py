@@ -0,0 +1,119 @@
+"""本地代號索引測試：不需資料庫與網路。"""
+import asyncio
+import time
+import unittest
+from unittest.mock import patch
+
+from app.api import stock
+from app.api.symbol_index import SymbolIndex
+
+
+def _entry(symbol, name, exchange=""):
+    return {"symbol": symbol, "name": name, "exchange": exchange, "display": f"{symbol} - {name}"}
+
+
+class TestSymbolIndex(unittest.TestCase):
+    def setUp(self):
+        self.index = SymbolIndex()
+        self.index.add(_entry("USDTWD=X", "USD/TWD 美元/新台幣", "FX"))
+        self.index.add(_entry("EURUSD=X", "EUR/USD 歐元/美元", "FX"))
+        self.index.add(_entry("2330.TW", "TAIWAN SEMICONDUCTOR MANUFACTURING"), aliases=("台積電",))
+        self.index.add(_entry("AAPL", "Apple Inc."))
+        self.index.add(_entry("APP", "AppLovin Corp"))
+
+    def _symbols(self, query):
+        return [r["symbol"] for r in self.index.search(query)]
+
+    def test_exact_symbol_first(self):
+        self.assertEqual(self._symbols("app")[0], "APP")
+        self.assertEqual(self._symbols("2330"), ["2330.TW"])
+
+    def test_forex_forms(self):
+        for query in ("USD/TWD", "usdtwd", "usdtwd=x"):
+            self.assertEqual(self._symbols(query)[0], "USDTWD=X")
+
+    def test_chinese_names(self):
+        self.assertEqual(self._symbols("台積"), ["2330.TW"])
+        self.assertEqual(self._symbols("積電"), ["2330.TW"])
+        self.assertEqual(set(self._symbols("美元")), {"USDTWD=X", "EURUSD=X"})
+
+    def test_name_prefix_and_fuzzy(self):
+        self.assertEqual(self._symbols("taiwan semi"), ["2330.TW"])
+        self.assertIn("AAPL", self._symbols("aple"))
+        self.assertEqual(self._symbols("zzzz"), [])
+
+    def test_aliases_merge_without_duplicates(self):
+        self.index.add(_entry("2330.TW", "台積電"))
+        self.assertEqual(len(self.index), 5)
+        self.assertEqual(self.index.search("2330")[0]["name"], "TAIWAN SEMICONDUCTOR MANUFACTURING")
+
+    def test_fast(self):
+        for i in range(5000):
+            self.index.add(_entry(f"T{i:04d}.TW", f"Company {i} 公司{i}"))
+        start = time.perf_counter()
+        for query in ("T12", "company 42", "公司", "台積", "USD"):
+            self.index.search(query)
+        self.assertLess((time.perf_counter() - start) / 5, 0.005)
+
+
+class TestSymbolIndexBound(unittest.TestCase):
+    def setUp(self):
+        self.index = SymbolIndex(max_learned=3)
+        self.index.add(_entry("USDTWD=X", "USD/TWD 美元/新台幣", "FX"), pinned=True)
+
+    def test_learned_symbols_capped_lru(self):
+        for i in range(5):
+            self.index.add(_entry(f"ZZ{i}", f"Learned Corp {i}"))
+            if i == 2:
+                self.index.add(_entry("ZZ0", "Learned Corp 0"))  # 再出現一次，變成最近使用
+        self.assertEqual(len(self.index), 4)
+        self.assertEqual(self.index.stats()["evictions"], 2)
+        remaining = {r["symbol"] for r in self.index.search("learned")}
+        self.assertEqual(remaining, {"ZZ0", "ZZ3", "ZZ4"})
+        # 被淘汰的代號從前綴與倒排索引都清乾淨
+        self.assertNotIn("ZZ1", [r["symbol"] for r in self.index.search("ZZ1")])
+        self.assertFalse(any(symbol == "ZZ1" for _, symbol in self.index._keys))
+        self.assertFalse(any("ZZ1" in symbols for symbols in self.index._postings.values()))
+
+    def test_pinned_never_evicted(self):
+        for i in range(10):
+            self.index.add(_entry(f"ZZ{i}", f"Learned Corp {i}"))
+        self.assertEqual(self.index.search("usdtwd")[0]["symbol"], "USDTWD=X")
+        self.index.add(_entry("ZZ9", "Learned Corp 9"), pinned=True)
+        for i in range(10, 20):
+            self.index.add(_entry(f"ZZ{i}", f"Learned Corp {i}"))
+        self.assertIn("ZZ9", self.index)
+        self.assertEqual(len(self.index), 2 + 3)
+
+    def test_names_per_symbol_capped(self):
+        for i in range(100):
+            self.index.add(_entry("ZZA", f"Name{i}"))
+        self.assertLessEqual(len(self.index._symbol_keys["ZZA"]), 40)
+
+
+class TestAutocomplete(unittest.TestCase):
+    def setUp(self):
+        stock.autocomplete_cache.clear()
+
+    def test_local_hits_skip_yahoo(self):
+        with patch.object(stock.yq, "search") as search:
+            results = asyncio.run(stock.autocomplete("美元", _="u@example.com"))
+        search.assert_not_called()
+        self.assertTrue(all(r["exchange"] == "FX" for r in results))
+        self.assertGreaterEqual(len(results), stock._LOCAL_ENOUGH)
+
+    def test_thin_results_fall_back_and_are_cached(self):
+        reply = {"quotes": [{"quoteType": "EQUITY", "symbol": "ZZTEST", "shortname": "Zz Test Corp",
+                             "exchange": "NMS"}]}
+        with patch.object(stock.yq, "search", return_value=reply) as search:
+            first = asyncio.run(stock.autocomplete("zztes", _="u@example.com"))
+            second = asyncio.run(stock.autocomplete("zztes", _="u@example.com"))
+        self.assertEqual(search.call_count, 1)
+        self.assertEqual(first, second)
+        self.assertEqual(first[0]["display"], "ZZTEST - Zz Test Corp (NASDAQ)")
+        # 之後本地就找得到
+        self.assertIn("ZZTEST", [r["symbol"] for r in stock.symbol_index.search("zz test")])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,89 @@
+"""TWSE 批次報價測試：依 URL 編碼後長度分批、大小寫不同的同一代號各自回傳。以假 session 取代上游。"""
+import asyncio
+import unittest
+from unittest.mock import patch
+
+from yarl import URL
+
+from app.api.providers import twse
+
+
+class _FakeResponse:
+    status = 200
+
+    def __init__(self, payload):
+        self._payload = payload
+
+    async def json(self, content_type=None):
+        return self._payload
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+class _FakeTwse:
+    """依請求的 ex_ch 回 msgArray；記下每次請求的 ex_ch 與實際 query string。"""
+
+    def __init__(self, missing=()):
+        self.requests = []
+        self.query_strings = []
+        self.missing = set(missing)
+
+    def get(self, url, params=None, **kwargs):
+        self.requests.append(params["ex_ch"].split("|"))
+        self.query_strings.append(URL(url).with_query(params).raw_query_string)
+        rows = []
+        for ex_ch in params["ex_ch"].split("|"):
+            ex, rest = ex_ch.split("_", 1)
+            code = rest[: -len(".tw")]
+            if code in self.missing:
+                continue
+            rows.append({"ex": ex, "c": code, "n": f"公司{code}", "z": "101.5", "y": "100"})
+        return _FakeResponse({"rtcode": "0000", "msgArray": rows})
+
+
+class TestTwseBatch(unittest.TestCase):
+    def _fetch(self, tickers, fake):
+        with patch.object(twse, "get_session", lambda name: fake):
+            return asyncio.run(twse.fetch_twse_quotes(tickers))
+
+    def test_chunks_respect_encoded_length(self):
+        tickers = [f"{1000 + i}.TW" for i in range(300)] + [f"{6000 + i}.TWO" for i in range(100)]
+        fake = _FakeTwse()
+        results = self._fetch(tickers, fake)
+        self.assertEqual(set(results), set(tickers))
+        self.assertGreater(len(fake.requests), 1)
+        for query in fake.query_strings:
+            ex_ch = query.split("&")[0][len("ex_ch="):]
+            self.assertIn("%7C", ex_ch)
+            self.assertLessEqual(len(ex_ch), twse._MAX_EX_CH_LEN)
+        # 每支只查一次
+        self.assertEqual(sum(len(r) for r in fake.requests), len(tickers))
+
+    def test_chunk_boundary_counts_separator_as_three_chars(self):
+        # 11 字元的 ex_ch：未編碼時 125 支剛好 1499 字元，編碼後 "|" 變 %7C 就超過上限
+        ex_chs = [f"tse_{1000 + i}.tw" for i in range(125)]
+        self.assertEqual(len("|".join(ex_chs)), 1499)
+        chunks = twse._chunk_ex_ch(ex_chs)
+        self.assertEqual(len(chunks), 2)
+        self.assertEqual(sum(len(c) for c in chunks), 125)
+
+    def test_duplicate_case_tickers_each_returned(self):
+        fake = _FakeTwse()
+        results = self._fetch(["2330.TW", "2330.tw", "6510.TWO"], fake)
+        self.assertEqual(fake.requests, [["tse_2330.tw", "otc_6510.tw"]])
+        self.assertEqual(set(results), {"2330.TW", "2330.tw", "6510.TWO"})
+        self.assertEqual(results["2330.tw"]["ticker"], "2330.tw")
+        self.assertEqual(results["2330.TW"]["price"], 101.5)
+
+    def test_missing_symbol_left_out(self):
+        fake = _FakeTwse(missing={"9999"})
+        results = self._fetch(["2330.TW", "9999.TW", "AAPL"], fake)
+        self.assertEqual(set(results), {"2330.TW"})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,110 @@
+"""啟動預熱測試：資料庫與上游都以 mock 取代。"""
+import asyncio
+import unittest
+from unittest.mock import AsyncMock, patch
+
+from fastapi.testclient import TestClient
+
+import main
+from app.api import stock, warmup as warmup_module
+from app.api.warmup import Warmup, preload_stale_quotes
+
+
+def _stored(ticker, price):
+    return {"ticker": ticker, "price": price, "stale": True, "as_of": "2026-10-16T20:00:00+00:00",
+            "market_state": "CLOSED"}
+
+
+class TestPreload(unittest.TestCase):
+    def setUp(self):
+        stock.yahoo_cache.clear()
+
+    tearDown = setUp
+
+    def test_stale_quotes_fill_empty_slots_only(self):
+        stock.yahoo_cache.set("AAPL", {"ticker": "AAPL", "price": 230.0, "market_state": "REGULAR"})
+        rows = [_stored("AAPL", 200.0), _stored("2330.TW", 1000.0), _stored("NOPX", None)]
+        with patch.object(warmup_module, "_db_stored_quotes", return_value=rows):
+            self.assertEqual(preload_stale_quotes(), 1)
+        self.assertNotIn("stale", stock.yahoo_cache.get("AAPL"))
+        self.assertTrue(stock.yahoo_cache.get("2330.TW")["stale"])
+        self.assertIsNone(stock.yahoo_cache.get("NOPX"))
+        self.assertLessEqual(stock.yahoo_cache.ttl_remaining("2330.TW"), warmup_module._STALE_QUOTE_TTL)
+
+
+class TestPrefetch(unittest.TestCase):
+    def setUp(self):
+        stock.yahoo_cache.clear()
+
+    tearDown = setUp
+
+    def test_prefetch_refreshes_stale_and_reports_ready(self):
+        stock.yahoo_cache.set("AAPL", _stored("AAPL", 200.0), ttl=60)
+        stock.yahoo_cache.set("MSFT", {"ticker": "MSFT", "price": 400.0, "market_state": "REGULAR"}, ttl=60)
+        running = 0
+        peak = 0
+
+        async def _history(ticker, range):
+            nonlocal running, peak
+            running += 1
+            peak = max(peak, running)
+            await asyncio.sleep(0.01)
+            running -= 1
+            return {"ticker": ticker, "range": range, "close": [1.0]}
+
+        tickers = ["AAPL", "MSFT"] + [f"T{i}" for i in range(10)]
+        fetch = AsyncMock(side_effect=lambda ts: {t: {"ticker": t} for t in ts})
+        sparklines = AsyncMock(side_effect=lambda ts: {t: {"ticker": t, "points": [1.0]} for t in ts})
+        warm = Warmup()
+        with patch.object(warmup_module, "_db_most_watched", return_value=tickers), \
+                patch.object(stock, "_fetch_quotes", fetch), \
+                patch.object(stock, "_sparklines_for", sparklines), \
+                patch.object(stock, "_history_for", side_effect=_history):
+            asyncio.run(warm._run())
+
+        fetched = fetch.call_args.args[0]
+        self.assertIn("AAPL", fetched)        # stale 的照樣重取
+        self.assertNotIn("MSFT", fetched)     # 已有新報價的不重取
+        sparklines.assert_awaited_once_with(tickers)  # 整批一次，不逐支
+        self.assertLessEqual(peak, warmup_module.HISTORY_CONCURRENCY)
+        self.assertTrue(warm.ready)
+        self.assertEqual((warm.tickers, warm.sparklines, warm.histories), (12, 12, 12))
+
+    def test_timeout_still_becomes_ready(self):
+        async def _slow():
+            await asyncio.sleep(1)
+
+        warm = Warmup()
+        with patch.object(warmup_module, "WARMUP_TIMEOUT_SECONDS", 0.01), \
+                patch.object(warm, "_prefetch", _slow):
+            asyncio.run(warm._run())
+        self.assertTrue(warm.ready)
+        self.assertTrue(warm.timed_out)
+
+
+class TestHealth(unittest.TestCase):
+    def setUp(self):
+        self.client = TestClient(main.app)
+
+    def test_not_ready_while_warming(self):
+        with patch.object(main, "_db_ping"), patch.object(main.warmup, "state", "warming"):
+            response = self.client.get("/health")
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.json()["status"], "warming")
+
+    def test_ready(self):
+        with patch.object(main, "_db_ping"), patch.object(main.warmup, "state", "ready"):
+            response = self.client.get("/health")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["warmup"]["state"], "ready")
+
+    def test_database_down(self):
+        with patch.object(main, "_db_ping", side_effect=RuntimeError("down")), \
+                patch.object(main.warmup, "state", "ready"):
+            response = self.client.get("/health")
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.json()["status"], "degraded")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -284,12 +284,15 @@ class TestAuthRequired(unittest.TestCase):
         for path in ["/watchlists", "/watchlists/1/stocks",
                      "/watchlist/memberships/AAPL", "/stockprice/AAPL",
                      "/autocomplete/apple", "/fundamentals/AAPL",
-                     "/sparkline/AAPL", "/stock/AAPL", "/ai-summary/AAPL"]:
+                     "/sparkline/AAPL", "/stock/AAPL", "/ai-summary/AAPL",
+                     "/metrics", "/stream/quotes?watchlist_id=1",
+                     "/ai-summary/AAPL/stream"]:
             with self.subTest(path=path):
                 self.assertEqual(self.anon.get(path).status_code, 401, f"GET {path} 應回 401")
 
         for method, path in [("post", "/watchlists"), ("put", "/watchlist/memberships"),
-                             ("post", "/watchlists/reorder")]:
+                             ("post", "/watchlists/reorder"), ("post", "/stockprices"),
+                             ("post", "/sparklines")]:
             with self.subTest(path=path):
                 r = getattr(self.anon, method)(path, json={})
                 self.assertEqual(r.status_code, 401, f"{method.upper()} {path} 應回 401")